@@ -1,7 +1,11 @@
 import logging
+from unittest.mock import patch
 
 import pytest
+import fakeredis
 
+from zenslackchat import slack_users
+from zenslackchat.clients import cache
 from zenslackchat.botlogging import log_setup
 
 
@@ -10,3 +14,27 @@ def log():
     """Set up logging as a pytest fixture."""
     log_setup()
     return logging.getLogger('zenslackchat')
+
+
+@pytest.fixture(autouse=True)
+def redis_connection():
+    """Give each test its own empty in-memory Redis instead of a server."""
+    connection = fakeredis.FakeRedis()
+    with patch('zenslackchat.redis_store.connection', return_value=connection):
+        yield connection
+
+
+@pytest.fixture(autouse=True)
+def client_cache():
+    """Don't share cached API clients between tests."""
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def slack_user_cache():
+    """Don't share cached Slack profiles between tests."""
+    slack_users.clear()
+    yield
+    slack_users.clear()
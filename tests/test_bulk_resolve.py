@@ -0,0 +1,191 @@
+from datetime import timedelta
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+from django.contrib.admin.sites import AdminSite
+from zenpy.lib.api_objects import JobStatus
+
+from zenslackchat import tasks
+from zenslackchat import zendesk_api
+from zenslackchat.admin import ZenSlackChatAdmin
+from zenslackchat.admin import TicketCloseJobAdmin
+from zenslackchat.models import utcnow
+from zenslackchat.models import ZenSlackChat
+from zenslackchat.models import TicketCloseJob
+from zenslackchat.tasks import poll_ticket_close_job as poll_task
+
+
+def open_issues(count, **kwargs):
+    for index in range(count):
+        ZenSlackChat.open(
+            'C1', f'1602064330.{index:06d}', ticket_id=str(index + 1), **kwargs
+        )
+
+
+def test_resolve_many_is_one_update(log, db, django_assert_num_queries):
+    """Verify the issues are resolved without a query per issue.
+    """
+    open_issues(250, ticket_status='open')
+    ZenSlackChat.open('C1', '1602064331.000001', ticket_id='900')
+    ZenSlackChat.mirror_ticket('900', 'closed')
+    ZenSlackChat.open('C1', '1602064331.000002', ticket_id='')
+    ZenSlackChat.resolve('C1', ZenSlackChat.open(
+        'C1', '1602064331.000003', ticket_id='901'
+    ).chat_id)
+
+    # A select and an update, plus the savepoint around them:
+    with django_assert_num_queries(4):
+        resolved, ticket_ids = ZenSlackChat.resolve_many(
+            ZenSlackChat.objects.all()
+        )
+
+    # The issue already resolved is left alone:
+    assert resolved == 252
+    # Only tickets which aren't known to be closed need closing:
+    assert sorted(ticket_ids, key=int) == [str(i) for i in range(1, 251)]
+    assert ZenSlackChat.open_issues() == []
+    assert set(ZenSlackChat.objects.values_list('ticket_status', flat=True)) == {
+        'closed'
+    }
+
+
+@patch('zenslackchat.admin.close_zendesk_tickets')
+def test_admin_resolve_and_close_tickets(close_zendesk_tickets, log, db):
+    """Verify the tickets are closed by Zendesk jobs of 100 tickets.
+    """
+    open_issues(250, ticket_status='open')
+    admin = ZenSlackChatAdmin(ZenSlackChat, AdminSite())
+    admin.message_user = MagicMock()
+
+    admin.resolve_and_close_tickets(MagicMock(), ZenSlackChat.objects.all())
+
+    jobs = TicketCloseJob.objects.order_by('pk')
+    assert [job.total for job in jobs] == [100, 100, 50]
+    assert jobs[0].ticket_ids == [str(i) for i in range(1, 101)]
+    assert {job.status for job in jobs} == {TicketCloseJob.PENDING}
+    assert [c[0][0] for c in close_zendesk_tickets.delay.call_args_list] == [
+        job.pk for job in jobs
+    ]
+    assert 'Closing 250 ticket(s) in 3 Zendesk job(s)' in (
+        admin.message_user.call_args[0][1]
+    )
+
+
+def test_close_tickets_sends_one_update_many(log):
+    """Verify only each ticket's status is sent in one request.
+    """
+    client = MagicMock()
+
+    zendesk_api.close_tickets(client, ['1', '2'])
+
+    changes = client.tickets.update.call_args[0][0]
+    assert [change.to_dict(serialize=True) for change in changes] == [
+        {'id': 1, 'status': 'closed'},
+        {'id': 2, 'status': 'closed'},
+    ]
+
+
+@patch('zenslackchat.tasks.poll_ticket_close_job')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_close_and_poll_the_job(ZendeskApp, poll_ticket_close_job, log, db):
+    """Verify the job is followed until Zendesk has finished it.
+    """
+    client = ZendeskApp.client.return_value
+    client.tickets.update.return_value = JobStatus(
+        id='job1', status='queued', progress=0, total=2
+    )
+    job, = TicketCloseJob.for_tickets(['1', '2'], 100)
+
+    tasks.close_zendesk_tickets(job.pk)
+
+    job.refresh_from_db()
+    assert (job.job_id, job.status, job.total) == ('job1', 'queued', 2)
+    poll_ticket_close_job.apply_async.assert_called_once_with(
+        (job.pk,), countdown=2.0
+    )
+
+    # Still working, so it is checked again:
+    poll_ticket_close_job.reset_mock()
+    client.job_status.return_value = JobStatus(
+        id='job1', status='working', progress=1, total=2
+    )
+    poll_task.run(job.pk)
+
+    client.job_status.assert_called_with(id='job1')
+    job.refresh_from_db()
+    assert (job.status, job.progress) == ('working', 1)
+    poll_ticket_close_job.apply_async.assert_called_once()
+
+    # Done. One ticket had already been closed in Zendesk:
+    poll_ticket_close_job.reset_mock()
+    client.job_status.return_value = JobStatus(
+        id='job1', status='completed', progress=2, total=2, results=[
+            {'id': 1, 'action': 'update', 'success': True},
+            {
+                'id': 2, 'error': 'TicketUpdateFailed',
+                'details': 'Status: closed prevents ticket update'
+            },
+        ]
+    )
+    poll_task.run(job.pk)
+
+    job.refresh_from_db()
+    assert (job.status, job.progress) == ('completed', 2)
+    assert job.error == '2: Status: closed prevents ticket update'
+    poll_ticket_close_job.apply_async.assert_not_called()
+
+
+@patch('zenslackchat.tasks.poll_ticket_close_job')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_poll_gives_up_after_an_hour(
+    ZendeskApp, poll_ticket_close_job, log, db
+):
+    """Verify a job Zendesk has forgotten about isn't polled forever.
+    """
+    ZendeskApp.client.return_value.job_status.side_effect = ValueError('gone')
+    job = TicketCloseJob.objects.create(
+        ticket_ids=['1'], job_id='job1', status=TicketCloseJob.QUEUED,
+        created_at=utcnow() - timedelta(hours=2),
+        sent_at=utcnow() - timedelta(hours=2)
+    )
+
+    poll_task.run(job.pk)
+
+    job.refresh_from_db()
+    assert job.status == TicketCloseJob.FAILED
+    poll_ticket_close_job.apply_async.assert_not_called()
+
+
+@patch('zenslackchat.tasks.poll_ticket_close_job')
+@patch('zenslackchat.admin.close_zendesk_tickets')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_retried_old_job_is_given_another_hour(
+    ZendeskApp, close_zendesk_tickets, poll_ticket_close_job, log, db
+):
+    """Verify the hour is timed from when the tickets were last sent.
+    """
+    client = ZendeskApp.client.return_value
+    job = TicketCloseJob.objects.create(
+        ticket_ids=['1'], job_id='job1', status=TicketCloseJob.FAILED,
+        created_at=utcnow() - timedelta(hours=3),
+        sent_at=utcnow() - timedelta(hours=3)
+    )
+    admin = TicketCloseJobAdmin(TicketCloseJob, AdminSite())
+    admin.message_user = MagicMock()
+
+    admin.retry(MagicMock(), TicketCloseJob.objects.all())
+    close_zendesk_tickets.delay.assert_called_once_with(job.pk)
+
+    client.tickets.update.return_value = JobStatus(
+        id='job2', status='queued', progress=0, total=1
+    )
+    tasks.close_zendesk_tickets(job.pk)
+    client.job_status.return_value = JobStatus(
+        id='job2', status='working', progress=0, total=1
+    )
+    poll_task.run(job.pk)
+
+    job.refresh_from_db()
+    assert (job.job_id, job.status) == ('job2', TicketCloseJob.WORKING)
+    assert utcnow() - job.sent_at < timedelta(minutes=1)
+    assert poll_ticket_close_job.apply_async.call_count == 2
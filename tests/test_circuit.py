@@ -0,0 +1,249 @@
+import time
+import threading
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+import pytest
+import aiohttp
+import requests
+from asgiref.sync import async_to_sync
+from zenpy.lib.exception import APIException
+from zenpy.lib.exception import RecordNotFoundException
+
+from zenslackchat import tasks
+from zenslackchat import circuit
+from zenslackchat import metrics
+from zenslackchat import dead_letter
+from zenslackchat import redis_store
+from zenslackchat import zendesk_api
+from zenslackchat.models import FailedEvent
+from zenslackchat.rate_limit import RateLimited
+
+
+SETTINGS = {
+    'CIRCUIT_BREAKER_THRESHOLD': 2,
+    'CIRCUIT_BREAKER_RESET': 30,
+    'CIRCUIT_BREAKER_RETRIES': 2,
+    'CIRCUIT_BREAKER_BACKOFF': 0.5,
+}
+
+
+def api_error(status):
+    return APIException('failed', response=MagicMock(status_code=status))
+
+
+def opened_long_ago():
+    """Move the breaker's opened time back past the reset time."""
+    redis_store.connection().set(
+        circuit.zendesk._key('opened_at'), time.time() - 31
+    )
+
+
+@pytest.fixture
+def breaker_settings():
+    with patch.dict('webapp.settings.__dict__', SETTINGS):
+        yield
+
+
+@patch('zenslackchat.circuit.time.sleep')
+def test_transient_errors_are_retried(sleep, log, breaker_settings):
+    """Verify a blip is retried with a jittered backoff.
+    """
+    client = MagicMock()
+    client.tickets.side_effect = [
+        requests.ConnectionError('reset'), api_error(503), 'the-ticket'
+    ]
+
+    assert zendesk_api.get_ticket(client, '32') == 'the-ticket'
+    assert client.tickets.call_count == 3
+    first, second = [call[0][0] for call in sleep.call_args_list]
+    assert 0 <= first <= 0.5
+    assert 0 <= second <= 1.0
+    assert circuit.zendesk.state() == circuit.CLOSED
+
+
+def test_async_calls_are_retried(log, breaker_settings):
+    """Verify coroutines go through the breaker in the same way.
+    """
+    calls = []
+
+    @circuit.zendesk.protect()
+    async def get():
+        calls.append(1)
+        if len(calls) == 1:
+            raise aiohttp.ServerDisconnectedError()
+        return 'the-ticket'
+
+    with patch.dict('webapp.settings.__dict__', {
+        'CIRCUIT_BREAKER_BACKOFF': 0
+    }):
+        assert async_to_sync(get)() == 'the-ticket'
+
+    assert len(calls) == 2
+    assert metrics.snapshot()['circuit.zendesk.retry'] == 1
+
+
+def test_async_calls_use_redis_off_the_event_loop(log, breaker_settings):
+    """Verify the breaker's Redis calls don't block the event loop.
+    """
+    breaker = circuit.CircuitBreaker('test')
+    redis_threads = []
+    connection = redis_store.connection
+
+    def recorded():
+        redis_threads.append(threading.get_ident())
+        return connection()
+
+    @breaker.protect()
+    async def get():
+        nonlocal loop_thread
+        loop_thread = threading.get_ident()
+        if not redis_threads:
+            raise aiohttp.ServerDisconnectedError()
+        return 'the-ticket'
+
+    loop_thread = None
+    with patch.dict('webapp.settings.__dict__', {
+        'CIRCUIT_BREAKER_BACKOFF': 0
+    }), patch('zenslackchat.redis_store.connection', recorded):
+        assert async_to_sync(get)() == 'the-ticket'
+
+    assert redis_threads
+    assert loop_thread not in redis_threads
+
+
+@patch('zenslackchat.circuit.time.sleep')
+def test_writes_are_not_sent_again_after_a_timeout(
+    sleep, log, breaker_settings
+):
+    """Verify a comment that may have been added isn't added twice.
+    """
+    client = MagicMock()
+    client.tickets.update.side_effect = requests.ReadTimeout('slow')
+
+    with pytest.raises(requests.ReadTimeout):
+        zendesk_api.add_comment(client, MagicMock(), 'hello', author_id=1)
+
+    client.tickets.update.assert_called_once()
+    sleep.assert_not_called()
+
+
+@patch('zenslackchat.circuit.time.sleep')
+def test_breaker_opens_and_fails_fast(sleep, log, breaker_settings):
+    """Verify calls stop once Zendesk is down and start again once it is
+    back.
+    """
+    client = MagicMock()
+    client.tickets.side_effect = api_error(502)
+
+    for _ in range(2):
+        with pytest.raises(APIException):
+            zendesk_api.get_ticket(client, '32')
+    assert client.tickets.call_count == 6
+    assert circuit.zendesk.state() == circuit.OPEN
+
+    # Zendesk isn't asked while open:
+    client.tickets.reset_mock()
+    with pytest.raises(circuit.CircuitOpen) as error:
+        zendesk_api.get_ticket(client, '32')
+    assert error.value.retry_after == 30
+    client.tickets.assert_not_called()
+
+    # Once the reset time has passed one call is let through:
+    opened_long_ago()
+    assert circuit.zendesk.state() == circuit.HALF_OPEN
+
+    client.tickets.side_effect = RecordNotFoundException('not found')
+    assert zendesk_api.get_ticket(client, '32') is None
+
+    assert circuit.zendesk.state() == circuit.CLOSED
+    counts = metrics.snapshot()
+    assert counts['circuit.zendesk.opened'] == 1
+    assert counts['circuit.zendesk.rejected'] == 1
+    assert counts['circuit.zendesk.closed'] == 1
+
+
+def test_only_one_trial_call_while_half_open(log, breaker_settings):
+    circuit.zendesk.failed()
+    circuit.zendesk.failed()
+
+    opened_long_ago()
+    circuit.zendesk.allow()
+    with pytest.raises(circuit.CircuitOpen):
+        circuit.zendesk.allow()
+
+    # The trial failed, open for another 30 seconds:
+    circuit.zendesk.failed()
+    assert circuit.zendesk.state() == circuit.OPEN
+
+
+def test_rate_limited_trial_leaves_the_breaker_half_open(log, breaker_settings):
+    """Verify a call refused by the rate limiter isn't counted either way.
+    """
+    circuit.zendesk.failed()
+    circuit.zendesk.failed()
+    opened_long_ago()
+
+    def refused():
+        raise RateLimited('zendesk', 60)
+
+    with pytest.raises(RateLimited):
+        circuit.zendesk.call(refused)
+
+    assert circuit.zendesk.state() == circuit.HALF_OPEN
+    # Another call can be the trial:
+    circuit.zendesk.allow()
+
+
+@patch('zenslackchat.dead_letter.handle')
+def test_events_kept_while_open_are_replayed_once_closed(
+    handle, log, breaker_settings, transactional_db
+):
+    error = circuit.CircuitOpen('zendesk', 30)
+    dead_letter.record('slack', {'n': 1}, error)
+    dead_letter.record('slack', {'n': 2}, ValueError('a bug'))
+
+    circuit.zendesk.failed()
+    circuit.zendesk.failed()
+    tasks.replay_circuit_failures()
+    handle.assert_not_called()
+
+    circuit.zendesk.succeeded()
+    tasks.replay_circuit_failures()
+    handle.assert_called_once_with('slack', {'n': 1})
+    assert [failed.event for failed in FailedEvent.objects.all()] == [{'n': 2}]
+
+
+@patch('zenslackchat.dead_letter.handle')
+def test_replay_is_the_trial_call_while_half_open(
+    handle, log, breaker_settings, transactional_db
+):
+    """Verify a quiet breaker doesn't stay half open with events kept.
+    """
+    error = circuit.CircuitOpen('zendesk', 30)
+    for n in range(3):
+        dead_letter.record('slack', {'n': n}, error)
+    circuit.zendesk.failed()
+    circuit.zendesk.failed()
+    opened_long_ago()
+
+    # The trial fails, so only the oldest event is tried:
+    def fail(source, event):
+        circuit.zendesk.allow()
+        circuit.zendesk.failed()
+        raise circuit.CircuitOpen('zendesk', 30)
+
+    handle.side_effect = fail
+    tasks.replay_circuit_failures()
+    assert handle.call_count == 1
+    assert FailedEvent.objects.count() == 3
+
+    # Zendesk is back, the trial closes the breaker and the rest follow:
+    opened_long_ago()
+    handle.reset_mock()
+    handle.side_effect = lambda source, event: circuit.zendesk.succeeded()
+    tasks.replay_circuit_failures()
+    assert [c[0][1] for c in handle.call_args_list] == [
+        {'n': 0}, {'n': 1}, {'n': 2}
+    ]
+    assert FailedEvent.objects.count() == 0
@@ -0,0 +1,215 @@
+import json
+import threading
+import itertools
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import redis
+import pytest
+
+from zenslackchat import metrics
+from zenslackchat.clients import cache
+from zenslackchat.clients import ClientCache
+from zenslackchat.clients import PooledAdapter
+from zenslackchat.clients import PooledWebClient
+from zenslackchat.clients import pooled_session
+from zenslackchat.models import SlackApp
+from zenslackchat.models import ZendeskApp
+
+
+def counting_factory():
+    count = itertools.count(1)
+    return lambda: next(count)
+
+
+def test_clients_are_reused_until_invalidated(log):
+    """Verify a client is built once and rebuilt in every process when
+    invalidated.
+    """
+    ours = ClientCache(check_interval=0)
+    theirs = ClientCache(check_interval=0)
+    factory = counting_factory()
+
+    assert ours.get('slack', factory) == 1
+    assert ours.get('slack', factory) == 1
+    assert theirs.get('slack', factory) == 2
+
+    # Only this process:
+    ours.clear('slack')
+    assert ours.get('slack', factory) == 3
+    assert theirs.get('slack', factory) == 2
+
+    # Every process:
+    theirs.invalidate('slack')
+    assert theirs.get('slack', factory) == 4
+    assert ours.get('slack', factory) == 5
+
+
+def test_clients_are_rebuilt_without_redis(log, redis_connection):
+    """Verify a token change can't be missed when Redis is unavailable.
+    """
+    cache = ClientCache(check_interval=60)
+    factory = counting_factory()
+
+    with patch.object(
+        redis_connection, 'get', side_effect=redis.ConnectionError('down')
+    ):
+        assert cache.get('slack', factory) == 1
+        assert cache.get('slack', factory) == 2
+
+
+def test_saving_a_token_rebuilds_the_client(log, db):
+    """Verify the signal handlers drop the cached client.
+    """
+    SlackApp.objects.create(
+        team_name='team', team_id='T1', bot_user_id='U1',
+        bot_access_token='xoxb-old'
+    )
+    client = SlackApp.client()
+    assert client.token == 'xoxb-old'
+    assert SlackApp.client() is client
+
+    SlackApp.objects.create(
+        team_name='team', team_id='T1', bot_user_id='U1',
+        bot_access_token='xoxb-new'
+    )
+    assert SlackApp.client().token == 'xoxb-new'
+
+    ZendeskApp.objects.create(
+        access_token='zendesk-token', token_type='bearer', scope='read'
+    )
+    zendesk = ZendeskApp.client()
+    assert ZendeskApp.client() is zendesk
+    assert zendesk.cache.disabled is True
+
+
+class SlackHandler(BaseHTTPRequestHandler):
+    """Answer every request like the Slack API, remembering what was sent."""
+    protocol_version = 'HTTP/1.1'
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append(dict(
+            path=self.path,
+            headers=dict(self.headers),
+            body=json.loads(body),
+        ))
+        reply = json.dumps({'ok': True, 'ts': '1602064330.001600'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slack_server():
+    SlackHandler.received = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlackHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/api/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_adapter_is_sized_from_settings(log):
+    """Verify the pool sizes are configurable.
+    """
+    with patch.dict('webapp.settings.__dict__', {
+        'HTTP_POOL_CONNECTIONS': 2,
+        'HTTP_POOL_MAXSIZE': 16,
+        'HTTP_POOL_BLOCK': True,
+    }):
+        adapter = PooledAdapter()
+
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 16
+    assert adapter.poolmanager.connection_pool_kw['block'] is True
+    assert adapter.poolmanager.pools._maxsize == 2
+
+    # A retry configuration given is kept:
+    assert PooledAdapter(max_retries=3).max_retries.total == 3
+
+
+def test_zendesk_requests_are_only_retried_by_the_circuit_breaker(log, db):
+    """Verify the Zendesk adapter never sends a request again by itself.
+    """
+    ZendeskApp.objects.create(
+        access_token='zendesk-token', token_type='bearer', scope='read'
+    )
+    with patch.dict('webapp.settings.__dict__', {'ZENDESK_SUBDOMAIN': 'z'}):
+        client = ZendeskApp.new_client()
+
+    retry = client.tickets.session.get_adapter('https://z.zendesk.com').max_retries
+    assert retry.total == 0
+    assert retry.read is False
+
+
+def test_slack_calls_reuse_one_connection(log, slack_server):
+    """Verify API calls go over one kept alive connection and are counted.
+    """
+    adapter = PooledAdapter()
+    client = PooledWebClient(
+        token='xoxb-token', base_url=slack_server,
+        session=pooled_session(adapter)
+    )
+
+    for number in range(3):
+        response = client.chat_postMessage(
+            channel='C0192NP3TFG', text=f'message {number}'
+        )
+        assert response['ts'] == '1602064330.001600'
+
+    received = SlackHandler.received
+    assert [request['body']['text'] for request in received] == [
+        'message 0', 'message 1', 'message 2'
+    ]
+    assert received[0]['path'] == '/api/chat.postMessage'
+    assert received[0]['headers']['Authorization'] == 'Bearer xoxb-token'
+    assert received[0]['headers']['Content-Type'] == 'application/json'
+
+    counts = metrics.snapshot()
+    assert counts['http.127.0.0.1.requests'] == 3
+    assert counts['http.127.0.0.1.connect'] == 1
+    assert 'http.127.0.0.1.pool_full' not in counts
+    assert adapter.in_flight('127.0.0.1') == 0
+
+
+@patch.object(ZendeskApp, 'new_client')
+@patch.object(SlackApp, 'new_client')
+def test_bot_identity_is_found_once_per_token(
+    slack_client, zendesk_client, log, db
+):
+    """Verify Zendesk is only asked who the bot is once per token.
+    """
+    zendesk_client.return_value.users.me.return_value.id = 1234
+    assert ZendeskApp.identity() is None
+
+    app = ZendeskApp.objects.create(
+        access_token='zendesk-token', token_type='bearer', scope='read'
+    )
+    SlackApp.objects.create(
+        team_name='team', team_id='T1', bot_user_id='U01BSHL8UNT',
+        bot_access_token='xoxb-token'
+    )
+    for _ in range(3):
+        assert ZendeskApp.identity() == 1234
+    zendesk_client.return_value.users.me.assert_called_once_with()
+
+    # Stored for the other processes:
+    app.refresh_from_db()
+    assert app.user_id == '1234'
+    cache.clear()
+    assert ZendeskApp.identity() == 1234
+    zendesk_client.return_value.users.me.assert_called_once_with()
+
+    # A new token is asked again:
+    zendesk_client.return_value.users.me.return_value.id = 5678
+    app.access_token = 'new-zendesk-token'
+    app.save()
+    assert ZendeskApp.identity() == 5678
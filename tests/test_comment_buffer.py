@@ -0,0 +1,137 @@
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+import pytest
+from zenpy.lib.exception import APIException
+
+from zenslackchat import tasks
+from zenslackchat import comment_buffer
+from zenslackchat.models import ZenSlackChat
+
+
+def test_burst_of_lines_opens_one_window_and_drains_in_order(log):
+    """Verify only the first line schedules a flush and order is kept.
+    """
+    assert comment_buffer.buffer_comment('77', 'Bob (Slack): one', 5) is True
+    assert comment_buffer.buffer_comment('77', 'Sue (Slack): two', 5) is False
+    assert comment_buffer.buffer_comment('77', 'Bob (Slack): 🔥', 5) is False
+    # other tickets are independent:
+    assert comment_buffer.buffer_comment('78', 'Ann (Slack): hi', 5) is True
+
+    lines = comment_buffer.drain_comments('77')
+    assert lines == [
+        'Bob (Slack): one', 'Sue (Slack): two', 'Bob (Slack): 🔥'
+    ]
+    assert comment_buffer.merge_comments(lines) == (
+        'Bob (Slack): one\n\nSue (Slack): two\n\nBob (Slack): 🔥'
+    )
+
+    # Drained, so the next line opens a new window:
+    assert comment_buffer.drain_comments('77') == []
+    assert comment_buffer.buffer_comment('77', 'Bob (Slack): 4', 5) is True
+
+
+def test_restored_lines_go_back_in_front(log):
+    """Verify lines put back after a failure keep their order.
+    """
+    comment_buffer.buffer_comment('77', 'three', 5)
+    comment_buffer.restore_comments('77', ['one', 'two'])
+    assert comment_buffer.drain_comments('77') == ['one', 'two', 'three']
+
+
+@patch('zenslackchat.tasks.add_comment')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_flush_writes_one_comment(ZendeskApp, add_comment, log):
+    """Verify the flush task merges the burst into one Zendesk update.
+    """
+    zendesk_client = MagicMock()
+    ZendeskApp.client.return_value = zendesk_client
+
+    comment_buffer.buffer_comment('77', 'Bob (Slack): one', 5)
+    comment_buffer.buffer_comment('77', 'Sue (Slack): two', 5)
+
+    tasks.flush_zendesk_comments('77')
+
+    add_comment.assert_called_once_with(
+        zendesk_client, '77', 'Bob (Slack): one\n\nSue (Slack): two',
+        author_id=ZendeskApp.identity()
+    )
+
+    # Nothing left, so a second flush does nothing:
+    add_comment.reset_mock()
+    tasks.flush_zendesk_comments('77')
+    add_comment.assert_not_called()
+
+
+@patch('zenslackchat.tasks.add_comment')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_flush_failure_keeps_the_lines(
+    ZendeskApp, add_comment, log
+):
+    """Verify lines are not lost if Zendesk fails during the flush.
+    """
+    add_comment.side_effect = ValueError('Zendesk is down')
+    comment_buffer.buffer_comment('77', 'Bob (Slack): one', 5)
+
+    with pytest.raises(ValueError):
+        tasks.flush_zendesk_comments('77')
+
+    assert comment_buffer.drain_comments('77') == ['Bob (Slack): one']
+
+
+@patch('zenslackchat.tasks.post_message')
+@patch('zenslackchat.tasks.SlackApp')
+@patch('zenslackchat.tasks.add_comment')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_flush_drops_comments_for_a_closed_ticket(
+    ZendeskApp, add_comment, SlackApp, post_message, log, db
+):
+    """Verify a closed ticket's comments are dropped, not retried, and the
+    thread is told.
+    """
+    ZenSlackChat.open('C1', '1602064330.001600', '77', ticket_status='open')
+    add_comment.side_effect = APIException(
+        'closed', response=MagicMock(
+            status_code=422, text='Status: closed prevents ticket update'
+        )
+    )
+    comment_buffer.buffer_comment('77', 'Bob (Slack): one', 5, thread=dict(
+        channel_id='C1', thread_id='1602064330.001600'
+    ))
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'ZENDESK_TICKET_URI': 'https://z/'}
+    ):
+        tasks.flush_zendesk_comments('77')
+
+    assert comment_buffer.drain_comments('77') == []
+    issue = ZenSlackChat.get('C1', '1602064330.001600')
+    assert issue.ticket_status == 'closed'
+    post_message.assert_called_once_with(
+        SlackApp.client(), '1602064330.001600', 'C1',
+        '🤖 This ticket is closed https://z/77. Please raise a new support '
+        'issue.'
+    )
+
+
+@patch('zenslackchat.tasks.flush_zendesk_comments')
+def test_debounce_schedules_a_flush_per_window(flush, log):
+    """Verify a flush is scheduled on the thread's queue once per window.
+    """
+    with patch.dict(
+        'webapp.settings.__dict__', {'ZENDESK_COMMENT_DEBOUNCE': 10}
+    ):
+        assert tasks.debounce_comment(
+            '77', '1602064330.001600', 'a', channel_id='C1'
+        ) is True
+        assert tasks.debounce_comment(
+            '77', '1602064330.001600', 'b', channel_id='C1'
+        ) is True
+
+    flush.apply_async.assert_called_once_with(
+        ('77',), countdown=10, queue='zenslackchat.events.0'
+    )
+    # Kept so the flush can reply in the thread:
+    assert comment_buffer.comment_thread('77') == dict(
+        channel_id='C1', thread_id='1602064330.001600'
+    )
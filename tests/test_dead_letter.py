@@ -0,0 +1,179 @@
+import time
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+import pytest
+from django.core.management import call_command
+
+from zenslackchat import tasks
+from zenslackchat import eventsview
+from zenslackchat import dead_letter
+from zenslackchat import comment_buffer
+from zenslackchat import zendesk_webhooks
+from zenslackchat.models import FailedEvent
+
+
+EVENT = {
+    'channel': 'C0192NP3TFG',
+    'text': 'My machine is on fire',
+    'ts': '1602064330.001600',
+    'type': 'message',
+    'user': 'UGF7MRWMS'
+}
+
+
+@patch('zenslackchat.eventsview.handler')
+def test_failed_slack_event_is_kept_and_replayed(handler, log, db):
+    """Verify the event is stored on failure and removed once replayed.
+    """
+    handler.side_effect = ValueError('Zendesk is down')
+    eventsview.process_event(EVENT)
+
+    failed = FailedEvent.objects.get()
+    assert failed.source == 'slack'
+    assert failed.event == EVENT
+    assert failed.attempts == 1
+    assert 'Zendesk is down' in failed.error
+
+    # Still down:
+    assert isinstance(dead_letter.replay(failed), ValueError)
+    failed.refresh_from_db()
+    assert failed.attempts == 2
+
+    # Back again:
+    handler.side_effect = None
+    assert dead_letter.replay(failed) is None
+    assert FailedEvent.objects.count() == 0
+    assert handler.call_args[0][0] == EVENT
+
+
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+@patch('zenslackchat.zendesk_webhooks.email_from_zendesk')
+def test_failed_webhook_event_is_kept(
+    email_from_zendesk, ZendeskApp, SlackApp, log, db
+):
+    """Verify webhook failures are stored under the webhook's name.
+    """
+    event = {'token': 'the-correct-token', 'ticket_id': '32'}
+    email_from_zendesk.side_effect = ValueError('Slack is down')
+
+    with pytest.raises(ValueError):
+        zendesk_webhooks.EmailWebHook().process(event)
+
+    failed = FailedEvent.objects.get()
+    assert failed.source == 'email'
+    assert failed.event == event
+
+    email_from_zendesk.side_effect = None
+    assert dead_letter.replay(failed) is None
+    email_from_zendesk.assert_called_with(
+        event, SlackApp.client(), ZendeskApp.client()
+    )
+
+
+@patch('zenslackchat.tasks.add_comment')
+@patch('zenslackchat.tasks.ZendeskApp')
+def test_comments_are_kept_when_the_flush_gives_up(
+    ZendeskApp, add_comment, log, db
+):
+    """Verify debounced replies are stored once the retries are used up.
+    """
+    add_comment.side_effect = ValueError('Zendesk is down')
+    comment_buffer.buffer_comment('77', 'Bob (Slack): one', 5)
+
+    # The last retry:
+    tasks.flush_zendesk_comments.push_request(retries=3)
+    try:
+        tasks.flush_zendesk_comments.run('77')
+
+    finally:
+        tasks.flush_zendesk_comments.pop_request()
+
+    failed = FailedEvent.objects.get()
+    assert failed.source == 'comment_flush'
+    assert failed.event == {'ticket_id': '77', 'comment': 'Bob (Slack): one'}
+    assert comment_buffer.drain_comments('77') == []
+
+
+def test_retry_after():
+    """Verify Retry-After is found on the different client errors.
+    """
+    zenpy_error = MagicMock(spec=['response'])
+    zenpy_error.response.headers = {'Retry-After': '30'}
+    assert dead_letter.retry_after(zenpy_error) == 30.0
+
+    async_error = MagicMock(spec=['retry_after'], retry_after='2')
+    assert dead_letter.retry_after(async_error) == 2.0
+
+    assert dead_letter.retry_after(ValueError('no')) is None
+    assert dead_letter.retry_after(None) is None
+
+
+@patch('zenslackchat.dead_letter.handle')
+def test_replay_command(handle, log, transactional_db):
+    """Verify the command replays on threads and backs off when told to.
+    """
+    for number in range(6):
+        FailedEvent.objects.create(
+            source='slack', event={'n': number, 'ts': str(number)}
+        )
+    FailedEvent.objects.create(source='email', event={'n': 'email'})
+
+    rate_limited = ValueError('slow down')
+    rate_limited.retry_after = '0.05'
+
+    def fail_one(source, event):
+        if event['n'] == 3:
+            raise rate_limited
+
+    handle.side_effect = fail_one
+
+    with patch.object(dead_letter.Pacer, 'pause') as pause:
+        call_command(
+            'replay_failed_events', '--source=slack', '--concurrency=3',
+            '--rate=0'
+        )
+
+    assert handle.call_count == 6
+    pause.assert_called_once_with(0.05)
+    remaining = FailedEvent.objects.order_by('source')
+    assert [failed.event['n'] for failed in remaining] == ['email', 3]
+    assert remaining[1].attempts == 2
+
+
+@patch('zenslackchat.dead_letter.handle')
+def test_replay_keeps_each_thread_in_order(handle, log, transactional_db):
+    """Verify a thread's events are replayed one at a time in order, and the
+    rest of a thread is kept if one fails.
+    """
+    for number in range(4):
+        for thread in ('1.1', '2.2'):
+            FailedEvent.objects.create(source='slack', event={
+                'n': number, 'ts': f'{thread}{number}', 'thread_ts': thread
+            })
+
+    running = set()
+    seen = {'1.1': [], '2.2': []}
+
+    def replay(source, event):
+        thread = event['thread_ts']
+        assert thread not in running
+        running.add(thread)
+        time.sleep(0.01)
+        seen[thread].append(event['n'])
+        running.discard(thread)
+        if thread == '2.2' and event['n'] == 1:
+            raise ValueError('Zendesk is down')
+
+    handle.side_effect = replay
+
+    results = dead_letter.replay_many(
+        FailedEvent.objects.order_by('created_at'), concurrency=4, rate=0
+    )
+
+    assert seen == {'1.1': [0, 1, 2, 3], '2.2': [0, 1]}
+    assert results == dict(replayed=5, failed=1, skipped=2)
+    assert [
+        failed.event['n'] for failed in FailedEvent.objects.order_by('pk')
+    ] == [1, 2, 3]
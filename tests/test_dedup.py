@@ -0,0 +1,87 @@
+from unittest.mock import patch
+
+import redis
+from asgiref.sync import async_to_sync
+from rest_framework.test import APIRequestFactory
+
+from zenslackchat import dedup
+from zenslackchat import metrics
+from zenslackchat import eventsview
+
+
+def test_event_id_is_duplicate_only_after_first_seen(log):
+    """Verify the first delivery is handled and redeliveries are spotted.
+    """
+    assert dedup.is_duplicate('Ev01AB2C3D4E') is False
+    assert dedup.is_duplicate('Ev01AB2C3D4E') is True
+    assert dedup.is_duplicate('Ev01AB2C3D4E') is True
+    assert dedup.is_duplicate('Ev09ZZ9Z9Z9Z') is False
+
+    assert metrics.snapshot()['slack.event.duplicate'] == 2
+
+
+def test_event_id_is_forgotten_after_ttl(log, redis_connection):
+    """Verify the stored event_id expires.
+    """
+    assert dedup.is_duplicate('Ev01AB2C3D4E', ttl=60) is False
+    ttl = redis_connection.ttl('zenslackchat:event:Ev01AB2C3D4E')
+    assert 0 < ttl <= 60
+
+
+def test_missing_event_id_is_never_a_duplicate(log):
+    """Verify events without an id are always handled.
+    """
+    assert dedup.is_duplicate(None) is False
+    assert dedup.is_duplicate('') is False
+    assert dedup.is_duplicate(None) is False
+
+
+def test_redis_unavailable_is_not_a_duplicate(log, redis_connection):
+    """Verify I carry on handling events if Redis is down.
+    """
+    with patch.object(
+        redis_connection, 'set', side_effect=redis.ConnectionError('down')
+    ):
+        assert dedup.is_duplicate('Ev01AB2C3D4E') is False
+        assert dedup.is_duplicate('Ev01AB2C3D4E') is False
+
+
+@patch('zenslackchat.eventsview.process_event')
+def test_retried_event_is_counted_and_only_handled_once(
+    process_event, log, settings
+):
+    """Test a Slack redelivery of the same event_id does not run the handler.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    settings.SRE_SUPPORT_CHANNEL = 'C0192NP3TFG'
+    settings.ASYNC_EVENT_PROCESSING = False
+    payload = dict(
+        token='the-correct-token',
+        event_id='Ev01AB2C3D4E',
+        event={
+            'channel': 'C0192NP3TFG',
+            'text': 'hello there!',
+            'ts': '1603983778.011500',
+            'type': 'message',
+            'user': 'UGF7MRWMS'
+        }
+    )
+    factory = APIRequestFactory()
+    view = async_to_sync(eventsview.Events.as_view())
+
+    response = view(factory.post('/slack/events/', payload, format='json'))
+    assert response.status_code == 200
+    process_event.assert_called_once_with(payload['event'])
+
+    process_event.reset_mock()
+    response = view(factory.post(
+        '/slack/events/', payload, format='json',
+        HTTP_X_SLACK_RETRY_NUM='1',
+        HTTP_X_SLACK_RETRY_REASON='http_timeout',
+    ))
+    assert response.status_code == 200
+    process_event.assert_not_called()
+
+    counts = metrics.snapshot()
+    assert counts['slack.retry.http_timeout'] == 1
+    assert counts['slack.event.duplicate'] == 1
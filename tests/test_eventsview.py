@@ -1,8 +1,14 @@
 import json
+import asyncio
+import threading
 import datetime
 from unittest.mock import patch
 from unittest.mock import MagicMock
 
+import pytest
+from asgiref.sync import async_to_sync
+
+from django.test import AsyncClient
 from django.test import RequestFactory, TestCase
 from rest_framework.test import APIRequestFactory
 from django.contrib.auth.models import User
@@ -32,7 +38,7 @@ def test_request_is_rejected_with_missing_token_field(handler):
         'user': 'UGF7MRWMS'
     }
 
-    events_view = eventsview.Events.as_view()
+    events_view = async_to_sync(eventsview.Events.as_view())
     request = factory.post(
         '/slack/events/', 
         dict(event=slack_event),
@@ -42,4 +48,218 @@ def test_request_is_rejected_with_missing_token_field(handler):
     # Forbidden
     assert response.status_code == 403
     # this should not have been called.
-    handler.assert_not_called()
\ No newline at end of file
+    handler.assert_not_called()
+
+def slack_event_payload(token):
+    return dict(
+        token=token,
+        event={
+            'channel': 'C0192NP3TFG',
+            'event_ts': '1603983778.011500',
+            'text': 'hello there!',
+            'ts': '1603983778.011500',
+            'type': 'message',
+            'user': 'UGF7MRWMS'
+        }
+    )
+
+
+@patch('zenslackchat.tasks.process_slack_event')
+@patch('zenslackchat.eventsview.handler')
+def test_async_event_is_queued_and_acknowledged(
+    handler, process_slack_event, settings
+):
+    """Test the event is handed to celery and the handler is not run inline.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    settings.SRE_SUPPORT_CHANNEL = 'C0192NP3TFG'
+    settings.ASYNC_EVENT_PROCESSING = True
+    payload = slack_event_payload('the-correct-token')
+
+    factory = APIRequestFactory()
+    request = factory.post('/slack/events/', payload, format='json')
+    response = async_to_sync(eventsview.Events.as_view())(request)
+
+    assert response.status_code == 200
+    process_slack_event.apply_async.assert_called_with(
+        (payload['event'],), queue='zenslackchat.events.0'
+    )
+    handler.assert_not_called()
+
+
+@patch('zenslackchat.eventsview.ZendeskApp')
+@patch('zenslackchat.eventsview.SlackApp')
+@patch('zenslackchat.eventsview.enqueue_slack_event')
+@patch('zenslackchat.eventsview.handler')
+def test_inline_event_is_handled_in_the_request(
+    handler, enqueue_slack_event, SlackApp, ZendeskApp, settings
+):
+    """Test the handler is run inline when async processing is disabled.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    settings.SRE_SUPPORT_CHANNEL = 'C0192NP3TFG'
+    settings.ASYNC_EVENT_PROCESSING = False
+    payload = slack_event_payload('the-correct-token')
+
+    factory = APIRequestFactory()
+    request = factory.post('/slack/events/', payload, format='json')
+    response = async_to_sync(eventsview.Events.as_view())(request)
+
+    assert response.status_code == 200
+    enqueue_slack_event.assert_not_called()
+    handler.assert_called_once()
+    assert handler.call_args[0][0] == payload['event']
+
+
+@patch('zenslackchat.eventsview.process_event')
+def test_process_slack_event_task_runs_handler(process_event):
+    """Test the celery task runs the same handling as the inline path.
+    """
+    from zenslackchat.tasks import process_slack_event
+
+    event = slack_event_payload('')['event']
+    process_slack_event(event)
+
+    process_event.assert_called_with(event)
+
+
+@pytest.mark.parametrize(
+    'event',
+    [
+        # not our channel
+        {'channel': 'C01A96HA9BR', 'ts': '1603983778.011500', 'user': 'U1'},
+        # a subtype we don't handle
+        {
+            'channel': 'C0192NP3TFG', 'ts': '1603983778.011500',
+            'subtype': 'channel_join'
+        },
+        # a bot message
+        {
+            'channel': 'C0192NP3TFG', 'ts': '1603983778.011500',
+            'bot_id': 'B01', 'text': '🤖 hello'
+        },
+    ]
+)
+@patch('zenslackchat.eventsview.is_duplicate')
+@patch('zenslackchat.eventsview.enqueue_slack_event')
+@patch('zenslackchat.eventsview.process_event')
+def test_ignored_events_are_dropped_before_any_work(
+    process_event, enqueue_slack_event, is_duplicate, event, settings
+):
+    """Test ignored events are acknowledged without being handled, queued or
+    even checked for duplicates.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    settings.SRE_SUPPORT_CHANNEL = 'C0192NP3TFG'
+
+    for async_mode in (True, False):
+        settings.ASYNC_EVENT_PROCESSING = async_mode
+        factory = APIRequestFactory()
+        request = factory.post(
+            '/slack/events/',
+            dict(token='the-correct-token', event_id='Ev01', event=event),
+            format='json'
+        )
+        response = async_to_sync(eventsview.Events.as_view())(request)
+        assert response.status_code == 200
+
+    is_duplicate.assert_not_called()
+    process_event.assert_not_called()
+    enqueue_slack_event.assert_not_called()
+
+
+@patch('zenslackchat.eventsview.slack_users')
+def test_event_errors_are_acknowledged(slack_users, log, settings):
+    """Test an error accepting an event is logged rather than given back to
+    Slack to retry.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    slack_users.update.side_effect = ValueError('database is down')
+    factory = APIRequestFactory()
+    request = factory.post(
+        '/slack/events/',
+        dict(
+            token='the-correct-token', event_id='Ev01',
+            event={'type': 'user_change', 'user': {'id': 'UGF7MRWMS'}},
+        ),
+        format='json'
+    )
+    response = async_to_sync(eventsview.Events.as_view())(request)
+    assert response.status_code == 200
+    slack_users.update.assert_called_once_with({'id': 'UGF7MRWMS'})
+
+
+def test_url_verification_challenge_and_bad_body(settings):
+    """Test the Slack URL verification handshake and garbage bodies.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    factory = APIRequestFactory()
+    view = async_to_sync(eventsview.Events.as_view())
+
+    challenge = dict(
+        token='the-correct-token',
+        type='url_verification',
+        challenge='3eZbrw1aBm2rZgRNFdxV2595E9CY3gmdALWMmHkvFXO7tYXAYM8P',
+    )
+    response = view(factory.post('/slack/events/', challenge, format='json'))
+    assert response.status_code == 200
+    assert json.loads(response.content) == challenge
+
+    response = view(factory.post(
+        '/slack/events/', 'not json', content_type='application/json'
+    ))
+    assert response.status_code == 400
+
+
+@patch('zenslackchat.eventsview.accept_envelope')
+def test_events_are_served_as_async_views_over_asgi(accept_envelope, settings):
+    """Test Django runs the view on the event loop and only the intake on a
+    thread.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    loop_thread = []
+
+    def intake(slack_message, retry_num, retry_reason):
+        loop_thread.append(threading.get_ident())
+
+    accept_envelope.side_effect = intake
+    assert asyncio.iscoroutinefunction(eventsview.Events.as_view())
+
+    async def post():
+        loop_thread.append(threading.get_ident())
+        return await AsyncClient().post(
+            '/slack/events/',
+            {'token': 'the-correct-token', 'event': {}},
+            content_type='application/json',
+        )
+
+    response = async_to_sync(post)()
+    assert response.status_code == 200
+    accept_envelope.assert_called_once_with(
+        {'token': 'the-correct-token', 'event': {}},
+        retry_num=None,
+        retry_reason=None,
+    )
+    assert loop_thread[0] != loop_thread[1]
+
+
+@patch('zenslackchat.eventsview.ZendeskApp')
+@patch('zenslackchat.eventsview.SlackApp')
+@patch('zenslackchat.eventsview.handler')
+def test_clients_are_only_built_when_used(
+    handler, SlackApp, ZendeskApp, settings
+):
+    """Test the handler gets clients which are created on first use.
+    """
+    def only_uses_slack(event, slack_client, zendesk_client, **kwargs):
+        slack_client.users_info(user=event['user'])
+
+    handler.side_effect = only_uses_slack
+
+    eventsview.process_event(slack_event_payload('')['event'])
+
+    SlackApp.client.assert_called_once()
+    SlackApp.client.return_value.users_info.assert_called_with(
+        user='UGF7MRWMS'
+    )
+    ZendeskApp.client.assert_not_called()
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import pytest
+
+from zenslackchat import metrics
+from zenslackchat.flow import Flow
+from zenslackchat.clients import LazyClient
+from zenslackchat.message import new_issue_flow
+
+
+def test_independent_steps_run_at_the_same_time(log):
+    """Verify steps which don't need each other overlap.
+    """
+    # Each step waits for the other to start, so this only completes if
+    # they run at the same time:
+    both_started = threading.Barrier(2, timeout=5)
+
+    def call(result):
+        both_started.wait()
+        time.sleep(0.2)
+        return result
+
+    flow = Flow('test')
+    flow.step('slack', lambda: call('posted'))
+    flow.step('zendesk', lambda: call('ticket'))
+    flow.step(
+        'both', lambda slack, zendesk: f'{slack} {zendesk}',
+        after=('slack', 'zendesk')
+    )
+
+    results = flow.run()
+
+    assert results == dict(slack='posted', zendesk='ticket', both='posted ticket')
+
+    timings = metrics.snapshot()
+    assert timings['flow.test.slack.count'] == 1
+    assert timings['flow.test.slack.total'] >= 0.2
+    assert timings['flow.test.total.count'] == 1
+
+
+def test_database_steps_run_on_the_calling_thread(log):
+    threads = {}
+
+    def record(name):
+        threads[name] = threading.current_thread()
+
+    flow = Flow('test')
+    flow.step('remote', lambda: record('remote'))
+    flow.step('store', lambda: record('store'), uses_db=True)
+    flow.run()
+
+    assert threads['store'] is threading.current_thread()
+    assert threads['remote'] is not threading.current_thread()
+
+
+def test_a_failed_step_skips_only_the_steps_after_it(log):
+    ran = []
+
+    def fail():
+        raise ValueError('Zendesk is down')
+
+    flow = Flow('test')
+    flow.step('ticket', fail)
+    flow.step('on_call', lambda: ran.append('on_call'))
+    flow.step('reply', lambda ticket: ran.append('reply'), after=('ticket',))
+
+    with pytest.raises(ValueError):
+        flow.run()
+
+    assert ran == ['on_call']
+
+
+def test_steps_must_come_after_known_steps():
+    flow = Flow('test')
+    flow.step('ticket', lambda: None)
+
+    with pytest.raises(ValueError):
+        flow.step('ticket', lambda: None)
+
+    with pytest.raises(ValueError):
+        flow.step('reply', lambda thread: None, after=('thread',))
+
+
+def test_new_issue_clients_are_built_before_the_flow_runs():
+    """Verify a client cache miss isn't left to one of the flow's threads.
+    """
+    threads = []
+
+    def factory():
+        threads.append(threading.current_thread())
+        return object()
+
+    new_issue_flow(
+        LazyClient(factory), LazyClient(factory), 'https://z', '1.1', 'C1',
+        'U1', 'G1', 'a@example.com', 'help', 'https://s'
+    )
+
+    assert threads == [threading.current_thread()] * 2
@@ -0,0 +1,169 @@
+import json
+from unittest.mock import patch
+
+from django.test import RequestFactory
+
+from zenslackchat import views
+from zenslackchat import tasks
+from zenslackchat import intake
+from zenslackchat import redis_store
+from zenslackchat import eventsview
+from zenslackchat import zendesk_webhooks
+
+
+def reply(ts, text='more detail', thread_ts='1603983778.011500'):
+    return {
+        'channel': 'C0192NP3TFG',
+        'text': text,
+        'thread_ts': thread_ts,
+        'ts': ts,
+        'type': 'message',
+        'user': 'UGF7MRWMS'
+    }
+
+
+def test_event_priorities():
+    """Verify new issues are protected and help is the first to go.
+    """
+    new_issue = reply('1603983778.011500', text='help', thread_ts=None)
+    assert intake.slack_priority(new_issue) == intake.HIGH
+    assert intake.slack_priority(reply('1603983779.0')) == intake.NORMAL
+    assert intake.slack_priority(reply('1603983779.0', ' Help')) == intake.LOW
+
+
+def test_full_intake_sheds_by_priority(log):
+    """Verify what happens to each priority once the depth is reached.
+    """
+    assert intake.admit('a', intake.NORMAL, max_depth=2) == intake.ADMIT
+    assert intake.admit('b', intake.LOW, max_depth=2) == intake.ADMIT
+    assert intake.stats()['depth'] == 2
+
+    assert intake.admit('c', intake.NORMAL, max_depth=2) == intake.DEFER
+    assert intake.admit('d', intake.LOW, max_depth=2) == intake.DROP
+    assert intake.admit('e', intake.HIGH, max_depth=2) == intake.ADMIT
+    assert intake.stats()['depth'] == 3
+
+    intake.release('a')
+    intake.release('e')
+    assert intake.admit('c', intake.NORMAL, max_depth=2) == intake.ADMIT
+
+    # No limit:
+    assert intake.admit('f', intake.LOW, max_depth=0) == intake.ADMIT
+
+
+def test_deferred_thread_is_kept_in_order(log):
+    """Verify a thread's later replies wait behind its deferred ones.
+    """
+    intake.admit('busy', intake.NORMAL, max_depth=1)
+    assert intake.admit('r1', intake.NORMAL, 'T1', 1) == intake.DEFER
+    intake.defer('slack', {'n': 1}, 'r1', intake.NORMAL, 'T1')
+
+    # Room is made, but T1 still has a deferred reply:
+    intake.release('busy')
+    assert intake.admit('r2', intake.NORMAL, 'T1', 1) == intake.DEFER
+    intake.defer('slack', {'n': 2}, 'r2', intake.NORMAL, 'T1')
+    # Other threads are not held:
+    assert intake.admit('x1', intake.NORMAL, 'T2', 1) == intake.ADMIT
+
+    stats = intake.stats()
+    assert stats['depth'] == 1
+    assert stats['deferred'] == 2
+    assert stats['oldest_age'] >= 0
+    assert stats['oldest_deferred_age'] >= 0
+
+    # Only handed back once there is room:
+    assert intake.next_deferred(max_depth=1) is None
+    intake.release('x1')
+    assert intake.next_deferred(max_depth=1)['item'] == {'n': 1}
+    intake.release('r1')
+    assert intake.next_deferred(max_depth=1)['item'] == {'n': 2}
+    assert intake.next_deferred(max_depth=1) is None
+
+    # The hold is gone with the last deferred reply:
+    intake.release('r2')
+    assert intake.admit('r3', intake.NORMAL, 'T1', 1) == intake.ADMIT
+
+
+def test_lost_hold_expires(log):
+    """Verify a thread isn't held forever if its deferred entry is lost.
+    """
+    with patch.dict('webapp.settings.__dict__', {'INTAKE_ITEM_TTL': 600}):
+        intake.defer('slack', {'n': 1}, 'r1', intake.NORMAL, 'T1')
+    redis_store.connection().delete(intake._deferred_key())
+    assert intake.admit('r2', intake.NORMAL, 'T1', 0) == intake.DEFER
+
+    held = intake._held_key('T1')
+    assert 0 < redis_store.connection().ttl(held) <= 600
+    redis_store.connection().expire(held, 0)
+    assert intake.admit('r2', intake.NORMAL, 'T1', 0) == intake.ADMIT
+
+
+@patch('zenslackchat.eventsview.process_event')
+def test_reply_is_deferred_and_drained_later(process_event, log, settings):
+    """Verify a deferred Slack reply is handled once the intake has room.
+    """
+    settings.SRE_SUPPORT_CHANNEL = 'C0192NP3TFG'
+    env = {'INTAKE_MAX_DEPTH': 1}
+    event = reply('1603983780.000100')
+    help_event = reply('1603983780.000200', text='help')
+
+    with patch.dict('webapp.settings.__dict__', env):
+        intake.admit('busy', intake.HIGH)
+        assert eventsview.accept_envelope(
+            {'event_id': 'Ev1', 'event': event}
+        ) is True
+        assert eventsview.accept_envelope(
+            {'event_id': 'Ev2', 'event': help_event}
+        ) is False
+        process_event.assert_not_called()
+
+        tasks.drain_deferred_events()
+        process_event.assert_not_called()
+
+        intake.release('busy')
+        tasks.drain_deferred_events()
+
+    process_event.assert_called_once_with(event)
+
+
+@patch('zenslackchat.zendesk_webhooks.email_from_zendesk')
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+def test_email_webhook_is_admitted_when_full(
+    ZendeskApp, SlackApp, email_from_zendesk, log
+):
+    """Verify emailed issues are always handled and release their place.
+    """
+    event = {'token': 'the-correct-token', 'ticket_id': '32'}
+    with patch.dict('webapp.settings.__dict__', {'INTAKE_MAX_DEPTH': 1}):
+        intake.admit('busy', intake.HIGH)
+        zendesk_webhooks.EmailWebHook().accept(event)
+
+    email_from_zendesk.assert_called_once()
+    assert intake.stats()['depth'] == 1
+
+
+def test_metrics_endpoint(log, settings):
+    """Verify the metrics need the token and report the intake.
+    """
+    intake.admit('a', intake.NORMAL)
+    factory = RequestFactory()
+
+    settings.METRICS_TOKEN = ''
+    response = views.service_metrics(factory.get('/metrics/'))
+    assert response.status_code == 403
+
+    settings.METRICS_TOKEN = 'the-token'
+    response = views.service_metrics(
+        factory.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong')
+    )
+    assert response.status_code == 403
+
+    response = views.service_metrics(
+        factory.get('/metrics/', HTTP_AUTHORIZATION='Bearer the-token')
+    )
+    assert response.status_code == 200
+    data = json.loads(response.content)
+    assert data['intake']['depth'] == 1
+    assert data['metrics']['intake.admit.normal'] == 1
+    assert data['circuits'] == {'zendesk': 'closed'}
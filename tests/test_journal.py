@@ -0,0 +1,146 @@
+import io
+import json
+import gzip
+import time
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from rest_framework.test import APIRequestFactory
+
+from zenslackchat import journal
+from zenslackchat import eventsview
+from zenslackchat.models import ZenSlackChat
+
+
+def new_issue(ts, text='My machine is on fire'):
+    return {
+        'token': 'the-correct-token',
+        'event_id': f'Ev{ts}',
+        'event': {
+            'channel': 'C0192NP3TFG',
+            'text': text,
+            'ts': ts,
+            'type': 'message',
+            'user': 'UGF7MRWMS'
+        },
+    }
+
+
+def write_journal(path, entries):
+    with gzip.open(path, 'wt') as out:
+        for entry in entries:
+            out.write(json.dumps(entry) + '\n')
+
+
+@patch('zenslackchat.eventsview.accept_envelope')
+def test_received_events_are_journaled_as_is(accept_envelope, tmp_path, settings):
+    """Verify the raw body is kept and can be read back.
+    """
+    settings.SLACK_VERIFICATION_TOKEN = 'the-correct-token'
+    body = json.dumps(new_issue('1602064330.001600'), indent=3)
+    factory = APIRequestFactory()
+    view = async_to_sync(eventsview.Events.as_view())
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'EVENT_JOURNAL_PATH': str(tmp_path)}
+    ):
+        try:
+            view(factory.post(
+                '/slack/events/', body, content_type='application/json',
+                HTTP_X_SLACK_RETRY_NUM='1'
+            ))
+            paths = list(tmp_path.glob('events-*.ndjson.gz'))
+            # Not flushed after every line, so gzip has something to compress:
+            assert list(journal.read(paths)) == []
+
+            # Readable while still open once flushed:
+            with patch('zenslackchat.journal.FLUSH_INTERVAL', 0):
+                journal.record('slack', b'{}')
+            assert len(list(journal.read(paths))) == 2
+
+        finally:
+            journal.close()
+
+    entry, _ = list(journal.read(paths))
+    assert entry['source'] == 'slack'
+    assert entry['body'] == body
+    assert entry['headers'] == {'X-Slack-Retry-Num': '1'}
+
+
+def test_journal_is_flushed_once_traffic_stops(tmp_path):
+    """Verify the last lines are not left waiting for another event.
+    """
+    override = {'EVENT_JOURNAL_PATH': str(tmp_path)}
+    with patch.dict('webapp.settings.__dict__', override):
+        try:
+            with patch('zenslackchat.journal.FLUSH_INTERVAL', 0.2):
+                journal.record('slack', b'{}')
+                paths = list(tmp_path.glob('events-*.ndjson.gz'))
+                assert list(journal.read(paths)) == []
+                time.sleep(0.5)
+                assert len(list(journal.read(paths))) == 1
+
+        finally:
+            journal.close()
+
+
+def test_nothing_is_journaled_by_default(tmp_path):
+    journal.record('slack', b'{}')
+    assert journal._journal is None
+
+
+def test_journals_are_read_in_order(tmp_path):
+    """Verify several process journals are merged by time received.
+    """
+    write_journal(tmp_path / 'a.ndjson.gz', [
+        dict(at=1.0, source='slack', body='1'),
+        dict(at=3.0, source='slack', body='3'),
+    ])
+    write_journal(tmp_path / 'b.ndjson.gz', [
+        dict(at=2.0, source='email', body='2'),
+    ])
+    paths = [tmp_path / 'a.ndjson.gz', tmp_path / 'b.ndjson.gz']
+    assert [entry['body'] for entry in journal.read(paths)] == ['1', '2', '3']
+
+
+def test_replay_journal_against_fakes(log, tmp_path, transactional_db):
+    """Verify a journal is replayed through the handlers and reported.
+    """
+    reply = new_issue('1602064400.000100', text='still on fire')
+    reply['event']['thread_ts'] = '1602064330.001600'
+    write_journal(tmp_path / 'events.ndjson.gz', [
+        dict(
+            at=100.0, source='slack',
+            body=json.dumps(new_issue('1602064330.001600'))
+        ),
+        dict(at=100.5, source='slack', body=json.dumps(reply)),
+        dict(at=101.0, source='comments', body=json.dumps({
+            'token': 'the-correct-token',
+            'ticket_id': '999',
+            'chat_id': '1602064330.001600',
+        })),
+        # Emails use the real clients, so are skipped:
+        dict(at=101.5, source='email', body=json.dumps({'ticket_id': '9'})),
+    ])
+    out = io.StringIO()
+
+    # The configured apps are never asked:
+    with patch(
+        'zenslackchat.models.PagerDutyApp.client', side_effect=AssertionError
+    ), patch(
+        'zenslackchat.models.ZendeskApp.resolve_identity',
+        side_effect=AssertionError
+    ):
+        call_command(
+            'replay_journal', str(tmp_path / 'events.ndjson.gz'),
+            '--speed=0', '--latency=0', '--concurrency=1',
+            '--channel=C0192NP3TFG', stdout=out
+        )
+
+    report = out.getvalue()
+    assert 'Replayed 3 events' in report
+    assert 'slack: 2 events, 0 errors' in report
+    assert 'comments: 1 events, 0 errors' in report
+    issue = ZenSlackChat.get('C0192NP3TFG', '1602064330.001600')
+    assert issue.ticket_id == '1'
@@ -2,8 +2,10 @@ from unittest.mock import patch
 from unittest.mock import MagicMock
 
 import pytest
+from zenpy.lib.exception import APIException
 
 from zenslackchat.message import handler
+from zenslackchat.circuit import CircuitOpen
 from zenslackchat.message import is_resolved
 from zenslackchat.models import ZenSlackChat
 from zenslackchat.message import IGNORED_SUBTYPES
@@ -30,15 +32,13 @@ class FakeUserResponse(object):
         )
 
 
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
-@patch('zenslackchat.message.message_issue_zendesk_url')
+@patch('zenslackchat.message.message_welcome')
 def test_new_support_message_creates_ticket(
-    message_issue_zendesk_url,
+    message_welcome,
     create_ticket,
     close_ticket,
-    get_ticket,
     log,
     db
 ):
@@ -55,7 +55,6 @@ def test_new_support_message_creates_ticket(
     slack_client.users_info.return_value = FakeUserResponse()
 
     # No existing ticket should be returned:
-    get_ticket.return_value = None
 
     # Return out fake ticket when asked to create:
     ticket = FakeTicket(ticket_id='32')
@@ -129,13 +128,16 @@ def test_new_support_message_creates_ticket(
         slack_message_url='https://s.l.a.c.k/C019JUGAGTS/p1597940362013100'
     )
 
-    # Check the args to the call that would post a message:
-    message_issue_zendesk_url.assert_called_with(
+    # Check the args to the call that would post a message. No PagerDuty
+    # or out of hours information is configured:
+    message_welcome.assert_called_once_with(
         slack_client,
         'https://z.e.n.d.e.s.k',
         '32',
         '1597940362.013100',
-        'C019JUGAGTS'
+        'C019JUGAGTS',
+        on_call={},
+        out_of_hours=None
     )
 
 
@@ -157,7 +159,6 @@ def test_is_resolve(resolve_command, expected):
 
 
 @patch('zenslackchat.message.add_comment')
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -175,7 +176,6 @@ def test_zendesk_comment_and_resolve_ticket_command_closes_the_issue(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     add_comment,
     resolve_command,
     log,
@@ -193,7 +193,6 @@ def test_zendesk_comment_and_resolve_ticket_command_closes_the_issue(
     group_id = '200000000005'
 
     slack_client.users_info.return_value = FakeUserResponse()
-    get_ticket.return_value = None
     ticket = FakeTicket(ticket_id='77')
     create_ticket.return_value = ticket
     assert ZenSlackChat.objects.count() == 0
@@ -240,7 +239,6 @@ def test_zendesk_comment_and_resolve_ticket_command_closes_the_issue(
     post_message.reset_mock()
 
     # Return the fake ticket instance this time
-    get_ticket.return_value = ticket
 
     handle_message({
         'channel': 'C0192NP3TFG',
@@ -270,8 +268,10 @@ def test_zendesk_comment_and_resolve_ticket_command_closes_the_issue(
     # Check the comment was "sent" to Zendesk correctly:
     add_comment.assert_called_with(
         zendesk_client,
-        ticket,
-        "Bob Sprocket (Slack): No wait, it was just a blinking red light"
+        ticket.id,
+        "Bob Sprocket (Slack): No wait, it was just a blinking red light",
+        # No ZendeskApp is set up so add_comment asks who it is:
+        author_id=None
     )
 
     # No slack message should have been sent:
@@ -320,7 +320,6 @@ def test_zendesk_comment_and_resolve_ticket_command_closes_the_issue(
     )
 
 
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -328,7 +327,6 @@ def test_message_with_existing_support_ticket_in_zendesk(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     log,
     db
 ):
@@ -347,7 +345,6 @@ def test_message_with_existing_support_ticket_in_zendesk(
     # Return the ticket which will indicate we know about this issue and
     # not then go one to make a new message.
     ticket = FakeTicket(ticket_id='21')
-    get_ticket.return_value = ticket
 
     # There should be no entries here yet:
     assert ZenSlackChat.objects.count() == 0
@@ -413,13 +410,11 @@ def test_message_with_existing_support_ticket_in_zendesk(
     slack_client.users_info.assert_called_with(user='UGF7MRWMS')
 
     # Quick check these should not have been called
-    get_ticket.assert_not_called()
     create_ticket.assert_not_called()
     post_message.assert_not_called()
 
 
 @patch('zenslackchat.message.add_comment')
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -427,7 +422,6 @@ def test_thread_message_with_support_ticket_in_zendesk(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     add_comment,
     log,
     db
@@ -447,7 +441,6 @@ def test_thread_message_with_support_ticket_in_zendesk(
     # Return the ticket which will indicate we know about this issue and
     # not then go one to make a new message.
     ticket = FakeTicket(ticket_id='83')
-    get_ticket.return_value = ticket
 
     # There should be no entries here yet:
     assert ZenSlackChat.objects.count() == 0
@@ -518,11 +511,12 @@ def test_thread_message_with_support_ticket_in_zendesk(
     slack_client.users_info.assert_called_with(user='UGF7MRWMS')
 
     # Check the ticket is "recovered" and the comment is "added" to it:
-    get_ticket.assert_called_with(zendesk_client, '83')
     add_comment.assert_called_with(
         zendesk_client,
-        ticket,
-        'Bob Sprocket (Slack): Oh, wait, my bad 🤦‍♀️, its ok now.'
+        ticket.id,
+        'Bob Sprocket (Slack): Oh, wait, my bad 🤦‍♀️, its ok now.',
+        # No ZendeskApp is set up so add_comment asks who it is:
+        author_id=None
     )
 
     # These should not have been called:
@@ -531,7 +525,6 @@ def test_thread_message_with_support_ticket_in_zendesk(
 
 
 @patch('zenslackchat.message.add_comment')
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -539,7 +532,6 @@ def test_old_message_thread_with_message_and_no_support_ticket_in_zendesk(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     add_comment,
     log,
     db
@@ -563,7 +555,6 @@ def test_old_message_thread_with_message_and_no_support_ticket_in_zendesk(
 
     # With no known issue for this and set ts & thread_ts, it will indicate an
     # old message thread with new chatter on it. I'm going to ignore this.
-    get_ticket.return_value = None
     assert len(ZenSlackChat.open_issues()) == 0
 
     # Send a new help message
@@ -618,7 +609,6 @@ def test_old_message_thread_with_message_and_no_support_ticket_in_zendesk(
 
     # These won't be called as we don't have a record of this conversation:
     add_comment.assert_not_called()
-    get_ticket.assert_not_called()
     create_ticket.assert_not_called()
     post_message.assert_not_called()
 
@@ -627,7 +617,6 @@ def test_old_message_thread_with_message_and_no_support_ticket_in_zendesk(
     'ignored_subtype',
     IGNORED_SUBTYPES
 )
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -635,7 +624,6 @@ def test_message_events_that_are_ignored_by_handler(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     ignored_subtype,
     log,
     db
@@ -669,7 +657,6 @@ def test_message_events_that_are_ignored_by_handler(
 
 
 @patch('zenslackchat.message.add_comment')
-@patch('zenslackchat.message.get_ticket')
 @patch('zenslackchat.message.close_ticket')
 @patch('zenslackchat.message.create_ticket')
 @patch('zenslackchat.message.post_message')
@@ -677,7 +664,6 @@ def test_channel_is_not_our_channel_so_message_is_ignored(
     post_message,
     create_ticket,
     close_ticket,
-    get_ticket,
     add_comment,
     log,
     db
@@ -712,6 +698,260 @@ def test_channel_is_not_our_channel_so_message_is_ignored(
     assert is_handled is False
     slack_client.users_info.assert_not_called()
     add_comment.assert_not_called()
-    get_ticket.assert_not_called()
     create_ticket.assert_not_called()
     post_message.assert_not_called()
+
+
+@patch('zenslackchat.message.debounce_comment')
+@patch('zenslackchat.message.add_comment')
+@patch('zenslackchat.message.post_message')
+def test_thread_message_is_debounced_when_enabled(
+    post_message,
+    add_comment,
+    debounce_comment,
+    log,
+    db
+):
+    """Test replies are buffered rather than sent to Zendesk one by one.
+    """
+    slack_client = MagicMock()
+    zendesk_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    debounce_comment.return_value = True
+
+    ZenSlackChat.open(
+        channel_id="C019JUGAGTS",
+        chat_id="1598021907.003600",
+        ticket_id="83",
+    )
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'ZENDESK_COMMENT_DEBOUNCE': 10}
+    ):
+        is_handled = handler(
+            {
+                'channel': 'C019JUGAGTS',
+                'text': 'and another thing',
+                'thread_ts': '1598021907.003600',
+                'ts': '1598022004.004900',
+                'user': 'UGF7MRWMS',
+            },
+            our_channel='C019JUGAGTS',
+            workspace_uri='https://s.l.a.c.k',
+            zendesk_uri='https://z.e.n.d.e.s.k',
+            slack_client=slack_client,
+            zendesk_client=zendesk_client,
+            user_id='100000000001',
+            group_id='200000000002',
+        )
+    assert is_handled is True
+
+    debounce_comment.assert_called_once_with(
+        '83', '1598021907.003600', 'Bob Sprocket (Slack): and another thing',
+        channel_id='C019JUGAGTS'
+    )
+    add_comment.assert_not_called()
+    post_message.assert_not_called()
+
+
+def reply(text):
+    """A message in the thread of issue 1598021907.003600."""
+    return {
+        'channel': 'C019JUGAGTS',
+        'text': text,
+        'thread_ts': '1598021907.003600',
+        'ts': '1598022004.004900',
+        'user': 'UGF7MRWMS',
+    }
+
+
+@pytest.mark.parametrize(
+    ('status', 'text', 'expected'),
+    [
+        ('closed', 'Is anyone there?', 'This ticket is closed'),
+        ('open', 'help', 'I understand the follow commands'),
+    ]
+)
+@patch('zenslackchat.message.add_comment')
+@patch('zenslackchat.message.post_message')
+def test_replies_use_the_mirrored_ticket_status(
+    post_message, add_comment, status, text, expected, log, db
+):
+    """Test replies which don't write to the ticket don't ask Zendesk for it.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    zendesk_client = MagicMock()
+    ZenSlackChat.open(
+        channel_id="C019JUGAGTS",
+        chat_id="1598021907.003600",
+        ticket_id="83",
+        ticket_status=status,
+    )
+
+    assert handler(
+        reply(text),
+        our_channel='C019JUGAGTS',
+        workspace_uri='https://s.l.a.c.k',
+        zendesk_uri='https://z.e.n.d.e.s.k',
+        slack_client=slack_client,
+        zendesk_client=zendesk_client,
+        user_id='100000000001',
+        group_id='200000000002',
+    ) is True
+
+    add_comment.assert_not_called()
+    assert expected in post_message.call_args[0][3]
+
+
+@patch('zenslackchat.message.add_comment')
+@patch('zenslackchat.message.post_message')
+def test_reply_to_a_ticket_closed_since_it_was_mirrored(
+    post_message, add_comment, log, db
+):
+    """Test a comment Zendesk refuses as the ticket is closed is reported.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    ZenSlackChat.open(
+        channel_id="C019JUGAGTS",
+        chat_id="1598021907.003600",
+        ticket_id="83",
+        ticket_status='open',
+    )
+    add_comment.side_effect = APIException(
+        'closed', response=MagicMock(
+            status_code=422, text='Status: closed prevents ticket update'
+        )
+    )
+
+    handler(
+        reply('Is anyone there?'),
+        our_channel='C019JUGAGTS',
+        workspace_uri='https://s.l.a.c.k',
+        zendesk_uri='https://z.e.n.d.e.s.k',
+        slack_client=slack_client,
+        zendesk_client=MagicMock(),
+        user_id='100000000001',
+        group_id='200000000002',
+    )
+
+    add_comment.assert_called_once()
+    assert 'This ticket is closed' in post_message.call_args[0][3]
+    issue = ZenSlackChat.get('C019JUGAGTS', '1598021907.003600')
+    assert issue.ticket_status == 'closed'
+
+
+@patch('zenslackchat.message.close_ticket')
+@patch('zenslackchat.message.post_message')
+def test_resolving_a_closed_ticket_does_not_write_to_zendesk(
+    post_message, close_ticket, log, db
+):
+    """Test the ticket is only closed in Zendesk if it isn't already.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    ZenSlackChat.open(
+        channel_id="C019JUGAGTS",
+        chat_id="1598021907.003600",
+        ticket_id="83",
+        ticket_status='closed',
+    )
+
+    handler(
+        reply('resolve'),
+        our_channel='C019JUGAGTS',
+        workspace_uri='https://s.l.a.c.k',
+        zendesk_uri='https://z.e.n.d.e.s.k',
+        slack_client=slack_client,
+        zendesk_client=MagicMock(),
+        user_id='100000000001',
+        group_id='200000000002',
+    )
+
+    close_ticket.assert_not_called()
+    issue = ZenSlackChat.get('C019JUGAGTS', '1598021907.003600')
+    assert issue.active is False
+
+
+@patch('zenslackchat.tasks.add_comment')
+@patch('zenslackchat.tasks.ZendeskApp')
+@patch('zenslackchat.message.close_ticket')
+@patch('zenslackchat.message.post_message')
+def test_resolving_writes_buffered_replies_first(
+    post_message, close_ticket, ZendeskApp, add_comment, log, db
+):
+    """Test replies still in the debounce buffer reach Zendesk before it is
+    closed.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    ZenSlackChat.open(
+        channel_id="C019JUGAGTS",
+        chat_id="1598021907.003600",
+        ticket_id="83",
+        ticket_status='open',
+    )
+    calls = MagicMock()
+    calls.attach_mock(add_comment, 'add_comment')
+    calls.attach_mock(close_ticket, 'close_ticket')
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'ZENDESK_COMMENT_DEBOUNCE': 10}
+    ), patch('zenslackchat.tasks.flush_zendesk_comments'):
+        for text in ('Is anyone there?', 'resolve'):
+            handler(
+                reply(text),
+                our_channel='C019JUGAGTS',
+                workspace_uri='https://s.l.a.c.k',
+                zendesk_uri='https://z.e.n.d.e.s.k',
+                slack_client=slack_client,
+                zendesk_client=MagicMock(),
+                user_id='100000000001',
+                group_id='200000000002',
+            )
+
+    assert [name for name, _, _ in calls.mock_calls] == [
+        'add_comment', 'close_ticket'
+    ]
+    assert add_comment.call_args[0][1:3] == (
+        '83', 'Bob Sprocket (Slack): Is anyone there?'
+    )
+
+
+@pytest.mark.parametrize('report_errors', [True, False])
+@patch('zenslackchat.message.create_ticket')
+@patch('zenslackchat.message.post_message')
+def test_zendesk_failures_are_only_reported_once(
+    post_message, create_ticket, report_errors, log, db
+):
+    """Test a replayed new issue doesn't tell the user again that Zendesk is
+    down.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value = FakeUserResponse()
+    create_ticket.side_effect = CircuitOpen('zendesk', 30)
+
+    with pytest.raises(CircuitOpen):
+        handler(
+            {
+                'channel': 'C019JUGAGTS',
+                'text': 'My 🖨 is on 🔥',
+                'ts': '1598022004.004900',
+                'user': 'UGF7MRWMS',
+            },
+            our_channel='C019JUGAGTS',
+            workspace_uri='https://s.l.a.c.k',
+            zendesk_uri='https://z.e.n.d.e.s.k',
+            slack_client=slack_client,
+            zendesk_client=MagicMock(),
+            user_id='100000000001',
+            group_id='200000000002',
+            report_errors=report_errors,
+        )
+
+    told = [
+        call for call in post_message.call_args_list
+        if 'unable to talk to Zendesk' in call[0][3]
+    ]
+    assert len(told) == (1 if report_errors else 0)
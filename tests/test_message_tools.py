@@ -9,8 +9,8 @@ from zenslackchat import message_tools
 from zenslackchat.models import PagerDutyApp
 from zenslackchat.message_tools import is_resolved
 from zenslackchat.message_tools import messages_for_slack
-from zenslackchat.message_tools import message_who_is_on_call
-from zenslackchat.message_tools import message_issue_zendesk_url
+from zenslackchat.message_tools import message_welcome
+from zenslackchat.message_tools import welcome_message
 
 
 UTC = timezone.utc
@@ -38,8 +38,8 @@ def test_is_resolve(resolve_command, expected):
 
 
 @patch('zenslackchat.message_tools.post_message')
-def test_message_issue_zendesk_url_tools(post_message, db, log):
-    """Test slack message for the zendesk issue link.
+def test_message_welcome_posts_once(post_message, db, log):
+    """Test the one slack message for a new issue.
     """
     channel_id = 'slack-channel-id'
     chat_id = 'slack-chat-id'
@@ -47,35 +47,75 @@ def test_message_issue_zendesk_url_tools(post_message, db, log):
     slack_client = MagicMock()
     zendesk_uri = 'https://z.e.n.d.e.s.k/'
 
-    message_issue_zendesk_url(
+    message_welcome(
         slack_client, zendesk_uri, ticket_id, chat_id, channel_id
     )
-    
+
     # Verify the what should be sent to slack:
-    post_message.assert_called_with(
+    post_message.assert_called_once_with(
         slack_client,
         'slack-chat-id',
         'slack-channel-id',
-        'Hello, your new support request is https://z.e.n.d.e.s.k/ticket-id'
+        'Hello, your new support request is https://z.e.n.d.e.s.k/ticket-id',
+        blocks=[{
+            'type': 'section',
+            'text': {
+                'type': 'mrkdwn',
+                'text': (
+                    'Hello, your new support request is '
+                    '<https://z.e.n.d.e.s.k/ticket-id|ticket-id>'
+                ),
+            },
+        }]
+    )
+
+
+def test_welcome_message_with_on_call_and_out_of_hours(log):
+    """Test everything is in the one message when known.
+    """
+    text, blocks = welcome_message(
+        'https://z.e.n.d.e.s.k', '32',
+        on_call=dict(primary='Fred <Sprocket>', secondary='Tony Tiger'),
+        out_of_hours='Call 999 for help.'
+    )
+
+    assert text == (
+        'Hello, your new support request is https://z.e.n.d.e.s.k/32\n\n'
+        '📧 Primary on call: Fred <Sprocket>\n'
+        'ℹ️ Secondary on call: Tony Tiger.\n\n'
+        'Call 999 for help.'
     )
+    assert [block['type'] for block in blocks] == [
+        'section', 'section', 'divider', 'section'
+    ]
+    assert [field['text'] for field in blocks[1]['fields']] == [
+        '*📧 Primary on call*\nFred &lt;Sprocket&gt;',
+        '*ℹ️ Secondary on call*\nTony Tiger',
+    ]
+    assert blocks[3]['text']['text'] == 'Call 999 for help.'
 
 
+@patch('zenslackchat.models.utcnow')
 @patch('zenslackchat.message_tools.post_message')
 @patch('zenslackchat.models.APISession.get')
-def test_message_who_is_on_call(session_get, post_message, db, log):
-    """Test the message sent / not sent for who is on call.
+def test_message_who_is_on_call(session_get, post_message, utcnow, db, log):
+    """Test who is on call is / is not in the welcome message.
     """
     channel_id = 'slack-channel-id'
     chat_id = 'slack-chat-id'
     slack_client = MagicMock()
 
-    # With no PagerDutyApp set up then no message should be sent:
-    message_who_is_on_call(
-        PagerDutyApp.on_call(), slack_client, chat_id, channel_id
+    # With no PagerDutyApp set up then no one on call is mentioned:
+    message_welcome(
+        slack_client, 'https://z', '32', chat_id, channel_id,
+        on_call=PagerDutyApp.on_call()
     )
-    post_message.assert_not_called()    
+    assert 'on call' not in post_message.call_args[0][3]
     post_message.reset_mock()
 
+    # Who is on call is looked up for now:
+    utcnow.return_value = _utc(datetime(2020, 12, 3, 9, 0))
+
     # Configure PageDurty and test the message sent:
     pd = PagerDutyApp(
         access_token='my-access-token',
@@ -137,8 +177,8 @@ def test_message_who_is_on_call(session_get, post_message, db, log):
                     "self": "https://api...etc",
                     "html_url": "https://uktrade...etc"
                 },
-                "start": "2020-12-02T08:00:00Z",
-                "end": "2020-12-02T22:00:00Z"
+                "start": "2020-12-03T08:00:00Z",
+                "end": "2020-12-03T22:00:00Z"
             }
         ],
         "limit": 25,
@@ -148,20 +188,23 @@ def test_message_who_is_on_call(session_get, post_message, db, log):
     }
     session_get.return_value.json = loads
     message = (
+        "Hello, your new support request is https://z/32\n\n"
         "📧 Primary on call: Fred Sprocket\n"
         "ℹ️ Secondary on call: Tony Tiger."
     )
-    message_who_is_on_call(
-        PagerDutyApp.on_call(), slack_client, chat_id, channel_id
+    message_welcome(
+        slack_client, 'https://z', '32', chat_id, channel_id,
+        on_call=PagerDutyApp.on_call()
     )
 
     # Verify the what should be sent to slack:
-    post_message.assert_called_with(
+    post_message.assert_called_once()
+    assert post_message.call_args[0] == (
         slack_client,
         'slack-chat-id',
         'slack-channel-id',
         message
-    )    
+    )
 
 
 @pytest.mark.parametrize(
@@ -3,8 +3,15 @@ from unittest.mock import patch
 from unittest.mock import MagicMock
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
 from django.test import TestCase
 
+from zenslackchat import redis_store
+from zenslackchat.clients import AsyncAPIClient
+from zenslackchat.models import OnCallWindow
+from zenslackchat.models import PagerDutyApp
 from zenslackchat.models import ZenSlackChat
 from zenslackchat.models import NotFoundError
 from zenslackchat.models import OutOfHoursInformation
@@ -227,3 +234,151 @@ def test_no_open_issues(db):
     """Verify I get no open issues when DB is empty.
     """
     assert ZenSlackChat.open_issues() == []
+
+
+def test_async_on_call(log):
+    """Test the on call contacts are recovered using the async client.
+    """
+    received = []
+
+    async def oncalls(request):
+        received.append(request)
+        return web.json_response({'oncalls': [
+            {'escalation_level': 2, 'user': {'summary': 'Bob Sprocket'}},
+            {'escalation_level': 1, 'user': {'summary': 'Alice Cog'}},
+        ]})
+
+    async def on_call():
+        app = web.Application()
+        app.router.add_get('/oncalls', oncalls)
+        async with TestServer(app) as server:
+            client = AsyncAPIClient(
+                str(server.make_url('/')),
+                headers={'Authorization': 'Bearer the-token'}
+            )
+            with patch.object(PagerDutyApp, 'async_client') as async_client:
+                async_client.return_value = client
+                return await PagerDutyApp.async_on_call()
+
+    override = {'PAGERDUTY_ESCALATION_POLICY_ID': 'PABC123'}
+    with patch.dict('webapp.settings.__dict__', override):
+        result = async_to_sync(on_call)()
+
+    assert result == dict(primary='Alice Cog', secondary='Bob Sprocket')
+    assert received[0].headers['Authorization'] == 'Bearer the-token'
+    assert received[0].query['escalation_policy_ids[]'] == 'PABC123'
+
+
+def oncall(level, name, start, end):
+    return {
+        'escalation_level': level,
+        'user': {'summary': name},
+        'start': start,
+        'end': end,
+    }
+
+
+@patch('zenslackchat.tasks.prefetch_on_call')
+@patch.object(PagerDutyApp, 'client')
+def test_on_call_uses_the_prefetched_windows(client, prefetch_task, log, db):
+    """Verify on call is looked up locally and refreshed in the background
+    once out of date.
+    """
+    now = datetime.datetime.now(UTC)
+    later = now + datetime.timedelta(hours=12)
+
+    client.return_value.get.return_value.json.return_value = {
+        'oncalls': [
+            oncall(2, 'Bob Sprocket', None, None),
+            oncall(1, 'Alice Cog', '2020-12-03T08:00:00Z', now.isoformat()),
+            oncall(1, 'Fred Bolt', now.isoformat(), None),
+        ],
+        'more': False,
+    }
+
+    override = {
+        'PAGERDUTY_ESCALATION_POLICY_ID': 'PABC123',
+        'PAGERDUTY_ONCALL_REFRESH': 900,
+    }
+    with patch.dict('webapp.settings.__dict__', override):
+        # Nothing stored yet so PagerDuty is asked:
+        assert PagerDutyApp.on_call(later) == dict(
+            primary='Fred Bolt', secondary='Bob Sprocket'
+        )
+        params = client.return_value.get.call_args[1]['params']
+        assert params['escalation_policy_ids[]'] == 'PABC123'
+        assert OnCallWindow.objects.count() == 3
+
+        # Looked up locally from now on:
+        client.return_value.get.reset_mock()
+        assert PagerDutyApp.on_call(
+            datetime.datetime(2020, 12, 3, 9, 0, tzinfo=UTC)
+        ) == dict(primary='Alice Cog', secondary='Bob Sprocket')
+        client.return_value.get.assert_not_called()
+        prefetch_task.delay.assert_not_called()
+
+        # Out of date windows are still used while a refresh is queued once:
+        redis_store.connection().set(
+            OnCallWindow.fetched_key('PABC123'),
+            (now - datetime.timedelta(hours=1)).isoformat()
+        )
+        for _ in range(2):
+            assert PagerDutyApp.on_call(later) == dict(
+                primary='Fred Bolt', secondary='Bob Sprocket'
+            )
+        client.return_value.get.assert_not_called()
+        prefetch_task.delay.assert_called_once_with()
+
+
+@patch('zenslackchat.tasks.prefetch_on_call')
+@patch.object(PagerDutyApp, 'client')
+def test_on_call_with_no_one_on_call(client, prefetch_task, log, db):
+    """Verify an empty prefetch is remembered rather than PagerDuty being
+    asked again for every new issue.
+    """
+    client.return_value.get.return_value.json.return_value = {
+        'oncalls': [], 'more': False
+    }
+
+    override = {
+        'PAGERDUTY_ESCALATION_POLICY_ID': 'PABC123',
+        'PAGERDUTY_ONCALL_REFRESH': 900,
+    }
+    with patch.dict('webapp.settings.__dict__', override):
+        for _ in range(3):
+            assert PagerDutyApp.on_call() == {}
+
+    client.return_value.get.assert_called_once()
+    prefetch_task.delay.assert_not_called()
+    assert OnCallWindow.objects.count() == 0
+    assert OnCallWindow.last_fetched('PABC123') is not None
+
+
+@patch.object(PagerDutyApp, 'client')
+def test_on_call_when_pagerduty_is_down(client, log, db):
+    """Verify no contacts are returned rather than raising.
+    """
+    client.return_value.get.side_effect = ConnectionError('down')
+    assert PagerDutyApp.on_call() == {}
+
+
+def test_ticket_status_mirror(log, db):
+    """Verify an out of order status change doesn't replace a newer one.
+    """
+    ZenSlackChat.open('C019JUGAGTS', '1598021907.003600', ticket_id='83')
+    issue = ZenSlackChat.get('C019JUGAGTS', '1598021907.003600')
+    assert issue.ticket_status == ''
+    assert issue.ticket_updated_at is None
+
+    newer = datetime.datetime(2021, 3, 9, 10, 0, tzinfo=UTC)
+    older = datetime.datetime(2021, 3, 9, 9, 0, tzinfo=UTC)
+    assert ZenSlackChat.mirror_ticket('83', 'Pending', newer) == 1
+    assert ZenSlackChat.mirror_ticket(83, 'open', older) == 0
+
+    issue.refresh_from_db()
+    assert issue.ticket_status == 'pending'
+    assert issue.ticket_updated_at == newer
+
+    ZenSlackChat.resolve('C019JUGAGTS', '1598021907.003600')
+    issue.refresh_from_db()
+    assert issue.ticket_status == 'closed'
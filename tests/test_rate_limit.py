@@ -0,0 +1,149 @@
+import threading
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from zenslackchat import metrics
+from zenslackchat import rate_limit
+from zenslackchat.clients import AsyncAPIClient
+from zenslackchat.clients import pooled_session
+
+
+@pytest.mark.parametrize(
+    ('url', 'expected'),
+    [
+        ('https://www.slack.com/api/chat.postMessage', 'slack:chat.postMessage'),
+        ('https://slack.com/api/users.info?user=U1', 'slack:users.info'),
+        ('https://staging.zendesk.com/api/v2/tickets/1.json', 'zendesk'),
+        ('https://api.pagerduty.com/oncalls', 'pagerduty'),
+        ('https://example.com/', None),
+    ]
+)
+def test_bucket_for(url, expected):
+    assert rate_limit.bucket_for(url) == expected
+
+
+def test_limits_can_be_changed():
+    assert rate_limit.limit_for('zendesk') == 700
+
+    with patch.dict('webapp.settings.__dict__', {
+        'API_RATE_LIMITS': {'zendesk': 200, 'slack': 50}
+    }):
+        assert rate_limit.limit_for('zendesk') == 200
+        assert rate_limit.limit_for('slack:users.info') == 100
+        assert rate_limit.limit_for('slack:conversations.list') == 50
+        assert rate_limit.limit_for('pagerduty') == 900
+
+
+@patch('zenslackchat.rate_limit.time.sleep')
+def test_callers_wait_for_a_token(sleep, log):
+    """Verify a burst is allowed then callers queue, and a Retry-After stops
+    every caller.
+    """
+    # One a second, ten at once:
+    with patch.dict('webapp.settings.__dict__', {
+        'API_RATE_LIMITS': {'zendesk': 60}
+    }):
+        for _ in range(10):
+            assert rate_limit.acquire('zendesk', max_wait=30) == 0
+        sleep.assert_not_called()
+
+        assert rate_limit.acquire('zendesk', max_wait=30) == pytest.approx(
+            1, abs=0.1
+        )
+        assert rate_limit.acquire('zendesk', max_wait=30) == pytest.approx(
+            2, abs=0.1
+        )
+
+        rate_limit.block('zendesk', 20)
+        with pytest.raises(rate_limit.RateLimited) as error:
+            rate_limit.acquire('zendesk', max_wait=5)
+        assert error.value.retry_after == pytest.approx(21, abs=0.1)
+
+    counts = metrics.snapshot()
+    assert counts['rate_limit.zendesk.wait.count'] == 2
+    assert counts['rate_limit.zendesk.refused'] == 1
+
+
+class TooManyHandler(BaseHTTPRequestHandler):
+    """Return a 429 for the first request only."""
+    protocol_version = 'HTTP/1.1'
+    received = 0
+
+    def do_GET(self):
+        TooManyHandler.received += 1
+        status = 429 if TooManyHandler.received == 1 else 200
+        self.send_response(status)
+        self.send_header('Retry-After', '7')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@patch('zenslackchat.rate_limit.block')
+@patch('zenslackchat.rate_limit.bucket_for', return_value='zendesk')
+def test_a_429_is_sent_again_after_backing_off(bucket_for, block, log):
+    """Verify callers get the retried response rather than the 429.
+    """
+    TooManyHandler.received = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TooManyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = pooled_session().get(
+            f'http://127.0.0.1:{server.server_port}/api/v2/tickets/1.json'
+        )
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert response.status_code == 200
+    assert TooManyHandler.received == 2
+    block.assert_called_once_with('zendesk', 7.0)
+    assert metrics.snapshot()['rate_limit.zendesk.429'] == 1
+
+
+@patch('zenslackchat.rate_limit.block')
+@patch('zenslackchat.rate_limit.bucket_for', return_value='zendesk')
+def test_async_client_sends_a_429_again(bucket_for, block, log):
+    """Verify the AsyncAPIClient backs off in the same way.
+    """
+    redis_threads = set()
+    block.side_effect = lambda *args: redis_threads.add(threading.get_ident())
+    take = rate_limit._take
+
+    def _take(*args):
+        redis_threads.add(threading.get_ident())
+        return take(*args)
+
+    TooManyHandler.received = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TooManyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def get():
+        nonlocal loop_thread
+        loop_thread = threading.get_ident()
+        base_url = f'http://127.0.0.1:{server.server_port}/api/v2/'
+        async with AsyncAPIClient(base_url) as client:
+            return await client.get('tickets/1.json')
+
+    loop_thread = None
+    try:
+        with patch('zenslackchat.rate_limit._take', _take):
+            assert async_to_sync(get)() == {}
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert TooManyHandler.received == 2
+    block.assert_called_once_with('zendesk', 7.0)
+    # Redis was only used off the event loop's thread:
+    assert loop_thread not in redis_threads
+    assert metrics.snapshot()['rate_limit.zendesk.429'] == 1
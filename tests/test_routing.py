@@ -0,0 +1,96 @@
+import signal
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from zenslackchat import routing
+
+
+@pytest.mark.parametrize(
+    ('event', 'expected'),
+    [
+        # top level message
+        ({'ts': '1597940362.013100'}, '1597940362.013100'),
+        # replies are keyed on their parent
+        (
+            {'ts': '1602065965.003200', 'thread_ts': '1597940362.013100'},
+            '1597940362.013100'
+        ),
+        ({}, ''),
+    ]
+)
+def test_thread_key(event, expected):
+    assert routing.thread_key(event) == expected
+
+
+def test_replies_are_routed_to_the_same_queue_as_their_thread():
+    """Verify a thread's messages stay on one queue.
+    """
+    parent = {'ts': '1597940362.013100'}
+    reply = {'ts': '1602065965.003200', 'thread_ts': '1597940362.013100'}
+
+    for shards in (1, 2, 8, 32):
+        queue = routing.queue_for(routing.thread_key(parent), shards)
+        assert queue in routing.all_queues(shards)
+        assert routing.queue_for(routing.thread_key(reply), shards) == queue
+
+
+def test_threads_are_spread_across_shards_and_rarely_move():
+    """Verify the consistent hash uses all shards and adding one shard only
+    moves a small share of the threads.
+    """
+    keys = [f'1597940{i:03d}.013100' for i in range(1000)]
+
+    before = [routing.jump_hash(key, 8) for key in keys]
+    assert set(before) == set(range(8))
+
+    after = [routing.jump_hash(key, 9) for key in keys]
+    moved = [(b, a) for b, a in zip(before, after) if b != a]
+    # Only moves to the new shard, around 1/9th of keys.
+    assert all(a == 8 for b, a in moved)
+    assert 50 < len(moved) < 200
+
+
+def test_single_shard_default():
+    """Verify everything goes to the one queue by default.
+    """
+    assert routing.all_queues(1) == ['zenslackchat.events.0']
+    assert routing.queue_for('1597940362.013100', 1) == 'zenslackchat.events.0'
+    assert routing.queue_for('1597940362.013100', 0) == 'zenslackchat.events.0'
+
+
+@patch('zenslackchat.management.commands.event_workers.subprocess.Popen')
+def test_event_workers_consume_every_shard(Popen, log):
+    """Verify one single threaded worker is started for each queue.
+    """
+    Popen.return_value.poll.return_value = 0
+    Popen.return_value.wait.return_value = 0
+
+    call_command('event_workers', '--shards=3')
+
+    queues = []
+    for (command,), _ in Popen.call_args_list:
+        assert '--concurrency=1' in command
+        assert '--prefetch-multiplier=1' in command
+        queues.append(command[command.index('-Q') + 1])
+    assert queues == routing.all_queues(3)
+
+
+@patch('zenslackchat.management.commands.event_workers.subprocess.Popen')
+def test_event_workers_stop_together(Popen, log):
+    """Verify the other workers are stopped when one dies.
+    """
+    running, dead = MagicMock(), MagicMock()
+    running.poll.return_value = None
+    running.wait.return_value = 0
+    dead.poll.return_value = 1
+    dead.wait.return_value = 1
+    Popen.side_effect = [running, dead]
+
+    with pytest.raises(CommandError):
+        call_command('event_workers', '--shards=2')
+
+    running.send_signal.assert_called_once_with(signal.SIGTERM)
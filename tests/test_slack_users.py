@@ -0,0 +1,132 @@
+from datetime import timedelta
+from unittest.mock import patch
+from unittest.mock import MagicMock
+
+from django.core.management import call_command
+
+from zenslackchat import slack_users
+from zenslackchat import eventsview
+from zenslackchat.models import utcnow
+from zenslackchat.models import SlackUser
+
+
+def slack_user(user_id, name, email='', deleted=False):
+    return {
+        'id': user_id,
+        'deleted': deleted,
+        'real_name': name,
+        'profile': {'real_name': name, 'email': email},
+    }
+
+
+def test_unknown_users_are_only_asked_for_once(log, db):
+    """Verify Slack is only asked about a user not in the directory.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value.data = {
+        'user': slack_user('UGF7MRWMS', 'Bob Sprocket', 'bob@example.com')
+    }
+
+    for _ in range(2):
+        assert slack_users.profile(slack_client, 'UGF7MRWMS') == dict(
+            real_name='Bob Sprocket', email='bob@example.com'
+        )
+    slack_client.users_info.assert_called_once_with(user='UGF7MRWMS')
+
+    # Still known once the in memory copy is gone:
+    slack_users.clear()
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['email'] == (
+        'bob@example.com'
+    )
+    slack_client.users_info.assert_called_once_with(user='UGF7MRWMS')
+
+
+def test_users_without_an_email_or_out_of_date_are_asked_for_again(log, db):
+    """Verify a stored user is refreshed rather than dropped for good.
+    """
+    slack_client = MagicMock()
+    slack_client.users_info.return_value.data = {
+        'user': slack_user('UGF7MRWMS', 'Bob Sprocket', 'bob@example.com')
+    }
+    SlackUser.store(slack_user('UGF7MRWMS', 'Bob Sprocket'))
+
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['email'] == (
+        'bob@example.com'
+    )
+    slack_client.users_info.assert_called_once_with(user='UGF7MRWMS')
+
+    # Out of date:
+    slack_users.clear()
+    SlackUser.objects.update(updated_at=utcnow() - timedelta(days=2))
+    slack_client.users_info.return_value.data = {
+        'user': slack_user('UGF7MRWMS', 'Bob Cog', 'bob@example.com')
+    }
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['real_name'] == (
+        'Bob Cog'
+    )
+    assert slack_client.users_info.call_count == 2
+
+    # If Slack can't be asked the stored copy is used:
+    slack_users.clear()
+    SlackUser.objects.update(updated_at=utcnow() - timedelta(days=2))
+    slack_client.users_info.side_effect = ValueError('Slack is down')
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['real_name'] == (
+        'Bob Cog'
+    )
+
+
+def test_user_events_update_the_directory(log, db):
+    """Verify user_change events are stored even though they aren't from the
+    support channel.
+    """
+    slack_client = MagicMock()
+    SlackUser.store(slack_user('UGF7MRWMS', 'Bob Sprocket', 'bob@example.com'))
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['real_name'] == (
+        'Bob Sprocket'
+    )
+
+    envelope = {
+        'event_id': 'Ev01',
+        'event': {
+            'type': 'user_change',
+            'user': slack_user('UGF7MRWMS', 'Bob Cog', 'bob@example.com'),
+        }
+    }
+    with patch('zenslackchat.eventsview.submit_event') as submit_event:
+        assert eventsview.accept_envelope(envelope) is True
+    submit_event.assert_not_called()
+
+    assert slack_users.profile(slack_client, 'UGF7MRWMS')['real_name'] == (
+        'Bob Cog'
+    )
+    slack_client.users_info.assert_not_called()
+
+
+@patch('zenslackchat.management.commands.sync_slack_users.SlackApp')
+def test_sync_slack_users_pages_through_the_workspace(SlackApp, log, db):
+    """Verify every page of users_list is stored.
+    """
+    SlackUser.store(slack_user('U1', 'Old Name'))
+
+    first = MagicMock()
+    first.data = {
+        'members': [slack_user('U1', 'Alice Cog'), slack_user('U2', 'Bob')],
+        'response_metadata': {'next_cursor': 'page2'},
+    }
+    second = MagicMock()
+    second.data = {
+        'members': [slack_user('U3', 'Sue', deleted=True)],
+        'response_metadata': {'next_cursor': ''},
+    }
+    users_list = SlackApp.client.return_value.users_list
+    users_list.side_effect = [first, second]
+
+    call_command('sync_slack_users', '--page-size=2')
+
+    assert users_list.call_args_list[1][1] == dict(cursor='page2', limit=2)
+    stored = SlackUser.objects.order_by('user_id')
+    assert [(user.user_id, user.real_name, user.deleted) for user in stored] == [
+        ('U1', 'Alice Cog', False),
+        ('U2', 'Bob', False),
+        ('U3', 'Sue', True),
+    ]
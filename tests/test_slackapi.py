@@ -1,6 +1,13 @@
 from unittest.mock import MagicMock
 
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
+
 from zenslackchat import slack_api
+from zenslackchat.clients import AsyncAPIClient
+from zenslackchat.clients import AsyncAPIError
 
 
 def test_slack_message_url(log):
@@ -56,3 +63,61 @@ def test_post_message(log):
         text='hello dude!',
         thread_ts='chat_id_12'
     )
+
+
+def test_post_message_with_blocks(log):
+    mock_web_client = MagicMock()
+    blocks = [{'type': 'divider'}]
+
+    slack_api.post_message(
+        mock_web_client, 'chat_id_12', 'channel_id_32', 'hello', blocks=blocks
+    )
+
+    mock_web_client.chat_postMessage.assert_called_with(
+        channel='channel_id_32',
+        text='hello',
+        thread_ts='chat_id_12',
+        blocks=blocks
+    )
+
+
+def test_async_create_thread_and_post_message(log):
+    """Verify the async helpers make the same chat.postMessage calls.
+    """
+    received = []
+
+    async def post_message(request):
+        data = await request.json()
+        received.append(data)
+        if data['channel'] == 'unknown':
+            return web.json_response({'ok': False, 'error': 'not_in_channel'})
+        return web.json_response({'ok': True, 'message': {'ts': '123.456'}})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/chat.postMessage', post_message)
+        async with TestServer(app) as server:
+            async with AsyncAPIClient(str(server.make_url('/'))) as client:
+                chat_id = await slack_api.async_create_thread(
+                    client, 'channel_id_32', 'help!'
+                )
+                await slack_api.async_post_message(
+                    client, chat_id, 'channel_id_32', 'hello dude!'
+                )
+                with pytest.raises(AsyncAPIError) as error:
+                    await slack_api.async_post_message(
+                        client, chat_id, 'unknown', 'hello?'
+                    )
+        return chat_id, error.value
+
+    chat_id, error = async_to_sync(run)()
+
+    assert chat_id == '123.456'
+    assert error.body == 'not_in_channel'
+    assert received[:2] == [
+        {'channel': 'channel_id_32', 'text': 'help!'},
+        {
+            'channel': 'channel_id_32', 'text': 'hello dude!',
+            'thread_ts': '123.456'
+        },
+    ]
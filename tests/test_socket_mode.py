@@ -0,0 +1,192 @@
+import time
+import asyncio
+import threading
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from zenslackchat.socket_mode import SocketModeWorker
+from zenslackchat.management.commands.socket_mode import on_envelope
+
+
+def envelope(envelope_id, ts, thread_ts=None):
+    message = {
+        'envelope_id': envelope_id,
+        'type': 'events_api',
+        'accepts_response_payload': False,
+        'retry_attempt': 0,
+        'retry_reason': '',
+        'payload': {
+            'token': 'verification-token',
+            'event_id': f'Ev{envelope_id}',
+            'event': {
+                'channel': 'C0192NP3TFG',
+                'text': 'hello there!',
+                'ts': ts,
+                'type': 'message',
+                'user': 'UGF7MRWMS'
+            },
+        },
+    }
+    if thread_ts:
+        message['payload']['event']['thread_ts'] = thread_ts
+    return message
+
+
+class FakeSlack(object):
+    """Local stand in for Slack's socket mode endpoints.
+    """
+    def __init__(self, messages):
+        self.messages = messages
+        self.acks = []
+        self.tokens = []
+        self.app = web.Application()
+        self.app.router.add_post('/api/apps.connections.open', self.open)
+        self.app.router.add_get('/link', self.link)
+        self.server = TestServer(self.app)
+
+    async def open(self, request):
+        self.tokens.append(request.headers['Authorization'])
+        url = str(self.server.make_url('/link'))
+        return web.json_response({'ok': True, 'url': url})
+
+    async def link(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        await websocket.send_json({'type': 'hello'})
+
+        for message in self.messages:
+            await websocket.send_json(message)
+            ack = await websocket.receive_json(timeout=5)
+            self.acks.append(ack)
+
+        await websocket.send_json(
+            {'type': 'disconnect', 'reason': 'refresh_requested'}
+        )
+        await websocket.close()
+        return websocket
+
+
+def test_events_are_acked_in_band_and_handed_on(log):
+    """Verify each envelope is acknowledged and its payload handled.
+    """
+    messages = [
+        envelope('e1', '1603983778.011500'),
+        # not an event, acked but not handed on:
+        {'envelope_id': 'e2', 'type': 'slash_commands', 'payload': {}},
+        envelope('e3', '1603983999.011500'),
+    ]
+    handled = []
+    lock = threading.Lock()
+
+    def on_envelope(payload, retry_num, retry_reason):
+        with lock:
+            handled.append((payload['event']['ts'], retry_num))
+
+    async def run():
+        fake = FakeSlack(messages)
+        await fake.server.start_server()
+        try:
+            worker = SocketModeWorker(
+                'xapp-1-token',
+                on_envelope,
+                max_in_flight=2,
+                api_uri=str(fake.server.make_url('/api/')),
+            )
+            async with ClientSession() as session:
+                await worker.run_once(session)
+                await worker.drain()
+
+        finally:
+            await fake.server.close()
+
+        return fake
+
+    fake = asyncio.run(run())
+
+    assert fake.tokens == ['Bearer xapp-1-token']
+    assert fake.acks == [
+        {'envelope_id': 'e1'}, {'envelope_id': 'e2'}, {'envelope_id': 'e3'}
+    ]
+    assert sorted(handled) == [
+        ('1603983778.011500', 0), ('1603983999.011500', 0)
+    ]
+
+
+def test_each_thread_is_handled_in_order(log):
+    """Verify a reply waits for its thread's earlier envelope, while other
+    threads carry on.
+    """
+    messages = [
+        envelope('e1', '1603983778.011500'),
+        envelope('e2', '1603983800.000100', thread_ts='1603983778.011500'),
+        envelope('e3', '1603983999.011500'),
+    ]
+    handled = []
+    lock = threading.Lock()
+
+    def on_envelope(payload, retry_num, retry_reason):
+        if payload['event_id'] == 'Eve1':
+            time.sleep(0.2)
+        with lock:
+            handled.append(payload['event_id'])
+
+    async def run():
+        fake = FakeSlack(messages)
+        await fake.server.start_server()
+        try:
+            worker = SocketModeWorker(
+                'xapp-1-token',
+                on_envelope,
+                max_in_flight=3,
+                api_uri=str(fake.server.make_url('/api/')),
+            )
+            async with ClientSession() as session:
+                await worker.run_once(session)
+                await worker.drain()
+
+        finally:
+            await fake.server.close()
+
+        return worker
+
+    worker = asyncio.run(run())
+
+    # The other thread didn't wait, the reply did:
+    assert handled == ['Eve3', 'Eve1', 'Eve2']
+    assert worker._threads == {}
+
+
+def test_unexpected_errors_reconnect(log):
+    """Verify the worker keeps going after any connection error.
+    """
+    worker = SocketModeWorker('xapp-1-token', None, reconnect_delay=0)
+    calls = []
+
+    async def run_once(session):
+        calls.append(session)
+        if len(calls) == 1:
+            raise asyncio.TimeoutError()
+        worker.stop()
+
+    worker.run_once = run_once
+    asyncio.run(worker.run())
+
+    assert len(calls) == 2
+
+
+@patch('zenslackchat.management.commands.socket_mode.close_old_connections')
+@patch('zenslackchat.management.commands.socket_mode.accept_envelope')
+def test_socket_mode_feeds_the_events_intake(
+    accept_envelope, close_old_connections, log
+):
+    """Verify the socket mode envelope goes through the same intake as HTTP.
+    """
+    payload = envelope('e1', '1603983778.011500')['payload']
+
+    on_envelope(payload, 1, 'timeout')
+
+    accept_envelope.assert_called_once_with(payload, 1, 'timeout')
+    close_old_connections.assert_called()
@@ -1,3 +1,4 @@
+import time
 from unittest.mock import patch
 from unittest.mock import MagicMock
 
@@ -9,8 +10,6 @@ from zenslackchat.message import is_resolved
 from zenslackchat.models import ZendeskApp
 from zenslackchat.models import ZenSlackChat
 from zenslackchat.message import IGNORED_SUBTYPES
-from zenslackchat.message import message_who_is_on_call
-from zenslackchat.message_tools import message_issue_zendesk_url
 from zenslackchat.zendesk_email_to_slack import email_from_zendesk
 
 
@@ -36,13 +35,11 @@ class FakeUserResponse(object):
 
 @patch('zenslackchat.zendesk_email_to_slack.get_ticket')
 @patch('zenslackchat.zendesk_email_to_slack.add_comment')
-@patch('zenslackchat.zendesk_email_to_slack.message_issue_zendesk_url')
-@patch('zenslackchat.zendesk_email_to_slack.message_who_is_on_call')
+@patch('zenslackchat.zendesk_email_to_slack.message_welcome')
 @patch('zenslackchat.zendesk_email_to_slack.SlackApp')
 @patch('zenslackchat.zendesk_email_to_slack.ZendeskApp')
 def test_email_from_zendesk_is_added_for_tracking(
-    ZendeskApp, SlackApp, message_who_is_on_call, message_issue_zendesk_url, 
-    add_comment, get_ticket, log, db
+    ZendeskApp, SlackApp, message_welcome, add_comment, get_ticket, log, db
 ):
     """Test linking an email created issue into our DB for tracking.
     """
@@ -114,23 +111,92 @@ def test_email_from_zendesk_is_added_for_tracking(
     assert issue.chat_id == '1597940362.013100'
     assert issue.ticket_id == '32'
 
-    # Check the args to the call that would post a message:
-    message_issue_zendesk_url.assert_called_with(
+    # Check the args to the call that would post a message. No pager duty
+    # is configured so there is no one on call:
+    message_welcome.assert_called_once_with(
         slack_client,
         'https://z.e.n.d.e.s.k',
         '32',
         '1597940362.013100',
-        'C024JUTACTS'
-    )
-
-    # No pager duty configured so no message about this:
-    message_who_is_on_call.assert_called_with(
-        {}, slack_client, '1597940362.013100', 'C024JUTACTS'
+        'C024JUTACTS',
+        on_call={}
     )
 
     # Zendesk issue will be updated with link to slack issue SRE team looks at
     slack_chat_url = 'https://s.l.a.c.k/C024JUTACTS/p1597940362013100'
     add_comment.assert_called_with(
-        zendesk_client, ticket, 
-        f'The SRE team is aware of your issue on Slack here {slack_chat_url}.'
+        zendesk_client, '32',
+        f'The SRE team is aware of your issue on Slack here {slack_chat_url}.',
+        author_id=ZendeskApp.identity()
     )
+
+    # Only the assignment is sent when routing comments back to slack:
+    change = zendesk_client.tickets.update.call_args[0][0]
+    assert change.to_dict(serialize=True) == {
+        'id': 32,
+        'assignee_id': '1234',
+        'group_id': '7890',
+        'external_id': '1597940362.013100',
+    }
+
+
+@patch('zenslackchat.zendesk_email_to_slack.get_ticket')
+@patch('zenslackchat.zendesk_email_to_slack.create_thread')
+@patch('zenslackchat.zendesk_email_to_slack.add_comment')
+@patch('zenslackchat.zendesk_email_to_slack.message_welcome')
+@patch('zenslackchat.zendesk_email_to_slack.SlackApp')
+@patch('zenslackchat.zendesk_email_to_slack.ZendeskApp')
+def test_replayed_email_only_updates_zendesk_again(
+    ZendeskApp, SlackApp, message_welcome, add_comment, create_thread,
+    get_ticket, log, db
+):
+    """Test an email which failed after its thread was made isn't posted
+    twice.
+    """
+    zendesk_client = MagicMock()
+    ZendeskApp.client.return_value = zendesk_client
+    ZenSlackChat.open('C024JUTACTS', '1597940362.013100', ticket_id='32')
+    settings = dict(
+        SRE_SUPPORT_CHANNEL='C024JUTACTS',
+        ZENDESK_USER_ID='1234',
+        ZENDESK_GROUP_ID='7890',
+        SLACK_WORKSPACE_URI='https://s.l.a.c.k',
+    )
+
+    with patch.dict('webapp.settings.__dict__', settings):
+        email_from_zendesk({'ticket_id': 32}, MagicMock(), zendesk_client)
+
+    get_ticket.assert_not_called()
+    create_thread.assert_not_called()
+    message_welcome.assert_not_called()
+    assert ZenSlackChat.objects.count() == 1
+
+    # The existing thread is linked and commented on again:
+    change = zendesk_client.tickets.update.call_args[0][0]
+    assert change.to_dict(serialize=True)['external_id'] == '1597940362.013100'
+    assert add_comment.call_args[0][:2] == (zendesk_client, 32)
+    assert 'p1597940362013100' in add_comment.call_args[0][2]
+
+
+@patch('zenslackchat.zendesk_email_to_slack.add_comment')
+@patch('zenslackchat.zendesk_email_to_slack.assign_ticket')
+@patch('zenslackchat.zendesk_email_to_slack.SlackApp')
+@patch('zenslackchat.zendesk_email_to_slack.ZendeskApp')
+def test_comment_is_added_after_the_assignment(
+    ZendeskApp, SlackApp, assign_ticket, add_comment, log, db
+):
+    """Test the two ticket updates are never sent at the same time.
+    """
+    calls = []
+    assign_ticket.side_effect = (
+        lambda *args: time.sleep(0.1) or calls.append('assign')
+    )
+    add_comment.side_effect = lambda *args, **kwargs: calls.append('comment')
+    ZenSlackChat.open('C024JUTACTS', '1597940362.013100', ticket_id='32')
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'SRE_SUPPORT_CHANNEL': 'C024JUTACTS'}
+    ):
+        email_from_zendesk({'ticket_id': '32'}, MagicMock(), MagicMock())
+
+    assert calls == ['assign', 'comment']
@@ -1,9 +1,18 @@
 """
 """
+import asyncio
 from unittest.mock import patch
 from unittest.mock import MagicMock
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
+from zenpy.lib.exception import APIException
+
 from zenslackchat import zendesk_api
+from zenslackchat.fake_services import FakeZendesk
+from zenslackchat.clients import AsyncAPIError
+from zenslackchat.clients import AsyncAPIClient
 
 
 class FakeUserResponse(object):
@@ -144,22 +153,227 @@ def test_create_ticket(log):
     assert ticket.subject == subject
     assert ticket.recipient == recipient_email
     assert ticket.submitter_id == user_id
-    assert ticket.assingee_id == user_id
+    assert ticket.requester_id == user_id
+    assert ticket.assignee_id == user_id
     assert ticket.group_id == group_id
     assert ticket.comment.author_id == user_id
     msg = f'This is the message on slack {slack_message_url}.'
     assert ticket.comment.body == msg
 
 
+def test_new_ticket_sends_the_fields_zendesk_knows(log):
+    """Verify the requester and assignee are sent with their API names.
+    """
+    ticket = zendesk_api.new_ticket(
+        'slack-conversation-id', 100000000001, 200000000002,
+        'bob@example.com', 'printer out of ink', 'https://example.com/c/1'
+    )
+
+    sent = ticket.to_dict(serialize=True)
+    assert sent['requester_id'] == 100000000001
+    assert sent['assignee_id'] == 100000000001
+    assert sent['submitter_id'] == 100000000001
+    assert 'assingee_id' not in sent
+    assert 'requestor_id' not in sent
+
+
+def test_created_ticket_is_assigned_to_the_bot_user(log):
+    """Verify the ticket Zendesk stores has the assignee and requester set.
+    """
+    zendesk = FakeZendesk()
+
+    ticket = zendesk_api.create_ticket(
+        zendesk, 'slack-conversation-id', 100000000001, 200000000002,
+        'bob@example.com', 'printer out of ink', 'https://example.com/c/1'
+    )
+
+    stored = zendesk.tickets_by_id[ticket.id]
+    assert stored.assignee_id == 100000000001
+    assert stored.requester_id == 100000000001
+
+
+def closed_error():
+    """The error Zendesk gives for changing a closed ticket."""
+    return APIException('closed', response=MagicMock(
+        status_code=422, text='Status: closed prevents ticket update'
+    ))
+
+
 def test_close_ticket(log):
-    """Verify get_ticket when I expect to get a result.
+    """Verify only the status is sent to close a ticket, without a lookup.
     """
-    fake_ticket = FakeTicket(ticket_id=12345)
-    fake_ticket_audit = FakeTicketAudit(fake_ticket)
-    assert fake_ticket.status == 'open'
-    client = FakeApi(results=[fake_ticket], ticket_audit=fake_ticket_audit)
+    client = MagicMock()
 
-    returned = zendesk_api.close_ticket(client, 12345)
+    zendesk_api.close_ticket(client, '12345')
 
-    assert returned == fake_ticket
-    assert fake_ticket.status == 'closed'
+    client.tickets.assert_not_called()
+    change = client.tickets.update.call_args[0][0]
+    assert change.to_dict(serialize=True) == {'id': 12345, 'status': 'closed'}
+
+
+def test_close_ticket_which_is_already_closed(log):
+    """Verify closing a closed ticket is not an error.
+    """
+    client = MagicMock()
+    client.tickets.update.side_effect = closed_error()
+
+    assert zendesk_api.close_ticket(client, '12345') is None
+
+
+def test_add_comment_only_sends_the_comment(log):
+    """Verify a comment is added by ticket ID without a lookup.
+    """
+    client = MagicMock()
+
+    zendesk_api.add_comment(client, '12345', 'hello', author_id=42)
+
+    client.tickets.assert_not_called()
+    client.users.me.assert_not_called()
+    change = client.tickets.update.call_args[0][0]
+    assert change.to_dict(serialize=True) == {
+        'id': 12345,
+        'comment': {'author_id': 42, 'body': 'hello', 'id': None},
+    }
+
+
+def test_assign_ticket_only_sends_the_assignment(log):
+    """Verify assigning sends the assignee, group and external_id only.
+    """
+    client = MagicMock()
+
+    zendesk_api.assign_ticket(client, '12345', '100', '200', '1234.5678')
+
+    change = client.tickets.update.call_args[0][0]
+    assert change.to_dict(serialize=True) == {
+        'id': 12345,
+        'assignee_id': '100',
+        'group_id': '200',
+        'external_id': '1234.5678',
+    }
+
+
+def test_is_closed_error(log):
+    """Verify only Zendesk refusing a change to a closed ticket matches.
+    """
+    assert zendesk_api.is_closed_error(closed_error()) is True
+    assert zendesk_api.is_closed_error(AsyncAPIError(
+        422, '{"details": {"status": [{"description": "Status: closed '
+        'prevents ticket update"}]}}'
+    )) is True
+    assert zendesk_api.is_closed_error(AsyncAPIError(422, 'Invalid')) is False
+    assert zendesk_api.is_closed_error(AsyncAPIError(404, 'closed')) is False
+    assert zendesk_api.is_closed_error(ValueError('closed')) is False
+
+
+def fake_zendesk_app(received):
+    """An aiohttp app answering the Zendesk API calls zendesk_api makes."""
+    tickets = {
+        1: {'id': 1, 'status': 'open', 'external_id': '1.1'},
+        2: {'id': 2, 'status': 'open', 'external_id': '2.2'},
+    }
+
+    async def get_ticket(request):
+        ticket_id = int(request.match_info['id'])
+        if ticket_id not in tickets:
+            return web.json_response({'error': 'RecordNotFound'}, status=404)
+        return web.json_response({'ticket': tickets[ticket_id]})
+
+    async def create_ticket(request):
+        data = await request.json()
+        received.append(('POST', data))
+        ticket = dict(data['ticket'], id=3, status='new')
+        ticket.pop('comment')
+        tickets[3] = ticket
+        return web.json_response({'ticket': ticket, 'audit': {}}, status=201)
+
+    async def update_ticket(request):
+        data = await request.json()
+        received.append(('PUT', data))
+        ticket = tickets[int(request.match_info['id'])]
+        if ticket['status'] == 'closed':
+            return web.json_response({'details': {'status': [{
+                'description': 'Status: closed prevents ticket update'
+            }]}}, status=422)
+        ticket.update(data['ticket'])
+        ticket.pop('comment', None)
+        return web.json_response({'ticket': ticket})
+
+    async def me(request):
+        return web.json_response({'user': {'id': 42}})
+
+    app = web.Application()
+    app.router.add_get('/tickets/{id}.json', get_ticket)
+    app.router.add_put('/tickets/{id}.json', update_ticket)
+    app.router.add_post('/tickets.json', create_ticket)
+    app.router.add_get('/users/me.json', me)
+    return app
+
+
+def run_against_zendesk(work, received):
+    """Run work(client) against the fake Zendesk and return its result."""
+    async def run():
+        async with TestServer(fake_zendesk_app(received)) as server:
+            async with AsyncAPIClient(str(server.make_url('/'))) as client:
+                return await work(client)
+
+    return async_to_sync(run)()
+
+
+def test_async_get_tickets_at_once(log):
+    """Verify many tickets can be looked up together on one event loop.
+    """
+    async def work(client):
+        return await asyncio.gather(*[
+            zendesk_api.async_get_ticket(client, ticket_id)
+            for ticket_id in (1, 2, 99)
+        ])
+
+    first, second, missing = run_against_zendesk(work, [])
+
+    assert (first.id, first.external_id, first.status) == (1, '1.1', 'open')
+    assert second.id == 2
+    assert missing is None
+
+
+def test_async_create_ticket_sends_the_same_ticket(log):
+    """Verify the async create sends what the Zenpy client would.
+    """
+    received = []
+
+    async def work(client):
+        return await zendesk_api.async_create_ticket(
+            client, '1234.5678', '100', '200', 'bob@example.com',
+            'My printer is on fire!', 'https://example.com/p12345678'
+        )
+
+    ticket = run_against_zendesk(work, received)
+
+    assert ticket.id == 3
+    issue = zendesk_api.new_ticket(
+        '1234.5678', '100', '200', 'bob@example.com',
+        'My printer is on fire!', 'https://example.com/p12345678'
+    )
+    assert received == [('POST', {'ticket': issue.to_dict(serialize=True)})]
+
+
+def test_async_comment_and_close(log):
+    """Verify only the comment or status change is sent to update a ticket.
+    """
+    received = []
+
+    async def work(client):
+        await zendesk_api.async_add_comment(client, 1, 'hello')
+        closed = await zendesk_api.async_close_ticket(client, 1)
+        return closed, await zendesk_api.async_close_ticket(client, 1)
+
+    ticket, already_closed = run_against_zendesk(work, received)
+
+    assert ticket.status == 'closed'
+    assert already_closed is None
+    assert received == [
+        ('PUT', {'ticket': {
+            'id': 1, 'comment': {'author_id': 42, 'body': 'hello', 'id': None}
+        }}),
+        ('PUT', {'ticket': {'id': 1, 'status': 'closed'}}),
+        ('PUT', {'ticket': {'id': 1, 'status': 'closed'}}),
+    ]
@@ -4,13 +4,18 @@ from unittest.mock import patch
 from unittest.mock import MagicMock
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.test import RequestFactory, TestCase
 from rest_framework.test import APIRequestFactory
 
 from zenslackchat.models import SlackApp
 from zenslackchat.models import ZendeskApp
+from zenslackchat import intake
+from zenslackchat import routing
+from zenslackchat import metrics
 from zenslackchat import zendesk_webhooks
 from zenslackchat import zendesk_base_webhook
+from zenslackchat.tasks import process_zendesk_webhook
 
 
 def test_zendesk_request_is_rejected_with_missing_token_field():
@@ -25,7 +30,7 @@ def test_zendesk_request_is_rejected_with_missing_token_field():
         'ticket_id': '1430',
     }
     factory = APIRequestFactory()
-    view = zendesk_base_webhook.BaseWebHook.as_view()
+    view = async_to_sync(zendesk_base_webhook.BaseWebHook.as_view())
     request = factory.post(
         '/zendesk/webhook/', 
         zendesk_event,
@@ -44,7 +49,7 @@ def test_zendesk_request_token_is_incorrect():
         'ticket_id': '1430',
     }
     factory = APIRequestFactory()
-    view = zendesk_base_webhook.BaseWebHook.as_view()
+    view = async_to_sync(zendesk_base_webhook.BaseWebHook.as_view())
     request = factory.post(
         '/zendesk/webhook/', 
         zendesk_event,
@@ -57,11 +62,12 @@ def test_zendesk_request_token_is_incorrect():
     assert response.status_code == 403
 
 
+@patch('zenslackchat.zendesk_base_webhook.dead_letter')
 @patch('zenslackchat.zendesk_base_webhook.SlackApp')
 @patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
 @patch('zenslackchat.zendesk_webhooks.comments_from_zendesk')
 def test_zendesk_exception_raised_by_update_comments(
-    comments_from_zendesk, ZendeskApp, SlackApp, log, db
+    comments_from_zendesk, ZendeskApp, SlackApp, dead_letter, log, db
 ):
     """Test that 200 ok is returned even if update blows up internally.
     """
@@ -71,7 +77,7 @@ def test_zendesk_exception_raised_by_update_comments(
         'ticket_id': '1430',
     }
     factory = APIRequestFactory()
-    view = zendesk_webhooks.CommentsWebHook.as_view()
+    view = async_to_sync(zendesk_webhooks.CommentsWebHook.as_view())
     request = factory.post(
         '/zendesk/webhook/', 
         zendesk_event,
@@ -88,6 +94,8 @@ def test_zendesk_exception_raised_by_update_comments(
 
     assert response.status_code == 200
     comments_from_zendesk.assert_called()
+    # Kept for replay:
+    dead_letter.record.assert_called_once()
 
 
 @pytest.mark.parametrize(
@@ -151,7 +159,7 @@ def test_zendesk_webhook_events_ok_path(
     assert ZendeskApp.client() == zendesk_client
     with patch(patch_path) as expected_function_call:    
         with patch.dict('webapp.settings.__dict__', env):    
-            view = WebHookView.as_view()
+            view = async_to_sync(WebHookView.as_view())
             factory = APIRequestFactory()
             request = factory.post(
                 '/zendeskwebhook/', 
@@ -167,4 +175,213 @@ def test_zendesk_webhook_events_ok_path(
         zendesk_event,
         slack_client,
         zendesk_client
-    )
\ No newline at end of file
+    )
+
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+@patch('zenslackchat.zendesk_base_webhook.process_zendesk_webhook')
+def test_zendesk_webhook_is_queued_when_async(
+    process_zendesk_webhook, ZendeskApp, SlackApp, log
+):
+    """Test only the token is checked and the event queued for celery.
+    """
+    WebHookView = zendesk_webhooks.EmailWebHook
+    zendesk_event = {'token': 'the-correct-token', 'ticket_id': '32'}
+    expected_queue_key = '32'
+    env = {
+        'ZENDESK_WEBHOOK_TOKEN': 'the-correct-token',
+        'ASYNC_EVENT_PROCESSING': True,
+    }
+    with patch.object(WebHookView, 'handle_event') as handle_event:
+        with patch.dict('webapp.settings.__dict__', env):
+            factory = APIRequestFactory()
+            request = factory.post(
+                '/zendesk/webhook/', zendesk_event, format='json'
+            )
+            response = async_to_sync(WebHookView.as_view())(request)
+
+    assert response.status_code == 200
+    handle_event.assert_not_called()
+    SlackApp.client.assert_not_called()
+    ZendeskApp.client.assert_not_called()
+
+    queue = routing.queue_for(expected_queue_key)
+    ((name, queued),), kwargs = process_zendesk_webhook.apply_async.call_args
+    assert name == WebHookView.name
+    # The event carries its intake id so the worker can release it:
+    assert queued == dict(zendesk_event, intake_id=queued['intake_id'])
+    assert kwargs == dict(queue=queue)
+
+
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+@patch('zenslackchat.zendesk_webhooks.email_from_zendesk')
+def test_queued_webhook_event_is_handled_by_the_worker(
+    email_from_zendesk, ZendeskApp, SlackApp, log
+):
+    """Test the celery task finds the webhook and runs its handler.
+    """
+    event = {'token': 'the-correct-token', 'ticket_id': '32'}
+
+    process_zendesk_webhook('email', event)
+
+    email_from_zendesk.assert_called_with(
+        event, SlackApp.client(), ZendeskApp.client()
+    )
+
+    # Errors are logged and not raised so the worker carries on.
+    email_from_zendesk.side_effect = ValueError('fake problem')
+    process_zendesk_webhook('email', event)
+
+
+@patch('zenslackchat.zendesk_webhooks.sync_zendesk_comments')
+@patch('zenslackchat.zendesk_webhooks.comments_from_zendesk')
+def test_burst_of_comment_triggers_schedules_one_sync(
+    comments_from_zendesk, sync_zendesk_comments, log
+):
+    """Test repeated triggers for a ticket are absorbed into one sync job.
+    """
+    env = {
+        'ZENDESK_WEBHOOK_TOKEN': 'the-correct-token',
+        'ASYNC_EVENT_PROCESSING': True,
+        'ZENDESK_COMMENT_SYNC_DELAY': 3,
+    }
+    event = {
+        'token': 'the-correct-token',
+        'chat_id': '1603983778.011500',
+        'ticket_id': '1430',
+    }
+    other = {
+        'token': 'the-correct-token',
+        'chat_id': '1603983999.011500',
+        'ticket_id': '1431',
+    }
+    view = async_to_sync(zendesk_webhooks.CommentsWebHook.as_view())
+    factory = APIRequestFactory()
+
+    def trigger(data):
+        request = factory.post('/zendesk/webhook/', data, format='json')
+        assert view(request).status_code == 200
+
+    with patch.dict('webapp.settings.__dict__', env):
+        for _ in range(5):
+            trigger(event)
+        trigger(other)
+
+    # One sync for each ticket, on the Slack thread's ordered queue:
+    assert sync_zendesk_comments.apply_async.call_count == 2
+    ((scheduled,),), kwargs = (
+        sync_zendesk_comments.apply_async.call_args_list[0]
+    )
+    assert scheduled == dict(event, intake_id=scheduled['intake_id'])
+    assert kwargs == dict(
+        countdown=3, queue=routing.queue_for('1603983778.011500')
+    )
+    comments_from_zendesk.assert_not_called()
+    assert metrics.snapshot()['zendesk.comments.absorbed'] == 4
+    # Only the scheduled syncs are waiting in the intake:
+    assert intake.stats()['depth'] == 2
+
+
+@patch('zenslackchat.zendesk_webhooks.sync_zendesk_comments')
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+@patch('zenslackchat.zendesk_webhooks.comments_from_zendesk')
+def test_trigger_after_sync_starts_schedules_another(
+    comments_from_zendesk, ZendeskApp, SlackApp, sync_zendesk_comments, log
+):
+    """Test the sync clears the mark so later comments are not missed.
+    """
+    from zenslackchat.tasks import sync_zendesk_comments as sync_task
+
+    event = {
+        'token': 'the-correct-token',
+        'chat_id': '1603983778.011500',
+        'ticket_id': '1430',
+    }
+    webhook = zendesk_webhooks.CommentsWebHook()
+
+    webhook.enqueue(event)
+    webhook.enqueue(event)
+    assert sync_zendesk_comments.apply_async.call_count == 1
+
+    # The worker runs the sync:
+    sync_task(event)
+    comments_from_zendesk.assert_called_once_with(
+        event, SlackApp.client(), ZendeskApp.client()
+    )
+
+    # A new trigger now schedules a new sync:
+    webhook.enqueue(event)
+    assert sync_zendesk_comments.apply_async.call_count == 2
+
+
+@patch('zenslackchat.zendesk_webhooks.sync_zendesk_comments')
+@patch('zenslackchat.zendesk_base_webhook.SlackApp')
+@patch('zenslackchat.zendesk_base_webhook.ZendeskApp')
+@patch('zenslackchat.zendesk_webhooks.comments_from_zendesk')
+def test_each_scheduled_sync_keeps_its_place_in_the_intake(
+    comments_from_zendesk, ZendeskApp, SlackApp, sync_zendesk_comments, log
+):
+    """Test a sync finishing doesn't release the next one for the ticket.
+    """
+    from zenslackchat.tasks import sync_zendesk_comments as sync_task
+
+    webhook = zendesk_webhooks.CommentsWebHook()
+
+    def trigger():
+        webhook.accept({
+            'token': 'the-correct-token',
+            'chat_id': '1603983778.011500',
+            'ticket_id': '1430',
+        })
+        ((event,),), _ = sync_zendesk_comments.apply_async.call_args
+        return event
+
+    with patch.dict(
+        'webapp.settings.__dict__', {'ASYNC_EVENT_PROCESSING': True}
+    ):
+        first = trigger()
+
+        # A comment is added while the first sync is running:
+        def comment_added(*args):
+            trigger()
+            assert intake.stats()['depth'] == 2
+
+        comments_from_zendesk.side_effect = comment_added
+        sync_task(first)
+
+    assert sync_zendesk_comments.apply_async.call_count == 2
+    assert intake.stats()['depth'] == 1
+
+
+@pytest.mark.django_db
+@patch('zenslackchat.zendesk_webhooks.sync_zendesk_comments')
+def test_comment_trigger_mirrors_the_ticket_status(sync_zendesk_comments, log):
+    """Test the status is recorded even when the trigger is absorbed.
+    """
+    from zenslackchat.models import ZenSlackChat
+
+    ZenSlackChat.open('C019JUGAGTS', '1603983778.011500', ticket_id='1430')
+    event = {
+        'token': 'the-correct-token',
+        'chat_id': '1603983778.011500',
+        'ticket_id': '1430',
+        'status': 'Open',
+        'updated_at': '2021-03-10T10:17:12Z',
+    }
+    webhook = zendesk_webhooks.CommentsWebHook()
+    env = {'ASYNC_EVENT_PROCESSING': True, 'ZENDESK_COMMENT_SYNC_DELAY': 3}
+
+    with patch.dict('webapp.settings.__dict__', env):
+        webhook.accept(event)
+        webhook.accept(dict(
+            event, status='Solved', updated_at='2021-03-10T10:20:00Z'
+        ))
+
+    assert sync_zendesk_comments.apply_async.call_count == 1
+    issue = ZenSlackChat.get('C019JUGAGTS', '1603983778.011500')
+    assert issue.ticket_status == 'solved'
+    assert issue.ticket_updated_at == datetime.datetime(
+        2021, 3, 10, 10, 20, tzinfo=datetime.timezone.utc
+    )
@@ -0,0 +1,18 @@
+"""
+ASGI config for webapp project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+import os
+
+from django.core.asgi import get_asgi_application
+
+from zenslackchat import botlogging
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webapp.settings')
+botlogging.log_setup()
+application = get_asgi_application()
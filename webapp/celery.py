@@ -20,7 +20,8 @@ app.conf.worker_hijack_root_logger = False
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    """Set up the daily report.
+    """Set up the daily report, the on call prefetch, the replay of events
+    kept while Zendesk was down and the deferred event drain.
     """
     sender.add_periodic_task(
         # 9:00am Monday to Friday
@@ -28,6 +29,24 @@ def setup_periodic_tasks(sender, **kwargs):
         run_daily_summary,
     )
 
+    from webapp import settings
+
+    sender.add_periodic_task(
+        settings.PAGERDUTY_ONCALL_REFRESH,
+        sender.signature('zenslackchat.tasks.prefetch_on_call'),
+    )
+
+    sender.add_periodic_task(
+        settings.CIRCUIT_BREAKER_RESET,
+        sender.signature('zenslackchat.tasks.replay_circuit_failures'),
+    )
+
+    if settings.INTAKE_MAX_DEPTH > 0:
+        sender.add_periodic_task(
+            settings.INTAKE_DRAIN_INTERVAL,
+            sender.signature('zenslackchat.tasks.drain_deferred_events'),
+        )
+
 
 @app.task(ignore_result=True)
 def run_daily_summary():
@@ -42,6 +42,12 @@ if os.environ.get("DISABLE_MESSAGE_PROCESSING", "0").strip() == "1":
     sys.stderr.write("DISABLE_MESSAGE_PROCESSING is set in environment!\n")
     DISABLE_MESSAGE_PROCESSING = True
 
+ASYNC_EVENT_PROCESSING = False
+if os.environ.get("ASYNC_EVENT_PROCESSING", "0").strip() == "1":
+    # Acknowledge events straight away and let the celery workers handle them.
+    # When not set events are handled inline in the request (tests, dev).
+    ASYNC_EVENT_PROCESSING = True
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
 
@@ -62,6 +68,12 @@ SLACK_BOT_USER_TOKEN = os.environ.get(
 SLACK_VERIFICATION_TOKEN = os.environ.get(
     'SLACK_VERIFICATION_TOKEN', 'YOUR VERIFICATION TOKEN'
 )
+# App level token (xapp-...) used to receive events over Socket Mode.
+SLACK_APP_TOKEN = os.environ.get('SLACK_APP_TOKEN', '')
+# How many socket mode events can be handled at once.
+SOCKET_MODE_MAX_IN_FLIGHT = int(
+    os.environ.get('SOCKET_MODE_MAX_IN_FLIGHT', '10')
+)
 # where to exchange the request token for an access token:
 SLACK_OAUTH_URI = os.environ.get(
     'SLACK_OAUTH_URI', 'https://slack.com/api/oauth.access'
@@ -125,6 +137,15 @@ PAGERDUTY_REDIRECT_URI = os.environ.get(
 PAGERDUTY_ESCALATION_POLICY_ID = os.environ.get(
     'PAGERDUTY_ESCALATION_POLICY_ID', 'PagerDuty Policy ID'
 )
+# Who is on call is prefetched this many hours ahead, every
+# PAGERDUTY_ONCALL_REFRESH seconds. Older windows are used while a refresh
+# is queued.
+PAGERDUTY_ONCALL_PREFETCH_HOURS = int(
+    os.environ.get('PAGERDUTY_ONCALL_PREFETCH_HOURS', '48')
+)
+PAGERDUTY_ONCALL_REFRESH = int(
+    os.environ.get('PAGERDUTY_ONCALL_REFRESH', '900')
+)
 
 # Used to work out our external URI for redirects. Also used as the entry in
 # ALLOWED_HOSTS.
@@ -246,6 +267,110 @@ else:
     REDIS_URL = os.environ['REDIS_URL']
     REDIS_CELERY_URL = REDIS_URL
 
+# Keep Redis calls outside of celery short. Callers carry on without Redis.
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '2'))
+
+# How long in seconds to remember Slack event_id's to spot redeliveries.
+SLACK_EVENT_DEDUP_TTL = int(os.environ.get('SLACK_EVENT_DEDUP_TTL', '3600'))
+
+# How many ordered queues Slack event handling is spread across. Each queue
+# needs its own worker running with a concurrency of 1.
+SLACK_EVENT_SHARDS = int(os.environ.get('SLACK_EVENT_SHARDS', '1'))
+
+# Seconds to collect a burst of Slack thread replies into one Zendesk comment.
+# 0 disables this and every reply is sent to Zendesk straight away.
+ZENDESK_COMMENT_DEBOUNCE = int(os.environ.get('ZENDESK_COMMENT_DEBOUNCE', '0'))
+
+# Seconds to wait after a Zendesk comment trigger before syncing the ticket's
+# comments to Slack. Further triggers for the ticket in this time are absorbed.
+ZENDESK_COMMENT_SYNC_DELAY = int(
+    os.environ.get('ZENDESK_COMMENT_SYNC_DELAY', '2')
+)
+
+# The most events waiting to be handled before replies are deferred and help
+# commands dropped. New issues are always accepted. 0 is no limit.
+INTAKE_MAX_DEPTH = int(os.environ.get("INTAKE_MAX_DEPTH", "0"))
+
+# Seconds after which an event that never finished no longer counts.
+INTAKE_ITEM_TTL = int(os.environ.get("INTAKE_ITEM_TTL", "3600"))
+
+# How often in seconds deferred events are retried.
+INTAKE_DRAIN_INTERVAL = int(os.environ.get("INTAKE_DRAIN_INTERVAL", "5"))
+
+# Bearer token for the /metrics/ endpoint. It is disabled if not set.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "").strip()
+
+# How many failed events are replayed at once and the most started a second.
+DEAD_LETTER_REPLAY_CONCURRENCY = int(
+    os.environ.get("DEAD_LETTER_REPLAY_CONCURRENCY", "4")
+)
+DEAD_LETTER_REPLAY_RATE = float(
+    os.environ.get("DEAD_LETTER_REPLAY_RATE", "5")
+)
+
+# Directory to journal every raw Slack event and Zendesk webhook to. This is
+# for replaying traffic with "manage.py replay_journal". Off if not set.
+EVENT_JOURNAL_PATH = os.environ.get("EVENT_JOURNAL_PATH", "").strip()
+
+# The most seconds a process keeps using an API client after its token was
+# changed by another process.
+CLIENT_CACHE_CHECK_INTERVAL = float(
+    os.environ.get("CLIENT_CACHE_CHECK_INTERVAL", "5")
+)
+
+# Outbound HTTP connection pools used by the Slack, Zendesk and PagerDuty
+# clients. HTTP_POOL_MAXSIZE is the connections kept open to each API. Set it
+# to the most threads making API calls at once in a process: the web server's
+# ASGI_THREADS or the Celery worker --concurrency, whichever is higher.
+# HTTP_POOL_CONNECTIONS is how many hosts to keep pools for. With
+# HTTP_POOL_BLOCK=1 requests wait for a free connection when the pool is in
+# use instead of opening an extra one.
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+HTTP_POOL_BLOCK = os.environ.get("HTTP_POOL_BLOCK", "0").strip() == "1"
+
+# How long in seconds a process keeps a Slack user's profile in memory. A
+# change from a user_change event is seen by other processes after this.
+SLACK_USER_CACHE_TTL = int(os.environ.get("SLACK_USER_CACHE_TTL", "300"))
+# Stored users older than this in seconds are asked for from Slack again:
+SLACK_USER_MAX_AGE = int(os.environ.get("SLACK_USER_MAX_AGE", "86400"))
+
+# Requests per minute allowed to each API, shared by all processes e.g.
+# {"zendesk": 700, "slack:chat.postMessage": 60}. These are added to the
+# defaults in zenslackchat.rate_limit.DEFAULT_LIMITS.
+API_RATE_LIMITS = json.loads(os.environ.get("API_RATE_LIMITS", "{}"))
+
+# The most seconds a request waits for its rate limit before failing, and how
+# many times a request getting a 429 is sent again after the Retry-After.
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "30"))
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "3"))
+
+# The circuit breaker around Zendesk calls. CIRCUIT_BREAKER_THRESHOLD failed
+# calls in a row open it and calls then fail at once for
+# CIRCUIT_BREAKER_RESET seconds. Transient errors are retried
+# CIRCUIT_BREAKER_RETRIES times, waiting a random time of up to
+# CIRCUIT_BREAKER_BACKOFF seconds doubled for each retry.
+CIRCUIT_BREAKER_THRESHOLD = int(
+    os.environ.get("CIRCUIT_BREAKER_THRESHOLD", "5")
+)
+CIRCUIT_BREAKER_RESET = int(os.environ.get("CIRCUIT_BREAKER_RESET", "30"))
+CIRCUIT_BREAKER_RETRIES = int(os.environ.get("CIRCUIT_BREAKER_RETRIES", "2"))
+CIRCUIT_BREAKER_BACKOFF = float(
+    os.environ.get("CIRCUIT_BREAKER_BACKOFF", "0.5")
+)
+# Seconds before a Zendesk request is given up on (Zenpy's default is 60).
+ZENDESK_TIMEOUT = float(os.environ.get("ZENDESK_TIMEOUT", "10"))
+
+# The threads running independent steps of a flow concurrently e.g. posting
+# to Slack while the issue is stored. See zenslackchat.flow.
+FLOW_MAX_WORKERS = int(os.environ.get("FLOW_MAX_WORKERS", "8"))
+
+# How often in seconds the bulk resolve checks on the Zendesk jobs closing
+# the tickets. See TicketCloseJob.
+ZENDESK_JOB_POLL_INTERVAL = float(
+    os.environ.get("ZENDESK_JOB_POLL_INTERVAL", "2")
+)
+
 CELERY_BROKER_URL = REDIS_CELERY_URL
 # no results as I'm just running a report once a day and it should just work.
 # result_backend = REDIS_CELERY_URL
@@ -1,16 +1,24 @@
 from django import forms
 from django.db import models
 from django.contrib import admin
+from django.contrib import messages
 from django.conf import settings
 from django.utils.html import format_html
 
 from zenslackchat.models import SlackApp
+from zenslackchat.models import SlackUser
 from zenslackchat.models import ZendeskApp
 from zenslackchat.models import PagerDutyApp
 from zenslackchat.models import ZenSlackChat
+from zenslackchat.models import FailedEvent
+from zenslackchat.models import TicketCloseJob
+from zenslackchat.models import OnCallWindow
 from zenslackchat.models import OutOfHoursInformation
+from zenslackchat.tasks import replay_failed_events
+from zenslackchat.tasks import close_zendesk_tickets
 from zenslackchat.slack_api import message_url
 from zenslackchat.slack_api import url_to_chat_id
+from zenslackchat.zendesk_api import UPDATE_MANY_LIMIT
 from zenslackchat.zendesk_api import zendesk_ticket_url
 
 
@@ -21,6 +29,17 @@ class SlackAppAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 
+@admin.register(SlackUser)
+class SlackUserAdmin(admin.ModelAdmin):
+    """View the local directory of Slack users.
+    """
+    list_display = ('user_id', 'real_name', 'email', 'deleted', 'updated_at')
+
+    search_fields = ('user_id', 'real_name', 'email')
+
+    list_filter = ('deleted',)
+
+
 @admin.register(ZendeskApp)
 class ZendeskAppAdmin(admin.ModelAdmin):
     """Manage the stored Zendesk OAuth client credentials
@@ -35,6 +54,15 @@ class PagerDutyAppAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 
+@admin.register(OnCallWindow)
+class OnCallWindowAdmin(admin.ModelAdmin):
+    """View who is on call, as last prefetched from PagerDuty.
+    """
+    list_display = ('name', 'escalation_level', 'start', 'end', 'fetched_at')
+
+    list_filter = ('escalation_level',)
+
+
 @admin.register(ZenSlackChat)
 class ZenSlackChatAdmin(admin.ModelAdmin):
     """Manage the stored support resquests
@@ -42,15 +70,15 @@ class ZenSlackChatAdmin(admin.ModelAdmin):
     date_hierarchy = 'opened'
 
     list_display = (
-        'chat_id', 'channel_id', 'ticket_url', 'chat_url', 'active', 'opened',
-        'closed'
+        'chat_id', 'channel_id', 'ticket_url', 'ticket_status', 'chat_url',
+        'active', 'opened', 'closed'
     )
 
     search_fields = ('chat_id', 'ticket_id')
 
     list_filter = ('active', 'opened', 'closed')
 
-    actions = ('mark_resolved',)
+    actions = ('mark_resolved', 'resolve_and_close_tickets')
 
     def chat_url(self, obj):
         """Provide a link to the slack chat."""
@@ -90,11 +118,35 @@ class ZenSlackChatAdmin(admin.ModelAdmin):
         example zendesk was down and the issue was partially created.
 
         """
-        for obj in queryset:
-            ZenSlackChat.resolve(obj.channel_id, obj.chat_id)
+        ZenSlackChat.resolve_many(queryset)
 
     mark_resolved.short_description = "Remove an issue by marking it resolved."
 
+    def resolve_and_close_tickets(modeladmin, request, queryset):
+        """Resolve the issues and close their tickets in Zendesk.
+
+        The issues are resolved with one database update. Their tickets are
+        closed by Zendesk jobs of UPDATE_MANY_LIMIT tickets each, which are
+        followed in the background. Their progress is shown in the Ticket
+        close jobs admin. No notice is sent on Slack.
+
+        """
+        resolved, ticket_ids = ZenSlackChat.resolve_many(queryset)
+        jobs = TicketCloseJob.for_tickets(ticket_ids, UPDATE_MANY_LIMIT)
+        for job in jobs:
+            close_zendesk_tickets.delay(job.pk)
+
+        modeladmin.message_user(
+            request,
+            f"Resolved {resolved} issue(s). Closing {len(ticket_ids)} "
+            f"ticket(s) in {len(jobs)} Zendesk job(s).",
+            messages.SUCCESS
+        )
+
+    resolve_and_close_tickets.short_description = (
+        "Resolve and close the Zendesk tickets."
+    )
+
 
 @admin.register(OutOfHoursInformation)
 class OutOfHoursInformationAdmin(admin.ModelAdmin):
@@ -108,3 +160,68 @@ class OutOfHoursInformationAdmin(admin.ModelAdmin):
             'widget': forms.Textarea(attrs={"rows": 10, "cols": 80})
         }
     }
+
+
+@admin.register(FailedEvent)
+class FailedEventAdmin(admin.ModelAdmin):
+    """Manage the events which failed in the handler.
+    """
+    date_hierarchy = 'created_at'
+
+    list_display = ('source', 'attempts', 'created_at', 'last_attempt')
+
+    list_filter = ('source', 'attempts')
+
+    actions = ('replay',)
+
+    def replay(modeladmin, request, queryset):
+        """Replay the selected events on the celery workers.
+
+        Events which succeed are removed. The rest have their attempts and
+        error updated.
+
+        """
+        ids = list(queryset.values_list('id', flat=True))
+        replay_failed_events.delay(ids)
+        modeladmin.message_user(
+            request, f"Replay of {len(ids)} event(s) scheduled.",
+            messages.SUCCESS
+        )
+
+    replay.short_description = "Replay the selected events."
+
+
+@admin.register(TicketCloseJob)
+class TicketCloseJobAdmin(admin.ModelAdmin):
+    """Follow the Zendesk jobs closing tickets for the bulk resolve.
+    """
+    date_hierarchy = 'created_at'
+
+    list_display = (
+        'job_id', 'status', 'progress', 'total', 'created_at', 'sent_at',
+        'updated_at'
+    )
+
+    list_filter = ('status',)
+
+    actions = ('retry',)
+
+    def retry(modeladmin, request, queryset):
+        """Send the failed jobs' tickets to Zendesk again.
+        """
+        jobs = list(queryset.filter(
+            status__in=(TicketCloseJob.FAILED, TicketCloseJob.KILLED)
+        ))
+        for job in jobs:
+            queryset.filter(pk=job.pk).update(
+                status=TicketCloseJob.PENDING, job_id='', progress=0,
+                error=''
+            )
+            close_zendesk_tickets.delay(job.pk)
+
+        modeladmin.message_user(
+            request, f"Retry of {len(jobs)} job(s) scheduled.",
+            messages.SUCCESS
+        )
+
+    retry.short_description = "Retry the selected failed jobs."
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ZenSlackChatConfig(AppConfig):
     name = 'zenslackchat'
+
+    def ready(self):
+        # Connect the signal handlers.
+        from zenslackchat import signals  # noqa: F401
@@ -0,0 +1,62 @@
+"""
+Support for class based async views on Django 3.2.
+
+Django 3.2 only recognises async function views. Django 4.1 marks the function
+returned by View.as_view() as a coroutine function when the handlers are async
+and AsyncView does the same here. Served over ASGI the request then never
+holds a thread while it waits, only while blocking code is run_in_thread().
+
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.views import View
+from django.db import close_old_connections
+from django.utils.decorators import classonlymethod
+
+try:
+    from asgiref.sync import markcoroutinefunction
+
+except ImportError:
+    # asgiref < 3.6
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+class AsyncView(View):
+    """A View whose HTTP method handlers are all coroutines.
+    """
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        return markcoroutinefunction(super().as_view(**initkwargs))
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        return super().http_method_not_allowed(request, *args, **kwargs)
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
+
+
+def run_in_thread(func):
+    """Wrap blocking Django code so it can be awaited from an async view.
+
+    Django 3.2 runs all thread sensitive code on one thread, which would
+    serialise every request. Instead this runs on the event loop's thread pool
+    and tidies up the thread's stale DB connections, as Django does at the end
+    of each request.
+
+    :param func: The blocking callable.
+
+    :returns: A coroutine function taking the same arguments.
+
+    """
+    def tidy(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+
+        finally:
+            close_old_connections()
+
+    return sync_to_async(tidy, thread_sensitive=False)
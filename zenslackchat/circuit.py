@@ -0,0 +1,359 @@
+"""
+A circuit breaker stopping calls to an API which is failing.
+
+When Zendesk is down every event would otherwise wait for its requests to
+time out, tying up the threads handling events. The breaker counts failed
+calls in Redis so every process shares its state:
+
+- closed: calls are made. Transient errors are retried with a jittered
+  exponential backoff. Once the retries are used up the failure is counted.
+- open: after 'threshold' failures in a row calls raise CircuitOpen straight
+  away. The event handlers keep the event in the dead letter store, from
+  which it is replayed once the breaker closes.
+- half_open: once 'reset_after' seconds have passed one call is let through
+  to try the API. If it works the breaker closes, if not it opens again.
+
+If Redis is unavailable the breaker stays closed.
+
+"""
+import time
+import random
+import asyncio
+import logging
+import functools
+
+import redis
+import aiohttp
+import requests
+from zenpy.lib.exception import APIException
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat import redis_store
+from zenslackchat.clients import AsyncAPIError
+from zenslackchat.async_views import run_in_thread
+from zenslackchat.rate_limit import RateLimited
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an API whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        """
+        :param name: The breaker name e.g. 'zendesk'.
+
+        :param retry_after: Seconds until the API is tried again.
+
+        """
+        super().__init__(
+            f"The {name} circuit breaker is open, retry in {retry_after:.0f}s"
+        )
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """True if the error might not happen if the call is made again.
+
+    Connection problems, timeouts and 5xx responses are transient. Errors
+    like a 404 or a 422 are the same every time.
+
+    """
+    if isinstance(error, requests.RequestException):
+        return True
+
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return True
+
+    if isinstance(error, APIException):
+        status = getattr(error.response, 'status_code', None)
+        return status is None or status >= 500
+
+    if isinstance(error, AsyncAPIError):
+        return error.status >= 500
+
+    return False
+
+
+def is_safe_to_retry(error):
+    """True if the request can't have been carried out.
+
+    If the response timed out the API might have done the work, so a write
+    sent again could e.g. add a comment twice.
+
+    """
+    if isinstance(error, (requests.ConnectTimeout, aiohttp.ClientConnectorError)):
+        return True
+
+    if isinstance(error, (requests.Timeout, asyncio.TimeoutError)):
+        return False
+
+    return is_transient(error)
+
+
+class CircuitBreaker(object):
+    """A circuit breaker whose state is shared through Redis.
+    """
+    def __init__(self, name, threshold=None, reset_after=None):
+        """
+        :param name: The API name e.g. 'zendesk'.
+
+        :param threshold: Failures in a row which open the breaker (default
+        is the setting CIRCUIT_BREAKER_THRESHOLD).
+
+        :param reset_after: Seconds before an open breaker tries the API
+        again (default is the setting CIRCUIT_BREAKER_RESET).
+
+        """
+        self.name = name
+        self._threshold = threshold
+        self._reset_after = reset_after
+
+    @property
+    def threshold(self):
+        return self._threshold or settings.CIRCUIT_BREAKER_THRESHOLD
+
+    @property
+    def reset_after(self):
+        return self._reset_after or settings.CIRCUIT_BREAKER_RESET
+
+    def _key(self, *parts):
+        return redis_store.key('circuit', self.name, *parts)
+
+    def _opened_at(self):
+        opened_at = redis_store.connection().get(self._key('opened_at'))
+        return float(opened_at) if opened_at else None
+
+    def state(self):
+        """Return CLOSED, OPEN or HALF_OPEN.
+        """
+        try:
+            opened_at = self._opened_at()
+
+        except redis.RedisError:
+            logging.getLogger(__name__).exception(
+                f"Unable to check the {self.name} circuit breaker: "
+            )
+            return CLOSED
+
+        if opened_at is None:
+            return CLOSED
+
+        if time.time() - opened_at < self.reset_after:
+            return OPEN
+
+        return HALF_OPEN
+
+    def allow(self):
+        """Raise CircuitOpen unless a call can be made now.
+
+        When half open only one caller at a time gets to try the API.
+
+        """
+        state = self.state()
+        if state == CLOSED:
+            return
+
+        if state == HALF_OPEN:
+            try:
+                trial = redis_store.connection().set(
+                    self._key('trial'), 1, nx=True, ex=int(self.reset_after)
+                )
+
+            except redis.RedisError:
+                trial = True
+
+            if trial:
+                logging.getLogger(__name__).info(
+                    f"Trying {self.name} again, the circuit is half open."
+                )
+                return
+
+        metrics.incr(f'circuit.{self.name}.rejected')
+        raise CircuitOpen(self.name, self.reset_after)
+
+    def release_trial(self):
+        """Let another caller try the API while half open."""
+        try:
+            redis_store.connection().delete(self._key('trial'))
+
+        except redis.RedisError:
+            logging.getLogger(__name__).exception(
+                f"Unable to release the {self.name} trial call: "
+            )
+
+    def succeeded(self):
+        """Close the breaker after a call worked."""
+        try:
+            was_open, _ = redis_store.connection().pipeline().delete(
+                self._key('opened_at')
+            ).delete(self._key('failures'), self._key('trial')).execute()
+            if was_open:
+                logging.getLogger(__name__).warning(
+                    f"The {self.name} circuit breaker is closed again."
+                )
+                metrics.incr(f'circuit.{self.name}.closed')
+
+        except redis.RedisError:
+            logging.getLogger(__name__).exception(
+                f"Unable to reset the {self.name} circuit breaker: "
+            )
+
+    def failed(self):
+        """Count a failed call, opening the breaker at the threshold."""
+        log = logging.getLogger(__name__)
+
+        try:
+            connection = redis_store.connection()
+            failures = connection.incr(self._key('failures'))
+            connection.expire(self._key('failures'), int(self.reset_after) * 10)
+            opened = self._opened_at() is not None
+            if failures >= self.threshold or opened:
+                # A failed trial opens it for another reset_after.
+                connection.set(self._key('opened_at'), time.time())
+                connection.delete(self._key('trial'))
+                if not opened:
+                    log.error(
+                        f"The {self.name} circuit breaker is open after "
+                        f"{failures} failures."
+                    )
+                    metrics.incr(f'circuit.{self.name}.opened')
+
+        except redis.RedisError:
+            log.exception(f"Unable to count a {self.name} failure: ")
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        """Call func through the breaker.
+
+        :param func: The API call to make.
+
+        :param idempotent: False if sending the call twice could do the
+        work twice. Timed out calls are then not retried.
+
+        The other arguments are passed on to func.
+
+        :returns: Whatever func returns.
+
+        CircuitOpen is raised without calling func if the breaker is open.
+        Otherwise transient errors are retried up to the setting
+        CIRCUIT_BREAKER_RETRIES times. Any error left is raised.
+
+        """
+        self.allow()
+
+        attempt = 0
+        while True:
+            try:
+                returned = func(*args, **kwargs)
+
+            except Exception as error:
+                delay = self._retry_delay(func, error, attempt, idempotent)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+            else:
+                self.succeeded()
+                return returned
+
+    async def async_call(self, func, *args, idempotent=True, **kwargs):
+        """The same as call() for a coroutine function.
+
+        Only the coroutine waits between retries, not the event loop. The
+        breaker's state is read and written in Redis on the thread pool.
+
+        """
+        await run_in_thread(self.allow)()
+
+        attempt = 0
+        while True:
+            try:
+                returned = await func(*args, **kwargs)
+
+            except Exception as error:
+                delay = await run_in_thread(self._retry_delay)(
+                    func, error, attempt, idempotent
+                )
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+            else:
+                await run_in_thread(self.succeeded)()
+                return returned
+
+    def _retry_delay(self, func, error, attempt, idempotent):
+        """Return how long to wait before retrying a failed call.
+
+        :returns: The seconds to wait or None if the call is not to be
+        retried, in which case the caller raises the error again. The
+        outcome has then been counted.
+
+        """
+        retryable = is_transient if idempotent else is_safe_to_retry
+
+        if isinstance(error, RateLimited):
+            # The API wasn't called, so this says nothing about it. Let
+            # another call be the trial if this one was.
+            self.release_trial()
+            return None
+
+        if not is_transient(error):
+            # The API answered, it is working.
+            self.succeeded()
+            return None
+
+        if not retryable(error):
+            self.failed()
+            return None
+
+        if attempt >= settings.CIRCUIT_BREAKER_RETRIES:
+            self.failed()
+            return None
+
+        delay = random.uniform(
+            0, settings.CIRCUIT_BREAKER_BACKOFF * 2 ** attempt
+        )
+        logging.getLogger(__name__).warning(
+            f"{self.name} call {func.__name__} failed, retry "
+            f"{attempt + 1} in {delay:.2f}s: {error}"
+        )
+        metrics.incr(f'circuit.{self.name}.retry')
+        return delay
+
+    def protect(self, idempotent=True):
+        """Decorate a function so it is always called through the breaker.
+
+        Coroutine functions are called with async_call().
+
+        """
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    return await self.async_call(
+                        func, *args, idempotent=idempotent, **kwargs
+                    )
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(func, *args, idempotent=idempotent, **kwargs)
+            return wrapper
+        return decorator
+
+
+# The breaker around every Zendesk call in zendesk_api.
+zendesk = CircuitBreaker('zendesk')
+
+
+def states():
+    """Return the state of each breaker, for the metrics view."""
+    return {zendesk.name: zendesk.state()}
@@ -0,0 +1,492 @@
+"""
+Helpers for the Slack, Zendesk and PagerDuty API clients.
+
+"""
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+
+import redis
+import urllib3
+import aiohttp
+import requests
+import requests.adapters
+from slack import WebClient
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat import rate_limit
+from zenslackchat import redis_store
+from zenslackchat.async_views import run_in_thread
+
+
+class LazyClient(object):
+    """Stand in for a client which is only built when first used.
+
+    Building a client costs a database query and a new HTTP session. Events
+    which are ignored part way through handling never need to pay that.
+
+    e.g. LazyClient(SlackApp.client).users_info(user=...)
+
+    """
+    def __init__(self, factory):
+        """
+        :param factory: A callable which returns the real client.
+
+        """
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        """True if the real client has been created."""
+        return self._client is not None
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+def real_client(client):
+    """Return the real client, building it now if client is a LazyClient.
+
+    Building a client may query the database, which must be done on the
+    calling thread. Use this before handing the client to a Flow's threads.
+
+    """
+    if isinstance(client, LazyClient):
+        return client._get()
+
+    return client
+
+
+class ClientCache(object):
+    """Per process cache of the API clients built from the stored tokens.
+
+    Building a client costs a database query and a new HTTP session, so TLS
+    connections are never reused between events. The cache keeps one client
+    per API for the life of the process instead.
+
+    When a token is saved or deleted invalidate() drops the client here and
+    bumps a version counter in Redis. Other processes see the new version
+    within check_interval seconds and drop theirs. If Redis is unavailable
+    clients are rebuilt every time.
+
+    """
+    def __init__(self, check_interval=5):
+        """
+        :param check_interval: How often in seconds to look for another
+        process changing a token.
+
+        """
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._version = None
+        self._checked = None
+        # Bumped on every invalidation so a build racing it is not kept.
+        self._generation = 0
+
+    def _version_key(self):
+        return redis_store.key('clients', 'version')
+
+    def _check_version(self):
+        """Drop all clients if another process has invalidated them.
+
+        This must be called holding the lock.
+
+        """
+        now = time.monotonic()
+        if self._checked is not None:
+            if now - self._checked < self.check_interval:
+                return
+
+        self._checked = now
+        try:
+            version = redis_store.connection().get(self._version_key())
+
+        except redis.RedisError as error:
+            logging.getLogger(__name__).warning(
+                f"Unable to check client versions, rebuilding: {error}"
+            )
+            self._checked = None
+            self._clients.clear()
+            self._generation += 1
+            return
+
+        # Nothing has been invalidated yet if the key is not set.
+        version = version or b'0'
+        if version != self._version:
+            self._clients.clear()
+            self._generation += 1
+            self._version = version
+
+    def get(self, name, factory):
+        """Return the cached client, building it with factory if needed.
+
+        :param name: The API name e.g. 'slack'.
+
+        :param factory: Callable returning a new client.
+
+        """
+        with self._lock:
+            self._check_version()
+            if name in self._clients:
+                return self._clients[name]
+            generation = self._generation
+
+        client = factory()
+
+        with self._lock:
+            if generation == self._generation:
+                self._clients[name] = client
+
+        return client
+
+    def invalidate(self, name=None):
+        """Drop a client, or all of them, here and in every other process.
+
+        :param name: The API name or None for all clients.
+
+        """
+        self.clear(name)
+        try:
+            redis_store.connection().incr(self._version_key())
+
+        except redis.RedisError:
+            logging.getLogger(__name__).exception(
+                "Unable to tell other processes to rebuild their clients: "
+            )
+
+    def clear(self, name=None):
+        """Drop a client, or all of them, in this process only."""
+        with self._lock:
+            if name is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(name, None)
+            self._generation += 1
+
+
+# The process wide client cache.
+cache = ClientCache(settings.CLIENT_CACHE_CHECK_INTERVAL)
+
+
+class CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """Record each new connection opened as 'http.<host>.connect'."""
+
+    def _new_conn(self):
+        metrics.incr(f'http.{self.host}.connect')
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    """Record each new connection opened as 'http.<host>.connect'."""
+
+    def _new_conn(self):
+        metrics.incr(f'http.{self.host}.connect')
+        return super()._new_conn()
+
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter keeping a pool of open connections to each host.
+
+    The pool sizes come from the HTTP_POOL_* settings so they can be matched
+    to the number of threads making API calls. Connections are kept alive and
+    reused, so only the first request to a host pays for the TLS handshake.
+
+    Requests to Slack, Zendesk and PagerDuty wait for their rate limit, see
+    zenslackchat.rate_limit.
+
+    Three metrics are kept for each host:
+
+      - 'http.<host>.requests': requests sent.
+      - 'http.<host>.connect': new connections opened. Ideally this stays
+        close to the pool size.
+      - 'http.<host>.pool_full': requests sent while every pooled connection
+        was busy. These open an extra connection which is thrown away after,
+        or wait for one if HTTP_POOL_BLOCK is set. Raise HTTP_POOL_MAXSIZE if
+        this keeps going up.
+
+    """
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: Passed on to HTTPAdapter. pool_connections,
+        pool_maxsize and pool_block default to the settings.
+
+        """
+        kwargs.setdefault('pool_connections', settings.HTTP_POOL_CONNECTIONS)
+        kwargs.setdefault('pool_maxsize', settings.HTTP_POOL_MAXSIZE)
+        kwargs.setdefault('pool_block', settings.HTTP_POOL_BLOCK)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def in_flight(self, host):
+        """The number of requests currently being sent to host."""
+        with self._in_flight_lock:
+            return self._in_flight.get(host, 0)
+
+    def send(self, request, *args, **kwargs):
+        """Send the request once the API's rate limit allows.
+
+        A 429 backs off every process for the Retry-After and the request is
+        sent again, up to settings.RATE_LIMIT_RETRIES times.
+
+        """
+        bucket = rate_limit.bucket_for(request.url)
+        attempt = 0
+        while True:
+            if bucket:
+                rate_limit.acquire(bucket)
+
+            response = self._send(request, *args, **kwargs)
+            if not bucket or response.status_code != 429:
+                return response
+
+            if attempt >= settings.RATE_LIMIT_RETRIES:
+                return response
+
+            attempt += 1
+            metrics.incr(f'rate_limit.{bucket}.429')
+            rate_limit.block(bucket, rate_limit.retry_after(response))
+            response.close()
+
+    def _send(self, request, *args, **kwargs):
+        host = urlparse(request.url).hostname
+        with self._in_flight_lock:
+            in_flight = self._in_flight.get(host, 0) + 1
+            self._in_flight[host] = in_flight
+
+        metrics.incr(f'http.{host}.requests')
+        if in_flight > self._pool_maxsize:
+            metrics.incr(f'http.{host}.pool_full')
+
+        try:
+            return super().send(request, *args, **kwargs)
+
+        finally:
+            with self._in_flight_lock:
+                self._in_flight[host] -= 1
+
+
+def pooled_session(adapter=None):
+    """Return a requests Session sending everything through a PooledAdapter.
+
+    :param adapter: The adapter to use, a new PooledAdapter by default.
+
+    """
+    adapter = adapter or PooledAdapter()
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class PooledWebClient(WebClient):
+    """Slack WebClient making its API calls over a pooled requests session.
+
+    The slackclient WebClient uses urllib, which opens a new connection and
+    does a TLS handshake for every API call. Only the HTTP part is replaced,
+    the arguments and responses are the same.
+
+    """
+    def __init__(self, *args, session=None, **kwargs):
+        """
+        :param session: The requests Session to use, pooled_session() by
+        default.
+
+        The other arguments are the same as WebClient.
+
+        """
+        super().__init__(*args, **kwargs)
+        self.session = session or pooled_session()
+
+    def _perform_urllib_http_request(self, *, url, args):
+        """Send the request with requests in place of urllib.
+
+        :returns: dict(status=<code>, headers=<dict>, body=<text>) as the
+        WebClient expects.
+
+        """
+        # requests sets the right Content-Type for the body itself.
+        headers = {
+            name: value for name, value in args['headers'].items()
+            if name.lower() != 'content-type'
+        }
+
+        kwargs = {}
+        if args['json']:
+            kwargs['json'] = args['json']
+
+        elif args['data']:
+            files = {}
+            data = {}
+            for name, value in args['data'].items():
+                readable = getattr(value, 'readable', None)
+                if readable and value.readable():
+                    files[name] = value
+                else:
+                    data[name] = str(value)
+            kwargs.update(data=data, files=files)
+
+        elif args['params']:
+            kwargs['data'] = args['params']
+
+        if self.proxy:
+            kwargs['proxies'] = {'http': self.proxy, 'https': self.proxy}
+
+        # Slack accepts POST for every API method.
+        response = self.session.post(
+            url, headers=headers, timeout=self.timeout, **kwargs
+        )
+
+        returned_headers = dict(response.headers)
+        if 'Retry-After' in response.headers:
+            # The same key urllib and aiohttp errors are looked up with.
+            returned_headers['Retry-After'] = response.headers['Retry-After']
+
+        return dict(
+            status=response.status_code,
+            headers=returned_headers,
+            body=response.text,
+        )
+
+
+class AsyncAPIError(Exception):
+    """Raised when an AsyncAPIClient request gets an error response."""
+
+    def __init__(self, status, body, retry_after=None):
+        """
+        :param status: The HTTP status code.
+
+        :param body: The response text.
+
+        :param retry_after: The Retry-After header if one was returned.
+
+        """
+        super().__init__(f"HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+
+class AsyncAPIClient(object):
+    """A small aiohttp based JSON API client for use on an event loop.
+
+    The aiohttp session belongs to the event loop it was created on, so it is
+    only created on the first request. Use it as an async context manager or
+    call close() when done.
+
+    e.g.
+
+        zendesk = await run_in_thread(ZendeskApp.async_client)()
+        async with zendesk:
+            data = await zendesk.get('tickets/1430.json')
+
+    """
+    def __init__(self, base_url, headers=None, timeout=30):
+        """
+        :param base_url: The URL which request paths are relative to.
+
+        :param headers: Headers sent with every request e.g. Authorization.
+
+        :param timeout: The total seconds a request is allowed to take.
+
+        """
+        self.base_url = base_url.rstrip('/') + '/'
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def request(self, method, path, **kwargs):
+        """Make a request and return the decoded JSON response.
+
+        :param method: The HTTP method e.g. 'GET'.
+
+        :param path: The path relative to the base_url.
+
+        :param kwargs: Passed on to aiohttp e.g. json={...} or params={...}
+
+        :returns: The decoded JSON or None for an empty response.
+
+        Requests wait for the API's rate limit and a 429 is sent again, as
+        the PooledAdapter does. The rate limit's Redis calls are made on the
+        thread pool so the event loop is never blocked. Responses with
+        status 400 or above raise AsyncAPIError.
+
+        """
+        url = self.base_url + path.lstrip('/')
+        bucket = rate_limit.bucket_for(url)
+        attempt = 0
+        while True:
+            if bucket:
+                await rate_limit.async_acquire(bucket)
+
+            async with self.session.request(method, url, **kwargs) as response:
+                limited = bucket and response.status == 429
+                if limited and attempt < settings.RATE_LIMIT_RETRIES:
+                    attempt += 1
+                    await run_in_thread(metrics.incr)(
+                        f'rate_limit.{bucket}.429'
+                    )
+                    await rate_limit.async_block(
+                        bucket, rate_limit.retry_after(response)
+                    )
+                    continue
+
+                if response.status >= 400:
+                    raise AsyncAPIError(
+                        response.status,
+                        await response.text(),
+                        response.headers.get('Retry-After'),
+                    )
+
+                if response.status == 204:
+                    return None
+
+                return await response.json(content_type=None)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
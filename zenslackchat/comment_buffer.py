@@ -0,0 +1,97 @@
+"""
+Buffer Slack thread replies so a burst becomes a single Zendesk comment.
+
+Each line is appended to a Redis list per ticket. The first line in a window
+also sets a marker, which tells the caller to schedule a flush once the window
+has passed. The flush drains the list in order and writes one comment. The
+Slack thread the lines came from is kept too, so the flush can reply there.
+
+"""
+import json
+
+from zenslackchat import redis_store
+
+
+def _lines_key(ticket_id):
+    return redis_store.key('comments', ticket_id, 'lines')
+
+
+def _marker_key(ticket_id):
+    return redis_store.key('comments', ticket_id, 'pending')
+
+
+def _thread_key(ticket_id):
+    return redis_store.key('comments', ticket_id, 'thread')
+
+
+def buffer_comment(ticket_id, line, window, thread=None):
+    """Append a comment line to the ticket's pending buffer.
+
+    :param ticket_id: The Zendesk ticket the line is for.
+
+    :param line: The comment text including the author e.g.
+    "Bob Sprocket (Slack): hello".
+
+    :param window: The debounce window in seconds.
+
+    :param thread: The optional dict(channel_id=..., thread_id=...) of the
+    Slack thread the line was posted in.
+
+    :returns: True if this line opened a new window and a flush must be
+    scheduled, False if a flush is already pending.
+
+    Redis errors are raised to the caller.
+
+    """
+    pipe = redis_store.connection().pipeline()
+    pipe.rpush(_lines_key(ticket_id), line)
+    # The marker outlives the window in case the flush is delayed. It is
+    # removed when the flush runs.
+    pipe.set(_marker_key(ticket_id), 1, nx=True, ex=int(window) + 60)
+    if thread:
+        pipe.set(_thread_key(ticket_id), json.dumps(thread), ex=int(window) + 600)
+    opened = pipe.execute()[1]
+
+    return bool(opened)
+
+
+def drain_comments(ticket_id):
+    """Remove and return all the pending lines for the ticket in order.
+
+    The marker is cleared first, so a line arriving during the flush opens a
+    new window rather than being lost.
+
+    :returns: A list of strings, empty if nothing is pending.
+
+    """
+    pipe = redis_store.connection().pipeline()
+    pipe.delete(_marker_key(ticket_id))
+    pipe.lrange(_lines_key(ticket_id), 0, -1)
+    pipe.delete(_lines_key(ticket_id))
+    _, lines, _ = pipe.execute()
+
+    return [line.decode() for line in lines]
+
+
+def comment_thread(ticket_id):
+    """Return the Slack thread the ticket's buffered lines were posted in.
+
+    :returns: The dict given to buffer_comment() or None if not known.
+
+    """
+    thread = redis_store.connection().get(_thread_key(ticket_id))
+    return json.loads(thread) if thread else None
+
+
+def restore_comments(ticket_id, lines):
+    """Put drained lines back at the front of the buffer after a failure.
+    """
+    if lines:
+        redis_store.connection().lpush(
+            _lines_key(ticket_id), *reversed(lines)
+        )
+
+
+def merge_comments(lines):
+    """Join the lines, each keeping its author, into one comment body."""
+    return '\n\n'.join(lines)
@@ -0,0 +1,42 @@
+"""
+Collapse repeated Zendesk comment triggers for a ticket into one sync.
+
+comments_from_zendesk reconciles the whole Slack thread with all the ticket's
+comments, so one run after a burst of triggers does the work of all of them.
+The first trigger marks the ticket dirty and schedules the sync. Triggers that
+arrive before the sync starts find the ticket already dirty and are absorbed.
+
+"""
+from zenslackchat import redis_store
+
+
+def _dirty_key(ticket_id):
+    return redis_store.key('comments', ticket_id, 'dirty')
+
+
+def mark_dirty(ticket_id, ttl):
+    """Mark the ticket as needing a sync.
+
+    :param ticket_id: The Zendesk ticket ID.
+
+    :param ttl: Seconds until the mark expires, in case a sync is lost.
+
+    :returns: True if the ticket was clean and a sync must be scheduled,
+    False if one is already scheduled.
+
+    Redis errors are raised to the caller.
+
+    """
+    return bool(
+        redis_store.connection().set(_dirty_key(ticket_id), 1, nx=True, ex=ttl)
+    )
+
+
+def mark_clean(ticket_id):
+    """Clear the mark as the sync starts.
+
+    Triggers from now on schedule a new sync, so comments added while this
+    one is running are not missed.
+
+    """
+    redis_store.connection().delete(_dirty_key(ticket_id))
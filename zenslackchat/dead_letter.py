@@ -0,0 +1,238 @@
+"""
+Keep events which fail in the handler so they can be replayed later.
+
+Without this an outage in Zendesk or Slack loses every event which arrives
+during it. Failures are stored as FailedEvent rows with the error and number
+of attempts. They are replayed in bulk with replay_many(), used by the
+replay_failed_events command and the admin action.
+
+"""
+import time
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+from zenslackchat import metrics
+from zenslackchat import routing
+from zenslackchat.models import utcnow
+from zenslackchat.models import FailedEvent
+
+
+SLACK = 'slack'
+COMMENT_FLUSH = 'comment_flush'
+
+
+def format_error(error):
+    """Return the error and its traceback as text for storing."""
+    return ''.join(traceback.format_exception(
+        type(error), error, error.__traceback__
+    ))
+
+
+def record(source, event, error):
+    """Store an event which failed so it can be replayed.
+
+    This must never break event handling, so any error is logged instead.
+
+    :param source: SLACK, COMMENT_FLUSH or the name of the Zendesk webhook.
+
+    :param event: The event as given to the handler.
+
+    :param error: The exception raised by the handler.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        FailedEvent.objects.create(
+            source=source, event=event, error=format_error(error)
+        )
+
+    except:  # noqa
+        log.exception(f"Unable to store failed {source} event: {event}")
+
+    else:
+        log.warning(f"Stored failed {source} event for replay.")
+        metrics.incr(f'dead_letter.{source}')
+
+
+def handle(source, event):
+    """Run the handler for a stored event, raising any error.
+    """
+    # Avoid circular imports, these all record failures here.
+    if source == SLACK:
+        from zenslackchat.eventsview import handle_event
+        # The user was told about the failure when it first happened.
+        handle_event(event, report_errors=False)
+
+    elif source == COMMENT_FLUSH:
+        from zenslackchat.tasks import write_comment
+        write_comment(event['ticket_id'], event['comment'])
+
+    else:
+        from zenslackchat.zendesk_webhooks import WEBHOOKS
+        WEBHOOKS[source]().run(event)
+
+
+def replay(failed):
+    """Replay a stored event.
+
+    The FailedEvent is deleted if it succeeds. Otherwise its attempts, error
+    and last_attempt are updated.
+
+    :param failed: The FailedEvent instance.
+
+    :returns: None if it succeeded, otherwise the exception raised.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        handle(failed.source, failed.event)
+
+    except Exception as error:
+        log.warning(f"Replay of FailedEvent {failed.pk} failed: {error}")
+        failed.attempts += 1
+        failed.error = format_error(error)
+        failed.last_attempt = utcnow()
+        failed.save()
+        metrics.incr('dead_letter.replay.failed')
+        return error
+
+    failed.delete()
+    metrics.incr('dead_letter.replay.ok')
+
+
+def retry_after(error):
+    """Recover how long the API asked us to back off for.
+
+    Zenpy, slackclient and AsyncAPIClient errors carry the Retry-After header
+    in different places.
+
+    :returns: The seconds as a float or None.
+
+    """
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After')
+
+    try:
+        return float(value)
+
+    except (TypeError, ValueError):
+        return None
+
+
+class Pacer(object):
+    """Space out the start of each replay to keep under a rate limit.
+
+    Any thread can pause() it when an API asks us to back off.
+
+    """
+    def __init__(self, rate):
+        """
+        :param rate: The most replays to start per second. 0 is no limit.
+
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            delay = self.next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_at = max(self.next_at, time.monotonic()) + self.interval
+
+    def pause(self, seconds):
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+def order_key(failed):
+    """Return the key of the events which must be replayed in order.
+
+    Slack events are kept in order per thread, the others per ticket.
+
+    """
+    if failed.source == SLACK:
+        return f'thread:{routing.thread_key(failed.event)}'
+
+    return f"ticket:{failed.event.get('ticket_id', failed.pk)}"
+
+
+def replay_many(failed_events, concurrency=4, rate=5.0):
+    """Replay stored events on a pool of threads.
+
+    Events for the same Slack thread or Zendesk ticket are replayed one at a
+    time in the order given, so e.g. replies reach Zendesk in the order they
+    were sent. If one fails the rest of its thread are skipped and kept.
+
+    :param failed_events: An iterable of FailedEvent e.g. a queryset, oldest
+    first.
+
+    :param concurrency: The most threads of events replayed at once.
+
+    :param rate: The most replays started per second. A Retry-After from a
+    failed replay pauses all of them.
+
+    :returns: dict(replayed=<count>, failed=<count>, skipped=<count>)
+
+    """
+    log = logging.getLogger(__name__)
+
+    pacer = Pacer(rate)
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    results = dict(replayed=0, failed=0, skipped=0)
+
+    in_order = {}
+    for failed in failed_events:
+        in_order.setdefault(order_key(failed), []).append(failed)
+
+    def work(group):
+        try:
+            for index, failed in enumerate(group):
+                pacer.wait()
+                try:
+                    error = replay(failed)
+
+                except:  # noqa
+                    log.exception(f"Unable to replay FailedEvent {failed.pk}: ")
+                    error = True
+
+                with lock:
+                    results['failed' if error else 'replayed'] += 1
+
+                if error:
+                    with lock:
+                        results['skipped'] += len(group) - index - 1
+                    wait = retry_after(error)
+                    if wait:
+                        log.warning(f"Rate limited, pausing replay for {wait}s")
+                        pacer.pause(wait)
+                    break
+
+        finally:
+            # Each thread has its own DB connection.
+            connections.close_all()
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for group in in_order.values():
+            # Don't read ahead of the workers.
+            slots.acquire()
+            pool.submit(work, group)
+
+    log.info(
+        f"Replayed {results['replayed']}, failed {results['failed']}, "
+        f"skipped {results['skipped']}"
+    )
+
+    return results
@@ -0,0 +1,73 @@
+"""
+Slack event de-duplication.
+
+Slack redelivers an event if it doesn't get a response within 3 seconds. Each
+event has an event_id which stays the same across retries. I record the ids
+seen in Redis with a TTL so a redelivery can be spotted with one SET NX.
+
+"""
+import logging
+
+import redis
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat import redis_store
+
+
+def is_duplicate(event_id, ttl=None):
+    """Record the event_id and return whether it has been seen before.
+
+    :param event_id: The 'event_id' from the Slack event envelope.
+
+    Events without an id are never considered duplicates.
+
+    :param ttl: How long to remember the event_id for in seconds. The default
+    is settings.SLACK_EVENT_DEDUP_TTL.
+
+    :returns: True if this event_id was already seen, otherwise False.
+
+    If Redis is unavailable False is returned. I would rather risk handling an
+    event twice than drop it.
+
+    """
+    log = logging.getLogger(__name__)
+
+    if not event_id:
+        return False
+
+    if ttl is None:
+        ttl = settings.SLACK_EVENT_DEDUP_TTL
+
+    try:
+        first_seen = redis_store.connection().set(
+            redis_store.key('event', event_id), 1, nx=True, ex=ttl
+        )
+
+    except redis.RedisError:
+        log.exception(f"Unable to check event_id:<{event_id}> for repeats: ")
+        return False
+
+    if not first_seen:
+        log.info(f"Ignoring duplicate event_id:<{event_id}>")
+        metrics.incr('slack.event.duplicate')
+
+    return not first_seen
+
+
+def record_retry(retry_num, retry_reason):
+    """Count a Slack redelivery by its X-Slack-Retry-Reason.
+
+    Regular 'http_timeout' retries mean we are not responding inside Slack's
+    3 second budget.
+
+    :param retry_num: The X-Slack-Retry-Num header value.
+
+    :param retry_reason: The X-Slack-Retry-Reason header value.
+
+    """
+    reason = retry_reason or 'unknown'
+    logging.getLogger(__name__).warning(
+        f"Slack retry number <{retry_num}> because <{reason}>"
+    )
+    metrics.incr(f'slack.retry.{reason}')
@@ -1,17 +1,39 @@
+import json
 import pprint
 import logging
 
+import redis
 from django.conf import settings
-from rest_framework import status
-from rest_framework.views import APIView
-from rest_framework.response import Response
-
+from django.http import HttpResponse
+from django.http import JsonResponse
+from django.http import HttpResponseForbidden
+from django.http import HttpResponseBadRequest
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+
+from zenslackchat import intake
+from zenslackchat import journal
+from zenslackchat import dead_letter
+from zenslackchat import routing
+from zenslackchat import slack_users
+from zenslackchat.dedup import record_retry
+from zenslackchat.dedup import is_duplicate
 from zenslackchat.message import handler
+from zenslackchat.message import is_ignored
 from zenslackchat.models import SlackApp
 from zenslackchat.models import ZendeskApp
+from zenslackchat.clients import LazyClient
+from zenslackchat.async_views import AsyncView
+from zenslackchat.async_views import run_in_thread
+from zenslackchat.tasks import enqueue_slack_event
+
 
+# Events which carry a changed or new Slack user:
+USER_EVENTS = ('user_change', 'team_join')
 
-class Events(APIView):
+
+@method_decorator(csrf_exempt, name='dispatch')
+class Events(AsyncView):
     """Handle Events using the webapp instead of using the RTM API.
 
     This is handy as i don't need to run a specifc bot process just to handle
@@ -26,46 +48,192 @@ class Events(APIView):
     - Enter the "Request URL" e.g.: http://<instance id>.ngrok.io/slack/events/
     - Then "Subscribe to events on behalf of users"
     - Click "Add Workspace Event" and add "message.channels".
+    - Add "user_change" and "team_join" to keep the user directory current.
 
     Message on channels will now start being recieved. The bot will need to be
     invited to a channel first.
 
+    Most events Slack sends are thrown away by the handler. This is a plain
+    Django view rather than a DRF one, so the body is parsed once and ignored
+    events are rejected before any clients are created.
+
+    This is an async view. The verification is done on the event loop and the
+    blocking intake runs on a thread pool.
+
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """Events will come in over a POST request.
         """
         log = logging.getLogger(__name__)
 
-        slack_message = request.data
+        try:
+            slack_message = json.loads(request.body)
+
+        except ValueError:
+            log.error("Slack message body is not valid JSON!")
+            return HttpResponseBadRequest()
 
         if slack_message.get('token') != settings.SLACK_VERIFICATION_TOKEN:
             log.error("Slack message verification failed!")
-            return Response(status=status.HTTP_403_FORBIDDEN)
+            return HttpResponseForbidden()
 
         # verification challenge, convert to signature verification instead:
         if slack_message.get('type') == 'url_verification':
-            return Response(data=slack_message, status=status.HTTP_200_OK)
-
-        if 'event' in slack_message:
-            event = slack_message.get('event')
-            if settings.DEBUG:
-                log.debug(f'event received:\n{pprint.pformat(event)}\n')
-            try:
-                handler(
-                    event,
-                    our_channel=settings.SRE_SUPPORT_CHANNEL,
-                    slack_client=SlackApp.client(),
-                    zendesk_client=ZendeskApp.client(),
-                    workspace_uri=settings.SLACK_WORKSPACE_URI,
-                    zendesk_uri=settings.ZENDESK_TICKET_URI,
-                    user_id=settings.ZENDESK_USER_ID,
-                    group_id=settings.ZENDESK_GROUP_ID,
-                )
-
-            except:  # noqa
-                # I want all event even if they cause me problems. If I don't
-                # accept the webhook will be marked as broken and then no more
-                # events will be sent.
-                log.exception("Slack message_handler error: ")
-
-        return Response(status=status.HTTP_200_OK)
+            return JsonResponse(slack_message)
+
+        retry_num = request.META.get('HTTP_X_SLACK_RETRY_NUM')
+        retry_reason = request.META.get('HTTP_X_SLACK_RETRY_REASON')
+        if journal.enabled():
+            await run_in_thread(journal.record)('slack', request.body, {
+                'X-Slack-Retry-Num': retry_num,
+                'X-Slack-Retry-Reason': retry_reason,
+            })
+
+        try:
+            await run_in_thread(accept_envelope)(
+                slack_message, retry_num=retry_num, retry_reason=retry_reason,
+            )
+
+        except Exception:
+            # Acknowledge it anyway. Slack would only retry the same event
+            # and disable the subscription if too many requests fail.
+            log.exception("Unable to accept Slack event: ")
+
+        return HttpResponse(status=200)
+
+
+def accept_envelope(slack_message, retry_num=None, retry_reason=None):
+    """Filter, de-duplicate and pass a Slack event through the intake.
+
+    This is the common intake for events received over HTTP by the Events
+    view and over the websocket by the socket mode worker.
+
+    :param slack_message: The event envelope dict containing 'event' and
+    'event_id'.
+
+    :param retry_num: The Slack retry number if this is a redelivery.
+
+    :param retry_reason: Why Slack redelivered the event.
+
+    :returns: True if the event was handled, queued or deferred, otherwise
+    False.
+
+    """
+    log = logging.getLogger(__name__)
+
+    if retry_num:
+        record_retry(retry_num, retry_reason)
+
+    event = slack_message.get('event')
+    if not event:
+        return False
+
+    # Keep the user directory up to date. These aren't channel messages so
+    # the channel filter would throw them away.
+    if event.get('type') in USER_EVENTS:
+        slack_users.update(event['user'])
+        return True
+
+    if is_ignored(event, settings.SRE_SUPPORT_CHANNEL):
+        return False
+
+    if is_duplicate(slack_message.get('event_id')):
+        # Already received, don't create a second Zendesk ticket.
+        return False
+
+    if settings.DEBUG:
+        log.debug(f'event received:\n{pprint.pformat(event)}\n')
+
+    item_id = intake.slack_item_id(event)
+    priority = intake.slack_priority(event)
+    hold_key = routing.thread_key(event)
+    decision = intake.admit(item_id, priority, hold_key=hold_key)
+
+    if decision == intake.DEFER:
+        try:
+            intake.defer('slack', event, item_id, priority, hold_key)
+            return True
+
+        except redis.RedisError:
+            log.exception("Unable to defer event, handling now: ")
+
+    elif decision == intake.DROP:
+        return False
+
+    submit_event(event)
+
+    return True
+
+
+def submit_event(event):
+    """Queue or handle an event which has been admitted by the intake.
+
+    :param event: The raw slack event dict.
+
+    """
+    log = logging.getLogger(__name__)
+
+    if settings.ASYNC_EVENT_PROCESSING:
+        try:
+            enqueue_slack_event(event)
+
+        except:  # noqa
+            # The broker is unavailable, handle it now rather than
+            # lose the event.
+            log.exception("Unable to queue event, handling inline: ")
+            process_event(event)
+
+    else:
+        process_event(event)
+
+
+def process_event(event):
+    """Run the message handler for the given Slack event.
+
+    This is called inline from the Events view or from the celery worker when
+    ASYNC_EVENT_PROCESSING is enabled. If the handler fails the event is kept
+    for replay.
+
+    :param event: The raw slack event dict.
+
+    :returns: None
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        handle_event(event)
+
+    except Exception as error:
+        # I want all event even if they cause me problems. If I don't
+        # accept the webhook will be marked as broken and then no more
+        # events will be sent.
+        log.exception("Slack message_handler error: ")
+        dead_letter.record(dead_letter.SLACK, event, error)
+
+    finally:
+        intake.release(intake.slack_item_id(event))
+
+
+def handle_event(event, report_errors=True):
+    """Call the message handler, raising any error.
+
+    The clients are only created if the handler gets as far as using them.
+
+    :param event: The raw slack event dict.
+
+    :param report_errors: False to not tell the user on Slack when Zendesk
+    can't be reached e.g. when replaying the event.
+
+    """
+    handler(
+        event,
+        report_errors=report_errors,
+        our_channel=settings.SRE_SUPPORT_CHANNEL,
+        slack_client=LazyClient(SlackApp.client),
+        zendesk_client=LazyClient(ZendeskApp.client),
+        workspace_uri=settings.SLACK_WORKSPACE_URI,
+        zendesk_uri=settings.ZENDESK_TICKET_URI,
+        user_id=settings.ZENDESK_USER_ID,
+        group_id=settings.ZENDESK_GROUP_ID,
+    )
@@ -0,0 +1,164 @@
+"""
+In-memory stand ins for the Slack and Zendesk clients.
+
+These answer the calls the message handler and comments_from_zendesk make so
+journaled traffic can be replayed without touching the real services. Each
+call sleeps for the given latency to stand in for the network.
+
+"""
+import time
+import itertools
+import threading
+
+from zenpy.lib.api_objects import Ticket
+
+
+class FakeResponse(dict):
+    """Looks enough like a slackclient SlackResponse."""
+
+    @property
+    def data(self):
+        return self
+
+
+class FakeSlack(object):
+    """Slack WebClient stand in.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.posted = []
+        self._lock = threading.Lock()
+        self._ts = itertools.count(int(time.time() * 1e6))
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def users_info(self, user):
+        self._call()
+        return FakeResponse(user=dict(
+            id=user,
+            real_name=f'User {user}',
+            profile=dict(email=f'{user.lower()}@example.com'),
+        ))
+
+    def chat_postMessage(self, channel, text, thread_ts=None, **kwargs):
+        self._call()
+        ts = str(next(self._ts))
+        message = dict(
+            ts=f'{ts[:-6]}.{ts[-6:]}',
+            channel=channel,
+            text=text,
+            thread_ts=thread_ts,
+        )
+        with self._lock:
+            self.posted.append(message)
+        return FakeResponse(ok=True, channel=channel, message=message)
+
+    def conversations_replies(self, channel, ts):
+        self._call()
+        with self._lock:
+            messages = [
+                message for message in self.posted
+                if ts in (message['ts'], message['thread_ts'])
+            ]
+        return FakeResponse(messages=messages)
+
+
+class FakeComment(object):
+
+    def __init__(self, body, channel):
+        self.body = body
+        self.channel = channel
+
+    def to_dict(self):
+        return dict(body=self.body, via=dict(channel=self.channel))
+
+
+class FakeTickets(object):
+    """The client.tickets part of the Zenpy API.
+    """
+    def __init__(self, zendesk):
+        self.zendesk = zendesk
+
+    def __call__(self, id):
+        self.zendesk._call()
+        with self.zendesk._lock:
+            ticket = self.zendesk.tickets_by_id.get(int(id))
+            if ticket is None:
+                ticket = Ticket(id=int(id), status='open', subject='')
+                self.zendesk.tickets_by_id[int(id)] = ticket
+        return ticket
+
+    def create(self, ticket):
+        self.zendesk._call()
+        with self.zendesk._lock:
+            ticket.id = next(self.zendesk._ids)
+            ticket.status = 'open'
+            self.zendesk.tickets_by_id[ticket.id] = ticket
+            self.zendesk.chats[ticket.external_id] = ticket.id
+        return type('TicketAudit', (), dict(ticket=ticket))
+
+    def update(self, ticket):
+        """Apply the changed fields to the stored ticket, as Zendesk does.
+        """
+        self.zendesk._call()
+        with self.zendesk._lock:
+            changes = ticket.to_dict(serialize=True)
+            comment = getattr(ticket, 'comment', None)
+            if comment is not None:
+                self.zendesk.comments.setdefault(ticket.id, []).append(
+                    FakeComment(comment.body, 'api')
+                )
+                changes.pop('comment', None)
+            stored = self.zendesk.tickets_by_id.setdefault(
+                ticket.id, Ticket(id=ticket.id, status='open', subject='')
+            )
+            for name, value in changes.items():
+                setattr(stored, name, value)
+        return stored
+
+    def comments(self, ticket):
+        """Return the ticket's comments plus a new one from an agent.
+
+        Each comments webhook was sent because an agent commented, so the
+        fake adds one each time it is asked.
+
+        """
+        self.zendesk._call()
+        with self.zendesk._lock:
+            comments = self.zendesk.comments.setdefault(int(ticket), [])
+            comments.append(
+                FakeComment(f'Agent reply {len(comments) + 1}', 'web')
+            )
+            return list(comments)
+
+
+class FakeUsers(object):
+
+    def __init__(self, zendesk):
+        self.zendesk = zendesk
+
+    def me(self):
+        self.zendesk._call()
+        return type('User', (), dict(id=self.zendesk.user_id))
+
+
+class FakeZendesk(object):
+    """Zenpy client stand in.
+    """
+    def __init__(self, latency=0.0, user_id=1):
+        self.latency = latency
+        self.user_id = user_id
+        self.tickets_by_id = {}
+        # Slack chat_id to fake ticket id, used to replay comment webhooks.
+        self.chats = {}
+        self.comments = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.tickets = FakeTickets(self)
+        self.users = FakeUsers(self)
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
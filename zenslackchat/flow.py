@@ -0,0 +1,180 @@
+"""
+Run the steps of a flow concurrently, each once the steps it needs are done.
+
+Handling a new issue is a chain of remote calls. Many of these don't depend
+on each other, e.g. who is on call can be looked up while the ticket is
+created. A Flow declares each step and what it comes after, then runs every
+step as soon as it can so only the critical path is waited for:
+
+    flow = Flow('new_issue')
+    flow.step('ticket', lambda: create_ticket(...))
+    flow.step('on_call', PagerDutyApp.on_call, uses_db=True)
+    flow.step(
+        'welcome', lambda ticket, on_call: message_welcome(..., on_call),
+        after=('ticket', 'on_call')
+    )
+    results = flow.run()
+
+A step is called with the results of the steps it comes after as keyword
+arguments. Steps run on a thread pool shared by the process, sized by the
+setting FLOW_MAX_WORKERS. Steps using the database run on the calling thread
+instead, so they share its connection and transaction.
+
+Each step's duration is recorded as the timing 'flow.<flow>.<step>' and the
+whole flow as 'flow.<flow>.total'.
+
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+
+from webapp import settings
+from zenslackchat import metrics
+
+
+# The pool size, read once as settings may be replaced in tests.
+MAX_WORKERS = settings.FLOW_MAX_WORKERS
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def pool():
+    """Return the process wide thread pool steps are run on."""
+    global _pool, _pool_pid
+
+    with _lock:
+        # A forked worker can't use its parent's threads.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS,
+                thread_name_prefix='flow',
+            )
+            _pool_pid = os.getpid()
+
+    return _pool
+
+
+class Step(object):
+
+    def __init__(self, name, func, after, uses_db):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.uses_db = uses_db
+
+
+class Flow(object):
+    """A set of steps with the order they must be run in.
+    """
+    def __init__(self, name):
+        """
+        :param name: Used in the timing metric names e.g. 'new_issue'.
+
+        """
+        self.name = name
+        self.steps = {}
+
+    def step(self, name, func, after=(), uses_db=False):
+        """Add a step to the flow.
+
+        :param name: The step name, unique in this flow.
+
+        :param func: The callable to run. It is given the results of the
+        steps it comes after as keyword arguments.
+
+        :param after: The names of the steps which must finish first.
+
+        :param uses_db: True to run the step on the calling thread as it uses
+        Django's database connection.
+
+        """
+        if name in self.steps:
+            raise ValueError(f"The step '{name}' is already in the flow.")
+
+        for needed in after:
+            if needed not in self.steps:
+                raise ValueError(
+                    f"The step '{name}' comes after the unknown '{needed}'."
+                )
+
+        self.steps[name] = Step(name, func, after, uses_db)
+
+    def _timed(self, step, kwargs):
+        started = time.monotonic()
+        try:
+            return step.func(**kwargs)
+
+        finally:
+            duration = time.monotonic() - started
+            logging.getLogger(__name__).debug(
+                f"{self.name} step {step.name} took {duration:.3f}s"
+            )
+            metrics.timing(f'flow.{self.name}.{step.name}', duration)
+
+    def run(self):
+        """Run every step, each as soon as the steps it needs are done.
+
+        :returns: A dict of step name to its result.
+
+        If a step raises, the steps after it are skipped but the others are
+        still run. The first error is then raised.
+
+        """
+        log = logging.getLogger(__name__)
+
+        started = time.monotonic()
+        results = {}
+        errors = []
+        failed = set()
+        waiting = dict(self.steps)
+        # Ready steps to run on this thread and futures of those in the pool.
+        local = []
+        running = {}
+
+        def finished(step_name, outcome):
+            try:
+                results[step_name] = outcome()
+
+            except Exception as error:
+                log.exception(f"{self.name} step {step_name} failed: ")
+                errors.append(error)
+                failed.add(step_name)
+
+        while waiting or local or running:
+            for step in list(waiting.values()):
+                if failed.intersection(step.after):
+                    log.warning(f"{self.name} step {step.name} skipped.")
+                    failed.add(step.name)
+                    del waiting[step.name]
+
+                elif all(needed in results for needed in step.after):
+                    del waiting[step.name]
+                    kwargs = {needed: results[needed] for needed in step.after}
+                    if step.uses_db:
+                        local.append((step, kwargs))
+                    else:
+                        future = pool().submit(self._timed, step, kwargs)
+                        running[future] = step.name
+
+            if local:
+                # The pool works on the other ready steps meanwhile.
+                step, kwargs = local.pop(0)
+                finished(step.name, lambda: self._timed(step, kwargs))
+
+            elif running:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(running.pop(future), future.result)
+
+        metrics.timing(f'flow.{self.name}.total', time.monotonic() - started)
+
+        if errors:
+            raise errors[0]
+
+        return results
@@ -0,0 +1,284 @@
+"""
+A bounded intake stage in front of the Slack and Zendesk event handlers.
+
+Every event admitted is recorded in a Redis sorted set, scored by the time it
+was admitted, until its handling finishes. The size of the set is the intake
+depth and its lowest score gives the age of the oldest event still waiting.
+
+Once the depth reaches settings.INTAKE_MAX_DEPTH events are shed by priority:
+
+- HIGH (a new issue) is always admitted. Users must never lose a ticket.
+- NORMAL (a thread reply, a Zendesk comment) is deferred. It is put on a
+  FIFO list which the drain_deferred_events task empties as room is made.
+- LOW (the help command) is dropped.
+
+While a thread has deferred events, later events for it are deferred too so
+they are not handled out of order. The thread's hold expires INTAKE_ITEM_TTL
+seconds after its last deferred event, so a lost entry can't hold it forever.
+
+The limit is soft. The check and the admit are not atomic, so a burst can take
+the depth a little over it. Redis errors admit the event.
+
+"""
+import json
+import time
+import uuid
+import logging
+
+import redis
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat import redis_store
+
+
+HIGH = 'high'
+NORMAL = 'normal'
+LOW = 'low'
+
+ADMIT = 'admit'
+DEFER = 'defer'
+DROP = 'drop'
+
+# Admits the oldest deferred entry and releases its thread's hold in one step,
+# so a failure part way can't leave the thread held.
+_NEXT = """
+local raw = redis.call('LPOP', KEYS[1])
+if not raw then
+    return nil
+end
+
+local entry = cjson.decode(raw)
+redis.call('ZADD', KEYS[2], ARGV[1], entry['item_id'])
+
+local hold_key = entry['hold_key']
+if type(hold_key) == 'string' and hold_key ~= '' then
+    local held = ARGV[2] .. hold_key
+    if redis.call('DECR', held) <= 0 then
+        redis.call('DEL', held)
+    end
+end
+
+return raw
+"""
+
+# Loaded into Redis on first use, see rate_limit._take_script.
+_next_script = None
+
+
+def _pending_key():
+    return redis_store.key('intake', 'pending')
+
+
+def _deferred_key():
+    return redis_store.key('intake', 'deferred')
+
+
+def _held_key(hold_key=''):
+    return redis_store.key('intake', 'held', hold_key)
+
+
+def _script():
+    global _next_script
+
+    if _next_script is None:
+        _next_script = redis_store.connection().register_script(_NEXT)
+
+    return _next_script
+
+
+def slack_item_id(event):
+    """The intake id of a Slack event."""
+    return f"slack:{event.get('channel', '')}:{event.get('ts', '')}"
+
+
+def webhook_item_id(name, event):
+    """A new intake id for a Zendesk webhook event.
+
+    Each trigger gets its own id, even for the same ticket. The caller keeps
+    it in the event as 'intake_id' so it can be released once handled.
+
+    """
+    return f"zendesk:{name}:{event.get('ticket_id', '')}:{uuid.uuid4().hex}"
+
+
+def slack_priority(event):
+    """Work out how important a Slack event is.
+
+    :returns: HIGH for a new issue, LOW for the help command and NORMAL for
+    other thread replies.
+
+    """
+    thread_ts = event.get('thread_ts')
+    if not thread_ts or thread_ts == event.get('ts'):
+        return HIGH
+
+    if event.get('text', '').strip().lower() == 'help':
+        return LOW
+
+    return NORMAL
+
+
+def _depth(conn, now):
+    # Forget events whose handler never finished e.g. a killed worker.
+    conn.zremrangebyscore(
+        _pending_key(), '-inf', now - settings.INTAKE_ITEM_TTL
+    )
+    return conn.zcard(_pending_key())
+
+
+def admit(item_id, priority, hold_key=None, max_depth=None):
+    """Decide what to do with an event arriving at the intake.
+
+    :param item_id: The event's intake id.
+
+    :param priority: HIGH, NORMAL or LOW.
+
+    :param hold_key: Events with the same key are kept in order e.g. the
+    Slack thread.
+
+    :param max_depth: Override settings.INTAKE_MAX_DEPTH. 0 means no limit.
+
+    :returns: ADMIT, DEFER or DROP.
+
+    When ADMIT is returned the caller must call release() once handling
+    finishes. For DEFER the caller must pass the event to defer().
+
+    """
+    log = logging.getLogger(__name__)
+
+    if max_depth is None:
+        max_depth = settings.INTAKE_MAX_DEPTH
+
+    now = time.time()
+    try:
+        conn = redis_store.connection()
+        if priority != LOW and hold_key and conn.exists(_held_key(hold_key)):
+            decision = DEFER
+
+        elif max_depth <= 0 or priority == HIGH:
+            decision = ADMIT
+
+        elif _depth(conn, now) < max_depth:
+            decision = ADMIT
+
+        elif priority == NORMAL:
+            decision = DEFER
+
+        else:
+            decision = DROP
+
+        if decision == ADMIT:
+            conn.zadd(_pending_key(), {item_id: now})
+
+    except redis.RedisError:
+        log.exception(f"Unable to check intake, admitting <{item_id}>: ")
+        return ADMIT
+
+    if decision != ADMIT:
+        log.warning(f"Intake is full, {decision} {priority} <{item_id}>")
+
+    metrics.incr(f'intake.{decision}.{priority}')
+
+    return decision
+
+
+def release(item_id):
+    """Mark an admitted event as handled, freeing its place in the intake.
+    """
+    try:
+        redis_store.connection().zrem(_pending_key(), item_id)
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception(
+            f"Unable to release <{item_id}>: "
+        )
+
+
+def defer(source, item, item_id, priority, hold_key=None):
+    """Put an event at the back of the deferred list.
+
+    :param source: Which intake to return the event to e.g. 'slack' or the
+    webhook name.
+
+    :param item: The raw event dict.
+
+    Redis errors are raised to the caller.
+
+    """
+    entry = dict(
+        source=source,
+        item=item,
+        item_id=item_id,
+        priority=priority,
+        hold_key=hold_key,
+        deferred_at=time.time(),
+    )
+    pipe = redis_store.connection().pipeline()
+    pipe.rpush(_deferred_key(), json.dumps(entry))
+    if hold_key:
+        pipe.incr(_held_key(hold_key))
+        pipe.expire(_held_key(hold_key), settings.INTAKE_ITEM_TTL)
+    pipe.execute()
+
+
+def next_deferred(max_depth=None):
+    """Admit the oldest deferred event if there is room for it.
+
+    :returns: The entry dict given to defer() or None if there is no room or
+    nothing is deferred. The caller must hand the entry's item on for
+    handling.
+
+    """
+    if max_depth is None:
+        max_depth = settings.INTAKE_MAX_DEPTH
+
+    now = time.time()
+    conn = redis_store.connection()
+    if max_depth > 0 and _depth(conn, now) >= max_depth:
+        return None
+
+    # The thread's last deferred event lets new ones be admitted again.
+    raw = _script()(
+        keys=[_deferred_key(), _pending_key()],
+        args=[now, _held_key()],
+        client=conn,
+    )
+    if raw is None:
+        return None
+
+    entry = json.loads(raw)
+    metrics.timing('intake.deferred', now - entry['deferred_at'])
+
+    return entry
+
+
+def stats():
+    """Return the intake's current depth and ages for monitoring.
+
+    :returns: A dict with 'depth', 'oldest_age', 'deferred',
+    'oldest_deferred_age' and 'max_depth'. The ages are in seconds. This is
+    {} if Redis is unavailable.
+
+    """
+    now = time.time()
+    try:
+        conn = redis_store.connection()
+        depth = _depth(conn, now)
+        oldest = conn.zrange(_pending_key(), 0, 0, withscores=True)
+        deferred = conn.llen(_deferred_key())
+        first = conn.lindex(_deferred_key(), 0)
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception("Unable to recover intake: ")
+        return {}
+
+    return dict(
+        depth=depth,
+        oldest_age=round(now - oldest[0][1], 3) if oldest else 0,
+        deferred=deferred,
+        oldest_deferred_age=(
+            round(now - json.loads(first)['deferred_at'], 3) if first else 0
+        ),
+        max_depth=settings.INTAKE_MAX_DEPTH,
+    )
@@ -0,0 +1,245 @@
+"""
+An optional journal of every raw Slack event and Zendesk webhook received.
+
+When settings.EVENT_JOURNAL_PATH is set, each verified request body is kept
+exactly as the Events and webhook views received it. The bodies are written
+as gzip compressed newline delimited JSON, one file per process so no locking
+is needed between processes:
+
+    {"at": 1603983778.0115, "source": "slack", "body": "{...}", "headers": {}}
+
+The file is flushed at most every FLUSH_INTERVAL seconds rather than after
+each line, which would leave little for gzip to compress. A timer flushes
+what is left once traffic stops, so a crash loses at most the last few
+seconds and the file can be read while in use.
+
+The replay_journal command feeds journals back through the handlers against
+fake services to measure throughput and latency.
+
+"""
+import os
+import gzip
+import json
+import time
+import heapq
+import socket
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+from webapp import settings
+
+
+# Most seconds a received event waits to be flushed to the journal file.
+FLUSH_INTERVAL = 5
+
+_lock = threading.Lock()
+_journal = None
+_journal_pid = None
+_flushed_at = 0
+_timer = None
+
+
+def enabled():
+    """True if events are being journaled."""
+    return bool(settings.EVENT_JOURNAL_PATH)
+
+
+def _open():
+    global _journal, _journal_pid, _flushed_at, _timer
+
+    # A forked worker must not share its parent's file or timer.
+    if _journal is None or _journal_pid != os.getpid():
+        _timer = None
+        os.makedirs(settings.EVENT_JOURNAL_PATH, exist_ok=True)
+        name = (
+            f"events-{socket.gethostname()}-{os.getpid()}-"
+            f"{int(time.time())}.ndjson.gz"
+        )
+        path = os.path.join(settings.EVENT_JOURNAL_PATH, name)
+        _journal = gzip.open(path, 'ab')
+        _journal_pid = os.getpid()
+        _flushed_at = time.monotonic()
+        logging.getLogger(__name__).info(f"Journaling events to {path}")
+
+    return _journal
+
+
+@atexit.register
+def close():
+    """Finish the journal file for this process."""
+    global _journal, _timer
+
+    with _lock:
+        if _journal is not None and _journal_pid == os.getpid():
+            if _timer is not None:
+                _timer.cancel()
+            _journal.close()
+        _journal = None
+        _timer = None
+
+
+def _flush():
+    """Flush lines left waiting after the last write."""
+    global _flushed_at, _timer
+
+    try:
+        with _lock:
+            _timer = None
+            if _journal is not None and _journal_pid == os.getpid():
+                _journal.flush()
+                _flushed_at = time.monotonic()
+
+    except:  # noqa
+        logging.getLogger(__name__).exception("Unable to flush journal: ")
+
+
+def record(source, body, headers=None):
+    """Append a received request body to the journal.
+
+    This must never break event handling, so any error is logged instead.
+    It writes to a file, so from async code call it using run_in_thread().
+
+    :param source: 'slack' or the name of the Zendesk webhook.
+
+    :param body: The raw request body bytes.
+
+    :param headers: Any request headers needed to replay it e.g. the Slack
+    retry headers.
+
+    """
+    global _flushed_at, _timer
+
+    if not enabled():
+        return
+
+    try:
+        line = json.dumps(dict(
+            at=time.time(),
+            source=source,
+            body=body.decode('utf-8'),
+            headers={k: v for k, v in (headers or {}).items() if v},
+        ))
+        with _lock:
+            journal = _open()
+            journal.write(line.encode('utf-8') + b'\n')
+            waited = time.monotonic() - _flushed_at
+            if waited >= FLUSH_INTERVAL:
+                journal.flush()
+                _flushed_at = time.monotonic()
+
+            elif _timer is None:
+                # Flush anyway if nothing else is written for a while:
+                _timer = threading.Timer(FLUSH_INTERVAL - waited, _flush)
+                _timer.daemon = True
+                _timer.start()
+
+    except:  # noqa
+        logging.getLogger(__name__).exception("Unable to journal event: ")
+
+
+def _read_file(path):
+    log = logging.getLogger(__name__)
+
+    with gzip.open(path, 'rt', encoding='utf-8') as journal:
+        try:
+            for line in journal:
+                try:
+                    yield json.loads(line)
+
+                except ValueError:
+                    log.warning(f"Skipping partial line in {path}")
+
+        except EOFError:
+            # Still being written or the process died.
+            log.warning(f"{path} ends early, it may be in use.")
+
+
+def read(paths):
+    """Read one or more journal files as a single stream.
+
+    :param paths: The journal file paths.
+
+    :returns: A generator of the journal records in the order received.
+
+    """
+    return heapq.merge(
+        *[_read_file(path) for path in paths], key=lambda entry: entry['at']
+    )
+
+
+def replay(records, handlers, speed=1.0, concurrency=8):
+    """Feed journal records to handlers at the pace they were received.
+
+    :param records: An iterable of journal records e.g. from read().
+
+    :param handlers: A dict of source to a callable taking the decoded body.
+    Records from other sources are skipped.
+
+    :param speed: 1 for the original pace, 10 for ten times faster or 0 for
+    as fast as possible.
+
+    :param concurrency: How many records can be handled at once.
+
+    :returns: A dict of source to dict(count, errors, latencies). Latencies
+    are seconds from when the record was due to when it finished, so they
+    include any time spent waiting for a free thread. As fast as possible
+    records are due as soon as a thread is free.
+
+    """
+    log = logging.getLogger(__name__)
+
+    results = {}
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def work(entry, due):
+        source = entry['source']
+        failed = False
+        try:
+            handlers[source](json.loads(entry['body']))
+
+        except:  # noqa
+            log.exception(f"Replay of {source} event failed: ")
+            failed = True
+
+        finally:
+            connections.close_all()
+            slots.release()
+
+        latency = time.monotonic() - due
+        with lock:
+            result = results.setdefault(
+                source, dict(count=0, errors=0, latencies=[])
+            )
+            result['count'] += 1
+            result['errors'] += int(failed)
+            result['latencies'].append(latency)
+
+    start = time.monotonic()
+    first_at = None
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in records:
+            if entry['source'] not in handlers:
+                continue
+
+            if first_at is None:
+                first_at = entry['at']
+
+            if speed > 0:
+                due = start + (entry['at'] - first_at) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                slots.acquire()
+
+            else:
+                slots.acquire()
+                due = time.monotonic()
+
+            pool.submit(work, entry, due)
+
+    return results
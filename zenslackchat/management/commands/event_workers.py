@@ -0,0 +1,86 @@
+import sys
+import signal
+import logging
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from zenslackchat import routing
+
+
+def worker_command(shard, loglevel):
+    """Return the celery command line consuming one ordered events queue.
+
+    Each queue must have exactly one worker handling one event at a time, so
+    events from the same Slack thread are handled in the order received.
+
+    """
+    return [
+        sys.executable, '-m', 'celery', '-A', 'webapp', 'worker',
+        '-n', f'events{shard}@%h',
+        '-Q', routing.queue_name(shard),
+        '--concurrency=1',
+        '--prefetch-multiplier=1',
+        '-l', loglevel,
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run one concurrency 1 celery worker for each of the "
+        "SLACK_EVENT_SHARDS ordered events queues. If any worker stops the "
+        "rest are stopped too, so the process manager restarts them all."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=settings.SLACK_EVENT_SHARDS,
+            help="How many queues to consume (default SLACK_EVENT_SHARDS)."
+        )
+        parser.add_argument(
+            '-l', '--loglevel',
+            default='INFO',
+            help="The celery worker log level."
+        )
+
+    def handle(self, *args, **options):
+        log = logging.getLogger(__name__)
+
+        shards = max(options['shards'], 1)
+        workers = [
+            subprocess.Popen(worker_command(shard, options['loglevel']))
+            for shard in range(shards)
+        ]
+        log.info(f"Started {shards} event worker(s)")
+
+        def stop(signum, frame):
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.send_signal(signum)
+
+        handlers = {
+            signum: signal.signal(signum, stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+        try:
+            # Wait for the first worker to stop for any reason:
+            while all(worker.poll() is None for worker in workers):
+                try:
+                    workers[0].wait(timeout=1)
+
+                except subprocess.TimeoutExpired:
+                    pass
+
+        finally:
+            stop(signal.SIGTERM, None)
+            codes = [worker.wait() for worker in workers]
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        if any(codes):
+            raise CommandError(f"Event workers stopped with {codes}")
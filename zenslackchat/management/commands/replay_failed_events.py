@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from zenslackchat import dead_letter
+from zenslackchat.models import FailedEvent
+
+
+class Command(BaseCommand):
+    help = "Replay events which failed in the handler, oldest first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            help="Only replay events from 'slack', 'comments', 'email' or "
+            "'comment_flush'."
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.DEAD_LETTER_REPLAY_CONCURRENCY,
+            help="How many events are replayed at once."
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=settings.DEAD_LETTER_REPLAY_RATE,
+            help="The most replays started a second, 0 for no limit."
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            help="Skip events which have failed this many times."
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help="The most events to replay."
+        )
+
+    def handle(self, *args, **options):
+        failed_events = FailedEvent.objects.all()
+        if options['source']:
+            failed_events = failed_events.filter(source=options['source'])
+        if options['max_attempts']:
+            failed_events = failed_events.filter(
+                attempts__lt=options['max_attempts']
+            )
+        if options['limit']:
+            failed_events = failed_events[:options['limit']]
+
+        results = dead_letter.replay_many(
+            failed_events.iterator(),
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+        )
+
+        self.stdout.write(
+            f"Replayed {results['replayed']}, failed {results['failed']}, "
+            f"skipped {results['skipped']}."
+        )
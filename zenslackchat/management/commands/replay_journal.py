@@ -0,0 +1,122 @@
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from webapp import settings as webapp_settings
+from zenslackchat import journal
+from zenslackchat.message import handler
+from zenslackchat.models import ZendeskApp
+from zenslackchat.models import PagerDutyApp
+from zenslackchat.fake_services import FakeSlack
+from zenslackchat.fake_services import FakeZendesk
+from zenslackchat.zendesk_comments_to_slack import comments_from_zendesk
+
+
+def percentile(values, percent):
+    """Return the value below which the given percent of values fall."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay event journals through the handlers against fake Slack and "
+        "Zendesk services and report throughput and latency. Run this "
+        "against a local database, it creates issues."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+', help="The journal .ndjson.gz files."
+        )
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=1.0,
+            help="1 for the recorded pace, 10 for ten times faster or 0 for "
+            "as fast as possible."
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help="How many events can be handled at once."
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.05,
+            help="Seconds each fake Slack or Zendesk call takes."
+        )
+        parser.add_argument(
+            '--channel',
+            default=settings.SRE_SUPPORT_CHANNEL,
+            help="The support channel the journal was recorded on."
+        )
+
+    def handle(self, *args, **options):
+        slack = FakeSlack(latency=options['latency'])
+        zendesk = FakeZendesk(latency=options['latency'])
+
+        def slack_event(envelope):
+            event = envelope.get('event')
+            if event:
+                handler(
+                    event,
+                    our_channel=options['channel'],
+                    workspace_uri=settings.SLACK_WORKSPACE_URI,
+                    zendesk_uri=settings.ZENDESK_TICKET_URI,
+                    slack_client=slack,
+                    zendesk_client=zendesk,
+                    user_id=settings.ZENDESK_USER_ID,
+                    group_id=settings.ZENDESK_GROUP_ID,
+                )
+
+        def comments(event):
+            # Point the webhook at the fake ticket made for its Slack thread.
+            ticket_id = zendesk.chats.get(
+                event.get('chat_id'), event.get('ticket_id')
+            )
+            comments_from_zendesk(
+                dict(event, ticket_id=ticket_id), slack, zendesk
+            )
+
+        # Debounced replies would be flushed by celery with the real client.
+        debounce = webapp_settings.ZENDESK_COMMENT_DEBOUNCE
+        webapp_settings.ZENDESK_COMMENT_DEBOUNCE = 0
+        started = time.monotonic()
+        try:
+            # The handlers look these up through the configured apps, which
+            # would reach the real Zendesk and PagerDuty:
+            with patch.object(ZendeskApp, 'identity', lambda: None), \
+                    patch.object(PagerDutyApp, 'on_call', lambda when=None: {}):
+                results = journal.replay(
+                    journal.read(options['paths']),
+                    dict(slack=slack_event, comments=comments),
+                    speed=options['speed'],
+                    concurrency=options['concurrency'],
+                )
+
+        finally:
+            webapp_settings.ZENDESK_COMMENT_DEBOUNCE = debounce
+
+        elapsed = time.monotonic() - started
+
+        total = sum(result['count'] for result in results.values())
+        self.stdout.write(
+            f"Replayed {total} events in {elapsed:.2f}s "
+            f"({total / elapsed if elapsed else 0:.1f}/s)"
+        )
+        for source, result in sorted(results.items()):
+            latencies = result['latencies']
+            self.stdout.write(
+                f"{source}: {result['count']} events, "
+                f"{result['errors']} errors, latency ms "
+                f"p50={percentile(latencies, 50) * 1000:.0f} "
+                f"p95={percentile(latencies, 95) * 1000:.0f} "
+                f"p99={percentile(latencies, 99) * 1000:.0f} "
+                f"max={max(latencies) * 1000:.0f}"
+            )
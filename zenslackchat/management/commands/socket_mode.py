@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from zenslackchat.eventsview import accept_envelope
+from zenslackchat.socket_mode import SocketModeWorker
+
+
+def on_envelope(payload, retry_num, retry_reason):
+    """Pass the event on to the same intake as the HTTP Events view.
+
+    This runs on a worker thread, so stale DB connections are tidied up as a
+    request would do.
+
+    """
+    close_old_connections()
+    try:
+        accept_envelope(payload, retry_num, retry_reason)
+
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Receive Slack events over a Socket Mode websocket."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-in-flight',
+            type=int,
+            default=settings.SOCKET_MODE_MAX_IN_FLIGHT,
+            help="How many events can be handled at once."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.SLACK_APP_TOKEN:
+            raise CommandError("SLACK_APP_TOKEN is not set!")
+
+        logging.getLogger(__name__).info("Starting Slack socket mode worker")
+        worker = SocketModeWorker(
+            settings.SLACK_APP_TOKEN,
+            on_envelope,
+            max_in_flight=options['max_in_flight'],
+        )
+        try:
+            asyncio.run(worker.run())
+
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from zenslackchat import slack_users
+from zenslackchat.models import SlackApp
+
+
+class Command(BaseCommand):
+    help = "Load every Slack workspace member into the user directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=200,
+            help="The users asked for in each users.list call."
+        )
+
+    def handle(self, *args, **options):
+        stored = slack_users.load_all(
+            SlackApp.client(), page_size=options['page_size']
+        )
+        self.stdout.write(f"Stored {stored} Slack users.")
@@ -12,21 +12,28 @@ import logging
 import zenpy
 
 from webapp import settings
+from zenslackchat import slack_users
+from zenslackchat.flow import Flow
+from zenslackchat.clients import real_client
+from zenslackchat.models import ZendeskApp
 from zenslackchat.models import PagerDutyApp
 from zenslackchat.models import ZenSlackChat
 from zenslackchat.models import NotFoundError
 from zenslackchat.models import OutOfHoursInformation
 from zenslackchat.slack_api import message_url
 from zenslackchat.slack_api import post_message
-from zenslackchat.zendesk_api import get_ticket
+from zenslackchat.tasks import debounce_comment
+from zenslackchat.tasks import flush_pending_comments
+from zenslackchat.circuit import CircuitOpen
 from zenslackchat.zendesk_api import add_comment
 from zenslackchat.zendesk_api import close_ticket
 from zenslackchat.zendesk_api import create_ticket
+from zenslackchat.zendesk_api import is_closed_error
 from zenslackchat.zendesk_api import zendesk_ticket_url
 from zenslackchat.message_tools import is_resolved
+from zenslackchat.message_tools import closed_message
 from zenslackchat.message_tools import ts_to_datetime
-from zenslackchat.message_tools import message_who_is_on_call
-from zenslackchat.message_tools import message_issue_zendesk_url
+from zenslackchat.message_tools import message_welcome
 
 
 # See https://api.slack.com/events/message for subtypes.
@@ -45,9 +52,111 @@ IGNORED_SUBTYPES = [
 # description and the bot was ignoring this.
 
 
+def is_ignored(event, our_channel):
+    """Decide if the event is one the handler will never act on.
+
+    This needs no clients or database access so it can be used to throw
+    events away as soon as they are received.
+
+    :param event: The slack event received.
+
+    :param our_channel: The slack channel id we listen to.
+
+    :returns: True if the event should be ignored, otherwise False.
+
+    """
+    log = logging.getLogger(__name__)
+
+    channel_id = event.get('channel', "").strip()
+    text = event.get('text', '')
+
+    if channel_id != our_channel:
+        if settings.DEBUG:
+            log.debug(
+                f"Ignoring event from channel id:<{channel_id} as its not from"
+                f"our support channel id:{our_channel}"
+            )
+        return True
+
+    # I'm ignoring most subtypes, I might be able to ignore all. I can manage
+    # the message / message-reply based on the ts/thread_ts fields and whether
+    # they are populated or not. I'm calling 'ts' chat_id and 'thread_ts'
+    # thread_id.
+    subtype = event.get('subtype')
+    if subtype in IGNORED_SUBTYPES:
+        log.debug(f"Ignoring subtype we don't handle: {subtype}")
+        return True
+
+    elif 'bot_id' in event:
+        log.debug(f"Ignoring bot message to prevent repeats: {text}")
+        return True
+
+    return False
+
+
+def new_issue_flow(
+    slack_client, zendesk_client, zendesk_uri, chat_id, channel_id, user_id,
+    group_id, recipient_email, text, slack_chat_url
+):
+    """Return the Flow raising a ticket for a new message and replying.
+
+    Who is on call and whether it is out of hours are looked up while the
+    ticket is created. The issue is then stored while the welcome message is
+    posted.
+
+    """
+    # The steps make their calls on other threads:
+    slack_client = real_client(slack_client)
+    zendesk_client = real_client(zendesk_client)
+
+    flow = Flow('new_issue')
+    flow.step('ticket', lambda: create_ticket(
+        zendesk_client,
+        chat_id=chat_id,
+        user_id=user_id,
+        group_id=group_id,
+        recipient_email=recipient_email,
+        subject=text,
+        slack_message_url=slack_chat_url,
+    ))
+    flow.step('on_call', PagerDutyApp.on_call, uses_db=True)
+
+    # Is this an issue created out of hours?
+    flow.step(
+        'out_of_hours',
+        lambda: OutOfHoursInformation.out_of_hours_message(
+            # ID is UTC epoch time. I use this for the 'now' time. This
+            # should handle any delay with messages from slack to the bot.
+            ts_to_datetime(chat_id)
+        ),
+        uses_db=True
+    )
+
+    # Store all the details and notify:
+    flow.step(
+        'open',
+        lambda ticket: ZenSlackChat.open(
+            channel_id, chat_id, ticket_id=ticket.id,
+            ticket_status=ticket.status
+        ),
+        after=('ticket',),
+        uses_db=True
+    )
+    flow.step(
+        'welcome',
+        lambda ticket, on_call, out_of_hours: message_welcome(
+            slack_client, zendesk_uri, ticket.id, chat_id, channel_id,
+            on_call=on_call, out_of_hours=out_of_hours
+        ),
+        after=('ticket', 'on_call', 'out_of_hours')
+    )
+
+    return flow
+
+
 def handler(
     event, our_channel, workspace_uri, zendesk_uri, slack_client,
-    zendesk_client, user_id, group_id
+    zendesk_client, user_id, group_id, report_errors=True
 ):
     """Decided what to do with the message we have received.
 
@@ -69,6 +178,9 @@ def handler(
 
     :param group_id: Which Zendesk group the ticket belongs to.
 
+    :param report_errors: False to not post in the thread when Zendesk can't
+    be reached, e.g. when replaying a kept event.
+
     :returns: True or False.
 
     False means the message was ignored as its not one we handle.
@@ -79,25 +191,7 @@ def handler(
     channel_id = event.get('channel', "").strip()
     text = event.get('text', '')
 
-    if channel_id != our_channel:
-        if settings.DEBUG:
-            log.debug(
-                f"Ignoring event from channel id:<{channel_id} as its not from"
-                f"our support channel id:{our_channel}"
-            )
-        return False
-
-    # I'm ignoring most subtypes, I might be able to ignore all. I can manage
-    # the message / message-reply based on the ts/thread_ts fields and whether
-    # they are populated or not. I'm calling 'ts' chat_id and 'thread_ts'
-    # thread_id.
-    subtype = event.get('subtype')
-    if subtype in IGNORED_SUBTYPES:
-        log.debug(f"Ignoring subtype we don't handle: {subtype}")
-        return False
-
-    elif 'bot_id' in event:
-        log.debug(f"Ignoring bot message to prevent repeats: {text}")
+    if is_ignored(event, our_channel):
         return False
 
     if settings.DISABLE_MESSAGE_PROCESSING:
@@ -119,10 +213,9 @@ def handler(
     # Recover the slack channel message author's email address. I assume
     # this is always set on all accounts.
     log.debug(f"Recovering profile for user <{slack_user_id}>")
-    resp = slack_client.users_info(user=slack_user_id)
-    # print(f"resp.event:\n{resp.event}\n")
-    real_name = resp.data['user']['real_name']
-    recipient_email = resp.data['user']['profile'].get('email', '')
+    user = slack_users.profile(slack_client, slack_user_id)
+    real_name = user['real_name']
+    recipient_email = user['email']
     if not recipient_email:
         log.error(
             f"For slack profile '{real_name}' I was not able to recover an "
@@ -132,9 +225,6 @@ def handler(
         # hmm this is not the answer as its getting into a loop :(
         return False
 
-    # zendesk ticket instance
-    ticket = None
-
     # Get any existing ticket from zendesk:
     if chat_id and thread_id:
         log.debug(
@@ -156,10 +246,11 @@ def handler(
         else:
             # If this is a command handle it otherwise ship it as a comment to
             # Zendesk. You can only add comments if the Zendesk ticket is not
-            # closed.
+            # closed. The ticket's status is mirrored locally and only the
+            # changed fields are written, so the ticket is never recovered
+            # from Zendesk here.
             ticket_id = issue.ticket_id
             url = zendesk_ticket_url(zendesk_uri, ticket_id)
-            ticket = get_ticket(zendesk_client, ticket_id)
             log.debug(
                 f'Recoverd ticket {ticket_id} from slack {slack_chat_url}'
             )
@@ -169,7 +260,12 @@ def handler(
                 log.debug(
                     f'Closing ticket {ticket_id} from slack {slack_chat_url}.'
                 )
-                close_ticket(zendesk_client, ticket_id)
+                if issue.ticket_status != 'closed':
+                    # Replies sent just before this are still buffered and
+                    # can't be added once the ticket is closed.
+                    if settings.ZENDESK_COMMENT_DEBOUNCE > 0:
+                        flush_pending_comments(ticket_id)
+                    close_ticket(zendesk_client, ticket_id)
                 ZenSlackChat.resolve(channel_id, thread_id)
                 post_message(
                     slack_client, thread_id, channel_id,
@@ -187,20 +283,39 @@ def handler(
                 )
 
             else:
-                if ticket.status == 'closed':
+                if issue.ticket_status == 'closed':
                     post_message(
                         slack_client, thread_id, channel_id,
-                        f"🤖 This ticket is closed {url}. Please raise a "
-                        "new support issue."
+                        closed_message(url)
                     )
 
                 else:
-                    # Send this message on to Zendesk.
-                    add_comment(
-                        zendesk_client,
-                        ticket,
-                        f"{real_name} (Slack): {text}"
-                    )
+                    # Send this message on to Zendesk. Bursts of replies are
+                    # merged into one comment if debouncing is enabled.
+                    comment = f"{real_name} (Slack): {text}"
+                    debounced = False
+                    if settings.ZENDESK_COMMENT_DEBOUNCE > 0:
+                        debounced = debounce_comment(
+                            ticket_id, thread_id, comment,
+                            channel_id=channel_id
+                        )
+                    if not debounced:
+                        try:
+                            add_comment(
+                                zendesk_client, ticket_id, comment,
+                                author_id=ZendeskApp.identity()
+                            )
+
+                        except zenpy.lib.exception.APIException as error:
+                            if not is_closed_error(error):
+                                raise
+                            # Closed since the status was last mirrored, or
+                            # the issue is from before it was mirrored.
+                            ZenSlackChat.mirror_ticket(ticket_id, 'closed')
+                            post_message(
+                                slack_client, thread_id, channel_id,
+                                closed_message(url)
+                            )
 
     else:
         slack_chat_url = message_url(workspace_uri, channel_id, chat_id)
@@ -213,46 +328,21 @@ def handler(
                 f"Received message from '{recipient_email}': {text}\n"
             )
             try:
-                ticket = create_ticket(
-                    zendesk_client,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    group_id=group_id,
-                    recipient_email=recipient_email,
-                    subject=text,
-                    slack_message_url=slack_chat_url,
-                )
-
-            except zenpy.lib.exception.APIException:
-                post_message(
-                    slack_client, thread_id, channel_id,
-                    "🤖 I'm unable to talk to Zendesk (API Error)."
-                )
-                log.exception("Zendesk API error: ")
-
-            else:
-                # Store all the details and notify:
-                ZenSlackChat.open(channel_id, chat_id, ticket_id=ticket.id)
-                message_issue_zendesk_url(
-                    slack_client, zendesk_uri, ticket.id, chat_id, channel_id
-                )
-                message_who_is_on_call(
-                    PagerDutyApp.on_call(),
-                    slack_client,
-                    chat_id,
-                    channel_id
-                )
-
-                # Is this an issue created out of hours?
-                OutOfHoursInformation.inform_if_out_of_hours(
-                    # ID is UTC epoch time. I use this for the 'now' time. This
-                    # should handle any delay with messages from slack to the
-                    # bot.
-                    ts_to_datetime(chat_id),
-                    chat_id,
-                    channel_id,
-                    slack_client
-                )
+                new_issue_flow(
+                    slack_client, zendesk_client, zendesk_uri, chat_id,
+                    channel_id, user_id, group_id, recipient_email, text,
+                    slack_chat_url
+                ).run()
+
+            except (zenpy.lib.exception.APIException, CircuitOpen):
+                if report_errors:
+                    post_message(
+                        slack_client, thread_id, channel_id,
+                        "🤖 I'm unable to talk to Zendesk (API Error)."
+                    )
+                # Raised so the message is kept and the ticket can be raised
+                # by replaying it once Zendesk is back.
+                raise
 
         else:
             # No, we have a ticket already for this.
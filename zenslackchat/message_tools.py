@@ -24,28 +24,108 @@ from zenslackchat.slack_api import post_message
 from zenslackchat.zendesk_api import zendesk_ticket_url
 
 
-def message_who_is_on_call(on_call, slack_client, chat_id, channel_id):
-    """Post to the chat who is primary and secondary on call.
+# Slack's limit on the text of a section block.
+SECTION_TEXT_LIMIT = 3000
 
-    This will only message if the PagerDutyApp / OAuth set up has been done.
 
+def escape_mrkdwn(text):
+    """Escape the characters Slack treats as control characters in mrkdwn.
     """
-    if on_call != {}:
-        message = (
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def closed_message(url):
+    """Return the reply telling a user their ticket can't be added to.
+
+    :param url: The link to the Zendesk ticket.
+
+    """
+    return (
+        f"🤖 This ticket is closed {url}. Please raise a new support issue."
+    )
+
+
+def welcome_message(zendesk_uri, ticket_id, on_call=None, out_of_hours=None):
+    """Return the Block Kit message posted to the thread of a new issue.
+
+    :param zendesk_uri: The base link to zendesk agent tickets.
+
+    :param ticket_id: The Zendesk ID of the new ticket.
+
+    :param on_call: The dict(primary=..., secondary=...) from
+    PagerDutyApp.on_call(). Nothing is said about who is on call if this is
+    empty.
+
+    :param out_of_hours: The out of hours contact information, or None in
+    office hours.
+
+    :returns: (text, blocks). The text is the same information for
+    notifications and clients which can't show blocks.
+
+    """
+    url = zendesk_ticket_url(zendesk_uri, ticket_id)
+    lines = [f"Hello, your new support request is {url}"]
+    blocks = [{
+        'type': 'section',
+        'text': {
+            'type': 'mrkdwn',
+            'text': f"Hello, your new support request is <{url}|{ticket_id}>",
+        },
+    }]
+
+    if on_call:
+        lines.append(
             f"📧 Primary on call: {on_call['primary']}\n"
             f"ℹ️ Secondary on call: {on_call['secondary']}."
         )
-        post_message(slack_client, chat_id, channel_id, message)
+        blocks.append({
+            'type': 'section',
+            'fields': [
+                {
+                    'type': 'mrkdwn',
+                    'text': (
+                        "*📧 Primary on call*\n"
+                        f"{escape_mrkdwn(on_call['primary'])}"
+                    ),
+                },
+                {
+                    'type': 'mrkdwn',
+                    'text': (
+                        "*ℹ️ Secondary on call*\n"
+                        f"{escape_mrkdwn(on_call['secondary'])}"
+                    ),
+                },
+            ],
+        })
+
+    if out_of_hours:
+        lines.append(out_of_hours)
+        blocks.append({'type': 'divider'})
+        blocks.append({
+            'type': 'section',
+            'text': {
+                'type': 'mrkdwn',
+                'text': out_of_hours[:SECTION_TEXT_LIMIT],
+            },
+        })
+
+    return '\n\n'.join(lines), blocks
+
+
+def message_welcome(
+    slack_client, zendesk_uri, ticket_id, chat_id, channel_id, on_call=None,
+    out_of_hours=None
+):
+    """Post the Zendesk URL, who is on call and any out of hours information
+    for a new issue as one Slack message.
 
+    See welcome_message() for the arguments.
 
-def message_issue_zendesk_url(
-    slack_client, zendesk_uri, ticket_id, chat_id, channel_id
-):
-    """Post to slack where the Zendesk URL of the issue.
     """
-    url = zendesk_ticket_url(zendesk_uri, ticket_id)
-    message = f"Hello, your new support request is {url}"
-    post_message(slack_client, chat_id, channel_id, message)
+    text, blocks = welcome_message(
+        zendesk_uri, ticket_id, on_call, out_of_hours
+    )
+    return post_message(slack_client, chat_id, channel_id, text, blocks=blocks)
 
 
 _resolve_cmds = ['resolve', 'resolve ticket', '🆗', '✅']
@@ -0,0 +1,75 @@
+"""
+Simple counters and timings kept in a Redis hash.
+
+The web, worker and beat processes all update the same hash so totals can be
+reported from anywhere. Recording a metric must never break event handling,
+so Redis errors are logged and ignored.
+
+"""
+import logging
+
+import redis
+
+from zenslackchat import redis_store
+
+
+def _metrics_key():
+    return redis_store.key('metrics')
+
+
+def incr(name, amount=1):
+    """Increment the named counter.
+
+    :param name: The counter e.g. 'slack.retry.http_timeout'.
+
+    :param amount: How much to increment by (default 1).
+
+    """
+    try:
+        redis_store.connection().hincrby(_metrics_key(), name, amount)
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception(f"Unable to record <{name}>: ")
+
+
+def timing(name, seconds):
+    """Record how long something took.
+
+    Two values are kept: '<name>.count' and '<name>.total' from which the
+    average can be worked out.
+
+    :param name: The timing e.g. 'flow.create_ticket'.
+
+    :param seconds: The duration as a float.
+
+    """
+    try:
+        pipe = redis_store.connection().pipeline()
+        pipe.hincrby(_metrics_key(), f'{name}.count', 1)
+        pipe.hincrbyfloat(_metrics_key(), f'{name}.total', seconds)
+        pipe.execute()
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception(f"Unable to record <{name}>: ")
+
+
+def snapshot():
+    """Return all the recorded metrics.
+
+    :returns: A dict of metric name to number or {} if Redis is unavailable.
+
+    """
+    returned = {}
+
+    try:
+        raw = redis_store.connection().hgetall(_metrics_key())
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception("Unable to recover metrics: ")
+
+    else:
+        for name, value in raw.items():
+            value = float(value)
+            returned[name.decode()] = int(value) if value.is_integer() else value
+
+    return returned
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:57
+
+from django.db import migrations, models
+import zenslackchat.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0010_auto_20210312_1119'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=50)),
+                ('event', models.JSONField()),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(default=zenslackchat.models.utcnow)),
+                ('last_attempt', models.DateTimeField(default=zenslackchat.models.utcnow)),
+            ],
+            options={
+                'ordering': ('created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import zenslackchat.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0011_failedevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OnCallWindow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy_id', models.CharField(max_length=20)),
+                ('escalation_level', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=200)),
+                ('start', models.DateTimeField(blank=True, null=True)),
+                ('end', models.DateTimeField(blank=True, null=True)),
+                ('fetched_at', models.DateTimeField(default=zenslackchat.models.utcnow)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='oncallwindow',
+            index=models.Index(fields=['policy_id', 'start'], name='zenslackcha_policy__ac7f49_idx'),
+        ),
+    ]
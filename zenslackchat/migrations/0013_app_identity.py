@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0012_oncallwindow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackapp',
+            name='bot_id',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='zendeskapp',
+            name='user_id',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:11
+
+from django.db import migrations, models
+import zenslackchat.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0013_app_identity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=20, unique=True)),
+                ('real_name', models.CharField(blank=True, default='', max_length=200)),
+                ('email', models.CharField(blank=True, default='', max_length=254)),
+                ('deleted', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(default=zenslackchat.models.utcnow)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0014_slackuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zenslackchat',
+            name='ticket_status',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='zenslackchat',
+            name='ticket_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:32
+
+from django.db import migrations, models
+import zenslackchat.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0015_ticket_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCloseJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_ids', models.JSONField()),
+                ('job_id', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(db_index=True, default='pending', max_length=20)),
+                ('progress', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=zenslackchat.models.utcnow)),
+                ('updated_at', models.DateTimeField(default=zenslackchat.models.utcnow)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
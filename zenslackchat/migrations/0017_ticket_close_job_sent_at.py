@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0016_ticket_close_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketclosejob',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
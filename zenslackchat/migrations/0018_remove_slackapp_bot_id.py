@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zenslackchat', '0017_ticket_close_job_sent_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='slackapp',
+            name='bot_id',
+        ),
+    ]
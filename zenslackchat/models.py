@@ -4,15 +4,22 @@ from datetime import datetime
 from datetime import timedelta
 from operator import itemgetter
 
-import requests
-import requests.adapters
 from zenpy import Zenpy
-from slack import WebClient
 from django.db import models
+from django.db import transaction
 from pdpyras import APISession
+from django.utils.dateparse import parse_datetime
 
 from webapp import settings
+from zenslackchat import metrics
 from zenslackchat import slack_api
+from zenslackchat import redis_store
+from zenslackchat.clients import cache
+from zenslackchat.clients import PooledAdapter
+from zenslackchat.clients import AsyncAPIClient
+from zenslackchat.clients import PooledWebClient
+from zenslackchat.clients import pooled_session
+from zenslackchat.async_views import run_in_thread
 from zenslackchat.slack_api import post_message
 
 
@@ -55,11 +62,23 @@ class ZenSlackChat(models.Model):
     # When the issue was resolved:
     closed = models.DateTimeField(null=True, blank=True)
 
+    # A copy of the Zendesk ticket's status e.g. 'open' or 'closed', so
+    # replies can be handled without asking Zendesk. It is kept up to date by
+    # the comments webhook and when the bot changes the ticket. Empty if not
+    # known.
+    ticket_status = models.CharField(max_length=20, blank=True, default='')
+
+    # When the ticket was changed in Zendesk to the ticket_status:
+    ticket_updated_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = (('channel_id', 'chat_id'),)
 
     @classmethod
-    def open(cls, channel_id, chat_id, ticket_id=None, opened=None):
+    def open(
+        cls, channel_id, chat_id, ticket_id=None, opened=None,
+        ticket_status=''
+    ):
         """Create a new issue for the chat bot to monitor.
 
         :param channel_id: The slack channel the conversation is in.
@@ -70,6 +89,8 @@ class ZenSlackChat(models.Model):
 
         :param opened: The optional datetime (default is UTC now).
 
+        :param ticket_status: The optional Zendesk Ticket status.
+
         :returns: A ZenSlackChat instance.
 
         """
@@ -79,6 +100,10 @@ class ZenSlackChat(models.Model):
             ticket_id=ticket_id
         )
 
+        if ticket_status:
+            kwargs['ticket_status'] = ticket_status
+            kwargs['ticket_updated_at'] = utcnow()
+
         if opened:
             kwargs['opened'] = opened
         else:
@@ -139,6 +164,32 @@ class ZenSlackChat(models.Model):
 
         return found
 
+    @classmethod
+    def get_for_ticket(cls, channel_id, ticket_id):
+        """Get the conversation raised for a Zendesk ticket.
+
+        :param channel_id: The slack channel the conversation is in.
+
+        :param ticket_id: The Zendesk Ticket ID.
+
+        :returns: A ZenSlackChat instance, the most recent if there are more.
+
+        If nothing is found for channel_id and ticket_id then NotFoundError
+        will be raised.
+
+        """
+        found = cls.objects.filter(
+            channel_id=channel_id, ticket_id=str(ticket_id)
+        ).order_by('-opened').first()
+
+        if found is None:
+            raise NotFoundError(
+                f"Nothing found for channel_id:<{channel_id}> and "
+                f"ticket_id:<{ticket_id}>"
+            )
+
+        return found
+
     @classmethod
     def resolve(cls, channel_id, chat_id, closed=None):
         """Close the issue and stop the bot monitoring this chat.
@@ -162,10 +213,71 @@ class ZenSlackChat(models.Model):
             issue.closed = closed
         else:
             issue.closed = utcnow()
+        # The bot closes the ticket before resolving the issue.
+        issue.ticket_status = 'closed'
+        issue.ticket_updated_at = issue.closed
         issue.save()
 
         return issue
 
+    @classmethod
+    def resolve_many(cls, queryset, closed=None):
+        """Resolve many issues with a single UPDATE.
+
+        :param queryset: The ZenSlackChat issues to resolve. Those already
+        resolved are left as they are.
+
+        :param closed: The optional datetime (default is UTC now).
+
+        :returns: (resolved, ticket_ids) the number of issues resolved and
+        the Zendesk Ticket IDs of those whose ticket isn't known to be
+        closed. Nothing is sent to Zendesk or Slack, the caller closes the
+        tickets e.g. with the close_zendesk_tickets task.
+
+        """
+        closed = closed or utcnow()
+        queryset = queryset.filter(active=True)
+
+        with transaction.atomic():
+            ticket_ids = list(
+                queryset.exclude(ticket_status='closed').exclude(
+                    ticket_id=''
+                ).values_list('ticket_id', flat=True)
+            )
+            resolved = queryset.update(
+                active=False,
+                closed=closed,
+                ticket_status='closed',
+                ticket_updated_at=closed,
+            )
+
+        return resolved, ticket_ids
+
+    @classmethod
+    def mirror_ticket(cls, ticket_id, status, updated_at=None):
+        """Record a change to the Zendesk ticket's status.
+
+        :param ticket_id: The Zendesk Ticket ID.
+
+        :param status: The ticket's status e.g. 'open'.
+
+        :param updated_at: The datetime Zendesk changed the ticket (default is
+        UTC now). Webhooks can arrive out of order, so a change older than
+        the one stored is ignored.
+
+        :returns: The number of issues updated.
+
+        """
+        updated_at = updated_at or utcnow()
+        unknown = models.Q(ticket_updated_at__isnull=True)
+        older = models.Q(ticket_updated_at__lte=updated_at)
+
+        issues = cls.objects.filter(unknown | older, ticket_id=str(ticket_id))
+        return issues.update(
+            ticket_status=status.strip().lower(),
+            ticket_updated_at=updated_at,
+        )
+
     @classmethod
     def open_issues(cls):
         """Return a list of open issues the bot needs to monitor.
@@ -275,6 +387,16 @@ class SlackApp(models.Model):
     def client(cls):
         """Returns a Slack web client ready for use.
 
+        The client is shared by the process and rebuilt when a SlackApp is
+        saved or deleted.
+
+        """
+        return cache.get('slack', cls.new_client)
+
+    @classmethod
+    def new_client(cls):
+        """Returns a new Slack web client.
+
         This recovers the latest SlackApp instance and uses its
         bot_access_token field for the web client.
 
@@ -286,10 +408,107 @@ class SlackApp(models.Model):
                 f"Bot Access Token:{app.bot_access_token}"
             )
 
-        return WebClient(token=app.bot_access_token)
+        return PooledWebClient(token=app.bot_access_token)
+
+    @classmethod
+    def async_client(cls):
+        """Returns an AsyncAPIClient for the Slack Web API.
+
+        The calls are made with the async_ functions in slack_api. This does
+        a database query so from async code call it using run_in_thread().
+
+        """
+        app = cls.objects.order_by('-created_at').first()
+
+        return AsyncAPIClient(
+            'https://slack.com/api/',
+            headers={'Authorization': f'Bearer {app.bot_access_token}'}
+        )
+
+
+class SlackUser(models.Model):
+    """A member of the Slack workspace.
+
+    This is a local copy of the profile fields the bot needs. It saves a
+    users_info call for each message. See zenslackchat.slack_users.
+
+    """
+    # e.g. UGF7MRWMS
+    user_id = models.CharField(max_length=20, unique=True)
+
+    real_name = models.CharField(max_length=200, blank=True, default='')
+
+    # Empty if the bot token can't see it (needs users:read.email):
+    email = models.CharField(max_length=254, blank=True, default='')
+
+    deleted = models.BooleanField(default=False)
+
+    updated_at = models.DateTimeField(default=utcnow)
+
+    @staticmethod
+    def fields_from(user):
+        """Recover the fields to store from a Slack user object.
+        """
+        profile = user.get('profile') or {}
+        return dict(
+            real_name=user.get('real_name') or profile.get('real_name', ''),
+            email=profile.get('email', ''),
+            deleted=user.get('deleted', False),
+        )
+
+    @classmethod
+    def store(cls, user, user_id=None):
+        """Add or update a user from a Slack user object.
+
+        :param user: The user dict from users_info, users_list or the
+        user_change and team_join events.
+
+        :param user_id: The user's ID if not user['id'].
+
+        :returns: The SlackUser instance.
+
+        """
+        found, _ = cls.objects.update_or_create(
+            user_id=user_id or user['id'],
+            defaults=dict(updated_at=utcnow(), **cls.fields_from(user)),
+        )
+        return found
+
+    @classmethod
+    def store_many(cls, users):
+        """Add or update a page of users from users_list.
+
+        :returns: The number of users stored.
+
+        """
+        now = utcnow()
+        users = {user['id']: user for user in users}
+
+        with transaction.atomic():
+            existing = {
+                found.user_id: found
+                for found in cls.objects.filter(user_id__in=list(users))
+            }
+
+            created = []
+            for user_id, user in users.items():
+                found = existing.get(user_id) or cls(user_id=user_id)
+                for name, value in cls.fields_from(user).items():
+                    setattr(found, name, value)
+                found.updated_at = now
+                if user_id not in existing:
+                    created.append(found)
+
+            cls.objects.bulk_create(created)
+            cls.objects.bulk_update(
+                list(existing.values()),
+                ['real_name', 'email', 'deleted', 'updated_at']
+            )
+
+        return len(users)
 
 
-class CustomHeaderAdapter(requests.adapters.HTTPAdapter):
+class CustomHeaderAdapter(PooledAdapter):
     """Allow custom request headers for Zenpy requests.
     """
     def add_headers(self, request, **kwargs):
@@ -317,11 +536,23 @@ class ZendeskApp(models.Model):
     token_type = models.CharField(max_length=50)
     scope = models.CharField(max_length=50)
     created_at = models.DateTimeField(default=utcnow)
+    # The Zendesk user the token belongs to, found when first needed:
+    user_id = models.CharField(max_length=20, blank=True, default='')
 
     @classmethod
     def client(cls):
         """Returns a Zenpy client instance ready for use.
 
+        The client is shared by the process and rebuilt when a ZendeskApp is
+        saved or deleted.
+
+        """
+        return cache.get('zendesk', cls.new_client)
+
+    @classmethod
+    def new_client(cls):
+        """Returns a new Zenpy client instance.
+
         This recovers the latest ZendeskApp instance and uses its access_token
         field for the token.
 
@@ -333,14 +564,68 @@ class ZendeskApp(models.Model):
                 f"Zendesk Access Token:{app.access_token}"
             )
 
-        session = requests.Session()
-        adapter = CustomHeaderAdapter(**Zenpy.http_adapter_kwargs())
-        session.mount('https://', adapter)
+        # Zenpy's adapter retries PUTs after a read timeout, which could add
+        # a comment twice. The zendesk circuit breaker does all the retrying
+        # instead, knowing which calls are safe to send again.
+        session = pooled_session(CustomHeaderAdapter(max_retries=0))
 
-        return Zenpy(
+        client = Zenpy(
             subdomain=settings.ZENDESK_SUBDOMAIN,
             oauth_token=app.access_token,
             session=session,
+            timeout=settings.ZENDESK_TIMEOUT,
+        )
+        # The client lives as long as the process. Zenpy's object cache would
+        # return tickets as they were when first fetched.
+        client.disable_caching()
+
+        return client
+
+    @classmethod
+    def identity(cls):
+        """Return the Zendesk user ID comments are written as.
+
+        This is the user the token belongs to. It is asked for once per
+        token and stored on the ZendeskApp. The process caches it with the
+        client.
+
+        :returns: The user ID or None if the OAuth app is not yet set up.
+
+        """
+        return cache.get('zendesk_identity', cls.resolve_identity)
+
+    @classmethod
+    def resolve_identity(cls):
+        """Return the user ID, asking Zendesk if it is not yet stored.
+        """
+        app = cls.objects.order_by('-created_at').first()
+        if not app:
+            return None
+
+        if not app.user_id:
+            app.user_id = str(cls.client().users.me().id)
+            # update() so the post_save signal doesn't rebuild the client.
+            cls.objects.filter(pk=app.pk).update(user_id=app.user_id)
+
+        return int(app.user_id)
+
+    @classmethod
+    def async_client(cls):
+        """Returns an AsyncAPIClient for the Zendesk API.
+
+        This sends the same OAuth token and X-On-Behalf-Of header as the Zenpy
+        client. It does a database query so from async code call it using
+        run_in_thread().
+
+        """
+        app = cls.objects.order_by('-created_at').first()
+
+        return AsyncAPIClient(
+            f'https://{settings.ZENDESK_SUBDOMAIN}.zendesk.com/api/v2/',
+            headers={
+                'Authorization': f'Bearer {app.access_token}',
+                'X-On-Behalf-Of': settings.ZENDESK_AGENT_EMAIL,
+            }
         )
 
 
@@ -358,10 +643,19 @@ class PagerDutyApp(models.Model):
     def client(cls):
         """Returns a client instance ready for use.
 
+        The client is shared by the process and rebuilt when a PagerDutyApp
+        is saved or deleted.
+
         :returns: The APISession instance for pager duty.
 
         If the OAuth app is not yet set up then None will be returned.
 
+        """
+        return cache.get('pagerduty', cls.new_client)
+
+    @classmethod
+    def new_client(cls):
+        """Returns a new APISession or None if the OAuth app is not set up.
         """
         log = logging.getLogger(__name__)
 
@@ -375,17 +669,144 @@ class PagerDutyApp(models.Model):
         session = None
         if app:
             session = APISession(app.access_token, auth_type='oauth2')
+            session.mount('https://', PooledAdapter())
+
+        return session
+
+    @classmethod
+    def async_client(cls):
+        """Returns an AsyncAPIClient for the PagerDuty API.
+
+        If the OAuth app is not yet set up then None will be returned.
+
+        """
+        app = cls.objects.order_by('-created_at').first()
+
+        session = None
+        if app:
+            session = AsyncAPIClient(
+                'https://api.pagerduty.com/',
+                headers={
+                    'Authorization': f'Bearer {app.access_token}',
+                    'Accept': 'application/vnd.pagerduty+json;version=2',
+                }
+            )
 
         return session
 
     @classmethod
-    def on_call(cls):
+    def on_call(cls, when=None):
         """Return the primary and secondary on call contacts.
 
+        This looks up the windows stored by prefetch_on_call(), which runs
+        periodically, so PagerDuty is not on the path of creating a ticket.
+        If the windows are older than PAGERDUTY_ONCALL_REFRESH seconds they
+        are still used and a refresh is queued. PagerDuty is only asked
+        directly when nothing has been stored yet.
+
+        :param when: The UTC datetime to look up (default is UTC now).
+
         :returns: dict(primary='First Lastname', secondary='First Lastname')
+        or {} if this is not known.
+
+        """
+        log = logging.getLogger(__name__)
+
+        if not cls.client():
+            log.error(
+                "No OAuth PagerDutyApp is configured. I'm unable to get who "
+                "is the primary and secondary on call engineers."
+            )
+            return {}
+
+        policy_id = settings.PAGERDUTY_ESCALATION_POLICY_ID
+        refresh = timedelta(seconds=settings.PAGERDUTY_ONCALL_REFRESH)
+        fetched_at = OnCallWindow.last_fetched(policy_id)
+
+        if fetched_at is None:
+            try:
+                cls.prefetch_on_call()
+
+            except:  # noqa
+                log.exception("Unable to recover who is on call: ")
+                metrics.incr('pagerduty.prefetch.failed')
+                return {}
+
+        elif fetched_at < utcnow() - refresh:
+            metrics.incr('pagerduty.oncall.stale')
+            cls.queue_refresh()
+
+        return OnCallWindow.on_call(policy_id, when or utcnow())
+
+    @classmethod
+    def prefetch_on_call(cls, hours=None):
+        """Store who is on call over the coming hours as OnCallWindows.
+
+        :param hours: How far ahead to look (default is the setting
+        PAGERDUTY_ONCALL_PREFETCH_HOURS).
+
+        :returns: The number of windows stored or None if the OAuth app is
+        not yet set up.
+
+        PagerDuty errors are raised to the caller.
 
         """
         session = cls.client()
+        if not session:
+            return None
+
+        policy_id = settings.PAGERDUTY_ESCALATION_POLICY_ID
+        since = utcnow()
+        until = since + timedelta(
+            hours=hours or settings.PAGERDUTY_ONCALL_PREFETCH_HOURS
+        )
+
+        oncalls = []
+        offset = 0
+        while True:
+            data = session.get('/oncalls', params={
+                'escalation_policy_ids[]': policy_id,
+                'since': since.isoformat(),
+                'until': until.isoformat(),
+                'limit': 100,
+                'offset': offset,
+            }).json()
+            oncalls.extend(data['oncalls'])
+            if not data.get('more') or not data['oncalls']:
+                break
+            offset += len(data['oncalls'])
+
+        return OnCallWindow.store(policy_id, oncalls, fetched_at=since)
+
+    @classmethod
+    def queue_refresh(cls):
+        """Queue the prefetch_on_call task, at most once a minute.
+        """
+        # Avoid a circular import, the tasks use the models.
+        from zenslackchat.tasks import prefetch_on_call
+
+        log = logging.getLogger(__name__)
+
+        try:
+            queued = redis_store.connection().set(
+                redis_store.key('pagerduty', 'oncall', 'queued'), 1,
+                nx=True, ex=60
+            )
+            if queued:
+                prefetch_on_call.delay()
+
+        except:  # noqa
+            log.exception("Unable to queue the on call refresh: ")
+
+    @classmethod
+    async def async_on_call(cls):
+        """Return the primary and secondary on call contacts without blocking
+        the event loop.
+
+        :returns: dict(primary='First Lastname', secondary='First Lastname')
+
+        """
+        session = await run_in_thread(cls.async_client)()
 
         if not session:
             logging.getLogger(__name__).error(
@@ -396,9 +817,20 @@ class PagerDutyApp(models.Model):
 
         policy_id = settings.PAGERDUTY_ESCALATION_POLICY_ID
 
-        path = f'/oncalls?escalation_policy_ids[]={policy_id}'
-        data = session.get(path).json()
+        async with session:
+            data = await session.get(
+                'oncalls', params={'escalation_policy_ids[]': policy_id}
+            )
+
+        return cls.on_call_names(data)
+
+    @staticmethod
+    def on_call_names(data):
+        """Recover the on call contacts from a PagerDuty /oncalls response.
+
+        :returns: dict(primary='First Lastname', secondary='First Lastname')
 
+        """
         # level 1 is the person on call, 2 is the secondary backup
         priority = sorted(data['oncalls'], key=itemgetter('escalation_level'))
         primary, secondary = [i['user']['summary'] for i in priority][:2]
@@ -406,6 +838,113 @@ class PagerDutyApp(models.Model):
         return dict(primary=primary, secondary=secondary)
 
 
+class OnCallWindow(models.Model):
+    """A period of time someone is on call for an escalation policy.
+
+    These are stored by PagerDutyApp.prefetch_on_call() so who is on call can
+    be looked up without asking PagerDuty.
+
+    """
+    policy_id = models.CharField(max_length=20)
+
+    # 1 is the primary on call, 2 is the secondary backup:
+    escalation_level = models.PositiveIntegerField()
+
+    # The PagerDuty user summary e.g. 'Fred Sprocket'
+    name = models.CharField(max_length=200)
+
+    # None if they are always on call:
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(null=True, blank=True)
+
+    # When PagerDuty was asked:
+    fetched_at = models.DateTimeField(default=utcnow)
+
+    class Meta:
+        indexes = [models.Index(fields=['policy_id', 'start'])]
+
+    @classmethod
+    def store(cls, policy_id, oncalls, fetched_at=None):
+        """Replace the windows for the policy.
+
+        :param policy_id: The escalation policy ID.
+
+        :param oncalls: The 'oncalls' list from the PagerDuty API.
+
+        :param fetched_at: The optional datetime (default is UTC now).
+
+        :returns: The number of windows stored.
+
+        """
+        fetched_at = fetched_at or utcnow()
+
+        windows = [
+            cls(
+                policy_id=policy_id,
+                escalation_level=oncall['escalation_level'],
+                name=oncall['user']['summary'],
+                start=parse_datetime(oncall['start'] or ''),
+                end=parse_datetime(oncall['end'] or ''),
+                fetched_at=fetched_at,
+            )
+            for oncall in oncalls
+        ]
+
+        with transaction.atomic():
+            cls.objects.filter(policy_id=policy_id).delete()
+            cls.objects.bulk_create(windows)
+
+        # Recorded apart from the windows, as there may be none to store:
+        redis_store.connection().set(
+            cls.fetched_key(policy_id), fetched_at.isoformat()
+        )
+
+        return len(windows)
+
+    @staticmethod
+    def fetched_key(policy_id):
+        """Return the Redis key holding when the policy was last fetched."""
+        return redis_store.key('pagerduty', 'oncall', policy_id, 'fetched')
+
+    @classmethod
+    def last_fetched(cls, policy_id):
+        """Return when the policy's windows were stored or None."""
+        fetched_at = redis_store.connection().get(cls.fetched_key(policy_id))
+        if fetched_at is None:
+            return None
+
+        if isinstance(fetched_at, bytes):
+            fetched_at = fetched_at.decode()
+
+        return parse_datetime(fetched_at)
+
+    @classmethod
+    def on_call(cls, policy_id, when):
+        """Return the primary and secondary on call contacts at a time.
+
+        :param policy_id: The escalation policy ID.
+
+        :param when: The UTC datetime.
+
+        :returns: dict(primary='First Lastname', secondary='First Lastname')
+        or {} if the stored windows don't cover when.
+
+        """
+        windows = cls.objects.filter(
+            models.Q(start__isnull=True) | models.Q(start__lte=when),
+            models.Q(end__isnull=True) | models.Q(end__gt=when),
+            policy_id=policy_id,
+        ).order_by('escalation_level', 'start')
+
+        names = [window.name for window in windows][:2]
+        if len(names) < 2:
+            return {}
+
+        primary, secondary = names
+
+        return dict(primary=primary, secondary=secondary)
+
+
 class OutOfHoursInformation(models.Model):
     """Store who to contact out of hours
 
@@ -513,6 +1052,17 @@ class OutOfHoursInformation(models.Model):
 
         return oohi
 
+    @classmethod
+    def out_of_hours_message(cls, now):
+        """Return the out of hours contact details if now is out of hours.
+
+        :param now: A UTC datetime instance.
+
+        :returns: The help_text() or None in office hours.
+
+        """
+        return cls.help_text() if cls.is_out_of_hours(now) else None
+
     @classmethod
     def inform_if_out_of_hours(cls, now, chat_id, channel_id, slack_client):
         """Inform the slack channel about outside hour contact details.
@@ -522,17 +1072,17 @@ class OutOfHoursInformation(models.Model):
         True means out of hours message was sent.
 
         """
-        is_ooh = cls.is_out_of_hours(now)
+        message = cls.out_of_hours_message(now)
 
-        if is_ooh:
+        if message is not None:
             post_message(
                 slack_client,
                 chat_id,
                 channel_id,
-                cls.help_text()
+                message
             )
 
-        return is_ooh
+        return message is not None
 
     def __str__(self) -> str:
         return (
@@ -540,3 +1090,108 @@ class OutOfHoursInformation(models.Model):
             f"{self.office_hours_end} "
             f"{self.message}"
         )
+
+
+class FailedEvent(models.Model):
+    """An event which could not be handled, kept so it can be replayed.
+
+    The event is stored exactly as it was given to the handler. Replaying
+    removes it once it succeeds, otherwise the attempts and error are
+    updated.
+
+    """
+    # 'slack', 'comment_flush' or the name of the Zendesk webhook.
+    source = models.CharField(max_length=50, db_index=True)
+    event = models.JSONField()
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(default=utcnow)
+    last_attempt = models.DateTimeField(default=utcnow)
+
+    class Meta:
+        ordering = ('created_at',)
+
+    def __str__(self) -> str:
+        return f"{self.source} ({self.attempts}) {self.created_at}"
+
+
+class TicketCloseJob(models.Model):
+    """A Zendesk job closing a batch of tickets, from the admin bulk resolve.
+
+    Zendesk closes up to UPDATE_MANY_LIMIT tickets in one background job.
+    The close_zendesk_tickets task sends the batch and poll_ticket_close_job
+    records the job's progress here until it is finished.
+
+    """
+    # Not yet sent to Zendesk:
+    PENDING = 'pending'
+    # The Zendesk job statuses:
+    QUEUED = 'queued'
+    WORKING = 'working'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    KILLED = 'killed'
+
+    FINISHED = (COMPLETED, FAILED, KILLED)
+
+    ticket_ids = models.JSONField()
+    # The Zendesk JobStatus id once the batch is sent:
+    job_id = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=20, default=PENDING, db_index=True)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    # The tickets Zendesk couldn't close and why, one per line:
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=utcnow)
+    updated_at = models.DateTimeField(default=utcnow)
+    # When the batch was last sent to Zendesk, a retry sends it again:
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED
+
+    @classmethod
+    def for_tickets(cls, ticket_ids, batch_size):
+        """Create a pending job for each batch of tickets.
+
+        :param ticket_ids: The Zendesk Ticket IDs to close.
+
+        :param batch_size: The most tickets in one job.
+
+        :returns: The list of TicketCloseJob created.
+
+        """
+        return [
+            cls.objects.create(
+                ticket_ids=ticket_ids[start:start + batch_size],
+                total=len(ticket_ids[start:start + batch_size]),
+            )
+            for start in range(0, len(ticket_ids), batch_size)
+        ]
+
+    def record(self, job_status, failures=()):
+        """Store the progress of the Zendesk job.
+
+        :param job_status: The Zenpy JobStatus.
+
+        :param failures: The (ticket_id, reason) tuples for tickets which
+        couldn't be closed.
+
+        """
+        self.job_id = job_status.id or self.job_id
+        self.status = job_status.status
+        self.progress = job_status.progress or 0
+        self.total = job_status.total or self.total
+        if failures:
+            self.error = '\n'.join(
+                f'{ticket_id}: {reason}' for ticket_id, reason in failures
+            )
+        self.updated_at = utcnow()
+        self.save()
+
+    def __str__(self) -> str:
+        return f"{self.job_id or self.pk} {self.status} {self.progress}/{self.total}"
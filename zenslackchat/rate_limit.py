@@ -0,0 +1,246 @@
+"""
+A token bucket rate limiter shared by every web and Celery process.
+
+Every Slack, Zendesk and PagerDuty request made through the PooledAdapter or
+an AsyncAPIClient takes a token from its API's bucket first. When the bucket
+is empty the caller sleeps until a token is free instead of getting a 429. A
+429 with a Retry-After empties the bucket until then, so every process backs
+off.
+
+The buckets are kept in Redis and updated by a Lua script so all the
+processes share them. Limits are requests per minute. Slack limits each API
+method separately so each method has its own bucket:
+
+    slack:chat.postMessage, slack:users.info, ..., zendesk, pagerduty
+
+If Redis is unavailable requests are not limited.
+
+"""
+import time
+import asyncio
+import logging
+from urllib.parse import urlparse
+
+import redis
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat import redis_store
+from zenslackchat.async_views import run_in_thread
+
+
+# Requests per minute. These can be changed with settings.API_RATE_LIMITS.
+DEFAULT_LIMITS = {
+    # https://api.slack.com/docs/rate-limits
+    'slack:chat.postMessage': 60,
+    'slack:users.info': 100,
+    'slack:users.list': 20,
+    'slack:conversations.replies': 50,
+    # Any other Slack method:
+    'slack': 20,
+    # The Zendesk Enterprise plan, lower plans allow less and must set theirs
+    # in settings.API_RATE_LIMITS:
+    'zendesk': 700,
+    'pagerduty': 900,
+}
+
+# A full bucket allows this many seconds worth of requests at once:
+BURST_SECONDS = 10
+
+_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+
+-- updated is in the future while backing off after a 429.
+if now > updated then
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    updated = now
+end
+
+local wait = updated - now
+if tokens < 1 then
+    wait = wait + (1 - tokens) / rate
+end
+
+if wait > max_wait then
+    return {0, tostring(wait)}
+end
+
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(updated))
+redis.call('EXPIRE', KEYS[1], math.ceil(updated - now + burst / rate) + 60)
+
+return {1, tostring(wait)}
+"""
+
+# Loaded into Redis on first use and run by its SHA after that. It is given
+# the client to run on, so it works with whichever connection is current.
+_take_script = None
+
+
+class RateLimited(Exception):
+    """Raised when a token would take longer than allowed to become free."""
+
+    def __init__(self, bucket, retry_after):
+        """
+        :param bucket: The bucket name e.g. 'zendesk'.
+
+        :param retry_after: Seconds until a token is free.
+
+        """
+        super().__init__(
+            f"Rate limit for <{bucket}> is used up for {retry_after:.1f}s"
+        )
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def bucket_for(url):
+    """Return the bucket name for a request URL or None if not limited.
+    """
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+
+    if host == 'slack.com' or host.endswith('.slack.com'):
+        method = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+        return f'slack:{method}'
+
+    elif host.endswith('.zendesk.com'):
+        return 'zendesk'
+
+    elif host == 'api.pagerduty.com':
+        return 'pagerduty'
+
+    return None
+
+
+def limit_for(bucket):
+    """Return the bucket's requests per minute.
+    """
+    limits = dict(DEFAULT_LIMITS, **settings.API_RATE_LIMITS)
+    api = bucket.split(':', 1)[0]
+    return limits.get(bucket, limits.get(api))
+
+
+def _key(bucket):
+    return redis_store.key('ratelimit', bucket)
+
+
+def _script():
+    global _take_script
+
+    if _take_script is None:
+        _take_script = redis_store.connection().register_script(_TAKE)
+
+    return _take_script
+
+
+def _take(bucket, max_wait):
+    """Take a token and return the seconds to wait before using it.
+    """
+    log = logging.getLogger(__name__)
+
+    per_minute = limit_for(bucket)
+    if not per_minute:
+        return 0
+
+    if max_wait is None:
+        max_wait = settings.RATE_LIMIT_MAX_WAIT
+
+    rate = per_minute / 60.0
+    burst = max(1, rate * BURST_SECONDS)
+
+    try:
+        taken, wait = _script()(
+            keys=[_key(bucket)], args=[rate, burst, time.time(), max_wait],
+            client=redis_store.connection(),
+        )
+
+    except redis.RedisError:
+        log.exception(f"Unable to rate limit <{bucket}>, carrying on: ")
+        return 0
+
+    wait = float(wait)
+    if not taken:
+        metrics.incr(f'rate_limit.{bucket}.refused')
+        raise RateLimited(bucket, wait)
+
+    if wait > 0:
+        log.debug(f"Waiting {wait:.2f}s for the <{bucket}> rate limit.")
+        metrics.timing(f'rate_limit.{bucket}.wait', wait)
+
+    return wait
+
+
+def acquire(bucket, max_wait=None):
+    """Take a token from the bucket, sleeping until one is free.
+
+    :param bucket: The bucket name e.g. 'slack:chat.postMessage'.
+
+    :param max_wait: The most seconds to sleep (default is the setting
+    RATE_LIMIT_MAX_WAIT).
+
+    :returns: The seconds slept.
+
+    RateLimited is raised rather than sleep for longer than max_wait.
+
+    """
+    wait = _take(bucket, max_wait)
+    if wait > 0:
+        time.sleep(wait)
+
+    return wait
+
+
+async def async_acquire(bucket, max_wait=None):
+    """The same as acquire() but only the coroutine waits for the token.
+
+    The token is taken from Redis on the thread pool, not the event loop.
+
+    """
+    wait = await run_in_thread(_take)(bucket, max_wait)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+    return wait
+
+
+def block(bucket, seconds):
+    """Give out no more tokens for a while, after a 429 from the API.
+
+    :param bucket: The bucket name.
+
+    :param seconds: The Retry-After the API returned.
+
+    """
+    try:
+        redis_store.connection().hset(_key(bucket), mapping=dict(
+            tokens=0, updated=time.time() + seconds
+        ))
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception(
+            f"Unable to back off <{bucket}> for {seconds}s: "
+        )
+
+
+async def async_block(bucket, seconds):
+    """The same as block() but Redis is updated on the thread pool.
+    """
+    await run_in_thread(block)(bucket, seconds)
+
+
+def retry_after(response, default=1.0):
+    """Return the seconds from a response's Retry-After header.
+    """
+    try:
+        return float(response.headers.get('Retry-After', default))
+
+    except (TypeError, ValueError):
+        return default
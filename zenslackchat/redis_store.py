@@ -0,0 +1,45 @@
+"""
+Shared access to the Redis instance Celery already uses.
+
+"""
+import threading
+
+import redis
+
+from webapp import settings
+
+
+# All keys we manage are prefixed so they don't collide with Celery's keys.
+KEY_PREFIX = 'zenslackchat'
+
+_lock = threading.Lock()
+_connection = None
+
+
+def key(*parts):
+    """Return a namespaced Redis key e.g. key('event', 'Ev01') ->
+    'zenslackchat:event:Ev01'.
+    """
+    return ':'.join([KEY_PREFIX] + [str(part) for part in parts])
+
+
+def connection():
+    """Return the process wide Redis client.
+
+    The client manages its own connection pool and is safe to share between
+    threads. Short timeouts are used as callers treat Redis as optional and
+    carry on without it.
+
+    """
+    global _connection
+
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                _connection = redis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                )
+
+    return _connection
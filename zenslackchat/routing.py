@@ -0,0 +1,83 @@
+"""
+Route event handling onto ordered Celery queues.
+
+Messages in the same Slack thread must reach Zendesk in the order they were
+sent. Messages in different threads can be handled in parallel. Each thread
+is mapped to one of settings.SLACK_EVENT_SHARDS queues. Each queue is consumed
+by a single worker process with a concurrency of 1, so its events are handled
+one at a time in the order received. Add shards and workers for throughput.
+
+"""
+import zlib
+
+from webapp import settings
+
+
+QUEUE_PREFIX = 'zenslackchat.events'
+
+
+def thread_key(event):
+    """Return the id of the Slack thread the event belongs to.
+
+    Replies carry the parent's 'thread_ts', top level messages only 'ts'.
+
+    """
+    return event.get('thread_ts') or event.get('ts') or ''
+
+
+def jump_hash(key, buckets):
+    """Map key consistently to one of the buckets.
+
+    This is the "jump consistent hash" by Lamping & Veach. Changing the
+    amount of buckets only moves 1/buckets of keys, so most threads keep
+    their queue when shards are added.
+
+    :param key: A string to map.
+
+    :param buckets: The number of buckets available (>= 1).
+
+    :returns: An int from 0 to buckets - 1.
+
+    """
+    # crc32 alone is only 32 bits, stretch it to the 64 bit key jump expects.
+    value = zlib.crc32(key.encode()) * 0x9E3779B97F4A7C15
+    value &= 0xFFFFFFFFFFFFFFFF
+
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        value = (value * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((value >> 33) + 1)))
+
+    return bucket
+
+
+def queue_name(shard):
+    """Return the Celery queue name for the shard number."""
+    return f'{QUEUE_PREFIX}.{shard}'
+
+
+def all_queues(shards=None):
+    """Return every Celery queue name events could be routed to.
+
+    :param shards: The number of shards (default SLACK_EVENT_SHARDS).
+
+    """
+    if shards is None:
+        shards = settings.SLACK_EVENT_SHARDS
+
+    return [queue_name(shard) for shard in range(max(shards, 1))]
+
+
+def queue_for(key, shards=None):
+    """Return the Celery queue which handles the given thread key.
+
+    :param key: The thread identifier, see thread_key().
+
+    :param shards: The number of shards (default SLACK_EVENT_SHARDS).
+
+    """
+    if shards is None:
+        shards = settings.SLACK_EVENT_SHARDS
+
+    return queue_name(jump_hash(key, max(shards, 1)))
@@ -0,0 +1,49 @@
+"""
+Rebuild the cached API clients when their stored tokens change.
+
+"""
+from django.dispatch import receiver
+from django.db.models.signals import pre_save
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+
+from zenslackchat.clients import cache
+from zenslackchat.models import SlackApp
+from zenslackchat.models import ZendeskApp
+from zenslackchat.models import PagerDutyApp
+
+
+CLIENT_NAMES = {
+    SlackApp: ('slack',),
+    ZendeskApp: ('zendesk', 'zendesk_identity'),
+    PagerDutyApp: ('pagerduty',),
+}
+
+# The token and the identity found using it:
+IDENTITY_FIELDS = {
+    ZendeskApp: ('access_token', 'user_id'),
+}
+
+
+@receiver(pre_save, sender=ZendeskApp)
+def forget_identity(sender, instance, **kwargs):
+    """Clear the stored identity if an existing app's token is changed."""
+    token_field, identity_field = IDENTITY_FIELDS[sender]
+    if instance.pk:
+        token = sender.objects.filter(
+            pk=instance.pk
+        ).values_list(token_field, flat=True).first()
+        if token is not None and token != getattr(instance, token_field):
+            setattr(instance, identity_field, '')
+
+
+@receiver(post_save, sender=SlackApp)
+@receiver(post_save, sender=ZendeskApp)
+@receiver(post_save, sender=PagerDutyApp)
+@receiver(post_delete, sender=SlackApp)
+@receiver(post_delete, sender=ZendeskApp)
+@receiver(post_delete, sender=PagerDutyApp)
+def token_changed(sender, **kwargs):
+    """Drop the client and identity for the app in every process."""
+    for name in CLIENT_NAMES[sender]:
+        cache.invalidate(name)
@@ -4,12 +4,18 @@ Useful code to aid the main message handler.
 To simplify testing I keep these functions django free and pass in whats needed
 in arguments. This can then be easily faked/mocked.
 
+The async_ functions do the same as their blocking namesakes using an
+AsyncAPIClient from SlackApp.async_client(), called with run_in_thread() as
+it queries the database.
+
 Oisin Mulvihill
 2020-08-18
 
 """
 import logging
 
+from zenslackchat.clients import AsyncAPIError
+
 
 def message_url(workspace_uri, channel, message_id):
     """Return a direct link to the message that can be stored in zendesk.
@@ -76,11 +82,14 @@ def create_thread(client, channel_id, message):
     return chat_id
 
 
-def post_message(client, chat_id, channel_id, message):
+def post_message(client, chat_id, channel_id, message, blocks=None):
     """Send a message to the parent thread with an update.
 
     :param client: The Slack web client to use.
 
+    :param blocks: Optional Block Kit blocks to show. The message is then
+    the text used in notifications.
+
     This is also a handy function to aid mocking in tests.
 
     """
@@ -90,8 +99,87 @@ def post_message(client, chat_id, channel_id, message):
         f"chat_id:<{chat_id}> channel:<{channel_id}> message:<{message}>"
     )
 
+    kwargs = {}
+    if blocks:
+        kwargs['blocks'] = blocks
+
     return client.chat_postMessage(
         channel=channel_id,
         text=message,
-        thread_ts=chat_id
+        thread_ts=chat_id,
+        **kwargs
+    )
+
+
+async def async_api_call(client, method, **kwargs):
+    """Call a Slack Web API method and return the response data.
+
+    :param client: The AsyncAPIClient for Slack.
+
+    :param method: The API method e.g. 'chat.postMessage'.
+
+    :param kwargs: The method's arguments.
+
+    Slack answers errors with "ok": false which raise AsyncAPIError, as the
+    blocking client raises SlackApiError.
+
+    """
+    response = await client.post(method, json=kwargs)
+    if not response.get('ok'):
+        raise AsyncAPIError(200, response.get('error', response))
+
+    return response
+
+
+async def async_create_thread(client, channel_id, message):
+    """Create a parent message which will be the thread for further comms.
+
+    :param client: The AsyncAPIClient for Slack.
+
+    The other arguments are the same as create_thread().
+
+    :returns: The chat_id of the new parent message.
+
+    """
+    log = logging.getLogger(__name__)
+
+    log.debug(f"channel:<{channel_id}> message:<{message}>")
+    response = await async_api_call(
+        client, 'chat.postMessage',
+        channel=channel_id,
+        text=message,
+    )
+
+    chat_id = response['message']['ts']
+    log.debug(f"New message chat_id:<{chat_id}>")
+
+    return chat_id
+
+
+async def async_post_message(
+    client, chat_id, channel_id, message, blocks=None
+):
+    """Send a message to the parent thread with an update.
+
+    :param client: The AsyncAPIClient for Slack.
+
+    The other arguments are the same as post_message().
+
+    """
+    log = logging.getLogger(__name__)
+
+    log.debug(
+        f"chat_id:<{chat_id}> channel:<{channel_id}> message:<{message}>"
+    )
+
+    kwargs = {}
+    if blocks:
+        kwargs['blocks'] = blocks
+
+    return await async_api_call(
+        client, 'chat.postMessage',
+        channel=channel_id,
+        text=message,
+        thread_ts=chat_id,
+        **kwargs
     )
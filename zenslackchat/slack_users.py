@@ -0,0 +1,145 @@
+"""
+A local directory of Slack users so messages don't need a users_info call.
+
+The handler needs the real name and email of whoever wrote each message.
+These are read from the SlackUser table, with a short lived in-memory cache
+in front of it. The table is bulk loaded with the sync_slack_users command
+and kept up to date by the user_change and team_join events. Slack is only
+asked about users not seen before, or whose stored copy has no email or is
+out of date.
+
+"""
+import time
+import logging
+import threading
+
+from webapp import settings
+from zenslackchat import metrics
+from zenslackchat.models import utcnow
+from zenslackchat.models import SlackUser
+
+
+# The most users kept in memory per process:
+MAX_CACHED = 10000
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def clear():
+    """Empty this process's in-memory cache."""
+    with _lock:
+        _cache.clear()
+
+
+def _cached(user_id):
+    with _lock:
+        entry = _cache.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def _remember(user_id, profile):
+    with _lock:
+        if len(_cache) >= MAX_CACHED:
+            _cache.clear()
+        _cache[user_id] = (
+            time.monotonic() + settings.SLACK_USER_CACHE_TTL, profile
+        )
+
+
+def _forget(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def _stale(user):
+    age = utcnow() - user.updated_at
+    return age.total_seconds() > settings.SLACK_USER_MAX_AGE
+
+
+def profile(slack_client, user_id):
+    """Return the name and email of a Slack user.
+
+    :param slack_client: The Slack web client, only used for users not yet
+    in the directory, stored without an email or not updated for
+    settings.SLACK_USER_MAX_AGE seconds.
+
+    :param user_id: The Slack user ID e.g. UGF7MRWMS
+
+    :returns: dict(real_name=..., email=...). The email is empty if the bot
+    token can't see it.
+
+    """
+    log = logging.getLogger(__name__)
+
+    found = _cached(user_id)
+    if found:
+        return found
+
+    user = SlackUser.objects.filter(user_id=user_id).first()
+    if user and user.email and not _stale(user):
+        metrics.incr('slack.users.local')
+
+    else:
+        # Missed events or a bulk load before the bot could see emails leave
+        # a stored user out of date, so ask Slack again.
+        log.debug(f"Recovering profile for user <{user_id}>")
+        metrics.incr('slack.users.remote')
+        try:
+            resp = slack_client.users_info(user=user_id)
+
+        except:  # noqa
+            if not user:
+                raise
+            log.exception(f"Unable to refresh user <{user_id}>, using stored: ")
+
+        else:
+            user = SlackUser.store(resp.data['user'], user_id)
+
+    found = dict(real_name=user.real_name, email=user.email)
+    _remember(user_id, found)
+
+    return found
+
+
+def update(user):
+    """Store a user from a user_change or team_join event.
+
+    Other processes pick up the change once their cached copy expires, after
+    settings.SLACK_USER_CACHE_TTL seconds.
+
+    :param user: The event's 'user' dict.
+
+    """
+    SlackUser.store(user)
+    _forget(user['id'])
+
+
+def load_all(slack_client, page_size=200):
+    """Store every user in the workspace.
+
+    :param slack_client: The Slack web client.
+
+    :param page_size: The users asked for in each users_list call.
+
+    :returns: The number of users stored.
+
+    """
+    log = logging.getLogger(__name__)
+
+    stored = 0
+    cursor = None
+    while True:
+        resp = slack_client.users_list(cursor=cursor, limit=page_size)
+        stored += SlackUser.store_many(resp.data['members'])
+        log.debug(f"Stored {stored} Slack users so far.")
+
+        cursor = resp.data.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            break
+
+    clear()
+
+    return stored
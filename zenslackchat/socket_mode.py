@@ -0,0 +1,209 @@
+"""
+Receive Slack events over a Socket Mode websocket instead of HTTP.
+
+The worker asks Slack for a websocket URL using the app level token, connects
+and then receives event envelopes in-band. Each envelope is acknowledged
+straight away and the payload is passed on to the same intake used by the
+Events view. There is no request overhead per event and Slack can't retry us
+into a storm as there is nothing for it to time out on.
+
+The worker is asyncio based. Handling an envelope is blocking Django code so
+it runs on a thread. At most max_in_flight envelopes are handled at once. When
+that many are busy the worker stops reading the websocket until one finishes.
+Envelopes for the same Slack thread are handled one at a time in the order
+received, as the ordered Celery queues do, so replies reach Zendesk in order.
+
+https://api.slack.com/apis/connections/socket-implement
+
+"""
+import asyncio
+import logging
+
+import aiohttp
+
+from zenslackchat import routing
+
+SLACK_API_URI = 'https://slack.com/api/'
+
+
+class SocketModeError(Exception):
+    """Raised when Slack will not give us a websocket URL."""
+
+
+class SocketModeWorker(object):
+    """Long running Socket Mode connection to Slack.
+    """
+    def __init__(
+        self, app_token, on_envelope, max_in_flight=10,
+        api_uri=SLACK_API_URI, reconnect_delay=5
+    ):
+        """
+        :param app_token: The Slack app level token (xapp-...) with the
+        connections:write scope.
+
+        :param on_envelope: Blocking callable taking (payload, retry_num,
+        retry_reason). The payload is the same envelope the Events view
+        receives.
+
+        :param max_in_flight: How many envelopes can be handled at once.
+
+        :param api_uri: The base Slack API URI, changed for testing.
+
+        :param reconnect_delay: Seconds to wait before reconnecting after an
+        error.
+
+        """
+        self.app_token = app_token
+        self.on_envelope = on_envelope
+        self.max_in_flight = max_in_flight
+        self.api_uri = api_uri.rstrip('/') + '/'
+        self.reconnect_delay = reconnect_delay
+        self._running = False
+        self._slots = None
+        self._tasks = set()
+        # The last envelope dispatched for each Slack thread:
+        self._threads = {}
+
+    async def connection_url(self, session):
+        """Ask Slack for a websocket URL to connect to.
+
+        :returns: The wss:// URL string.
+
+        """
+        response = await session.post(
+            f'{self.api_uri}apps.connections.open',
+            headers={'Authorization': f'Bearer {self.app_token}'}
+        )
+        data = await response.json()
+        if not data.get('ok'):
+            raise SocketModeError(
+                f"apps.connections.open failed: {data.get('error')}"
+            )
+
+        return data['url']
+
+    async def run_once(self, session):
+        """Connect and handle messages until Slack asks us to disconnect or
+        the connection drops.
+
+        """
+        log = logging.getLogger(__name__)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        url = await self.connection_url(session)
+        log.debug("Connecting to Slack socket mode")
+
+        async with session.ws_connect(url, heartbeat=30) as websocket:
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    log.debug(f"Connection closing: {message.type}")
+                    break
+
+                if not await self.receive(websocket, message.json()):
+                    break
+
+    async def receive(self, websocket, message):
+        """Act on one message from the websocket.
+
+        :returns: False if the connection should be closed and reopened.
+
+        """
+        log = logging.getLogger(__name__)
+        kind = message.get('type')
+
+        if kind == 'hello':
+            log.info("Connected to Slack socket mode")
+
+        elif kind == 'disconnect':
+            log.info(f"Slack asked us to reconnect: {message.get('reason')}")
+            return False
+
+        elif 'envelope_id' in message:
+            # Slack needs the ack within 3 seconds, before any handling.
+            await websocket.send_json({'envelope_id': message['envelope_id']})
+
+            if kind == 'events_api':
+                # Wait for a free slot. This stops reading the websocket when
+                # we are busy.
+                await self._slots.acquire()
+                event = message.get('payload', {}).get('event') or {}
+                key = routing.thread_key(event)
+                task = asyncio.ensure_future(
+                    self.dispatch(message, after=self._threads.get(key))
+                )
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                if key:
+                    self._threads[key] = task
+                    task.add_done_callback(
+                        lambda task: self._forget(key, task)
+                    )
+
+            else:
+                log.debug(f"Ignoring socket mode message type <{kind}>")
+
+        return True
+
+    def _forget(self, key, task):
+        if self._threads.get(key) is task:
+            del self._threads[key]
+
+    async def dispatch(self, message, after=None):
+        """Hand the envelope payload to on_envelope on a thread.
+
+        :param message: The socket mode envelope.
+
+        :param after: The task handling the previous envelope for the same
+        Slack thread, which must finish first. None if there isn't one.
+
+        """
+        log = logging.getLogger(__name__)
+        loop = asyncio.get_running_loop()
+
+        try:
+            if after is not None:
+                await asyncio.wait([after])
+
+            await loop.run_in_executor(
+                None,
+                self.on_envelope,
+                message.get('payload', {}),
+                message.get('retry_attempt'),
+                message.get('retry_reason'),
+            )
+
+        except Exception:
+            log.exception("Socket mode envelope handling error: ")
+
+        finally:
+            self._slots.release()
+
+    async def drain(self):
+        """Wait for envelopes still being handled."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def run(self):
+        """Stay connected, reconnecting as needed, until stop() is called.
+        """
+        log = logging.getLogger(__name__)
+        self._running = True
+
+        async with aiohttp.ClientSession() as session:
+            while self._running:
+                try:
+                    await self.run_once(session)
+
+                except Exception:
+                    # Anything else e.g. a bad frame or a timeout would end
+                    # the worker, stay connected instead.
+                    log.exception("Socket mode connection error: ")
+                    await asyncio.sleep(self.reconnect_delay)
+
+            await self.drain()
+
+    def stop(self):
+        """Stop reconnecting once the current connection ends."""
+        self._running = False
@@ -0,0 +1,460 @@
+"""
+Celery tasks which handle events outside of the web request.
+
+The views acknowledge Slack and Zendesk as quickly as possible and hand the
+raw event over to these tasks when ASYNC_EVENT_PROCESSING is enabled.
+
+"""
+import logging
+from datetime import timedelta
+
+import redis
+from zenpy.lib.exception import APIException
+
+from webapp import settings
+from webapp.celery import app
+from zenslackchat import intake
+from zenslackchat import circuit
+from zenslackchat import metrics
+from zenslackchat import dead_letter
+from zenslackchat import routing
+from zenslackchat import comment_buffer
+from zenslackchat.comment_sync import mark_clean
+from zenslackchat.models import SlackApp
+from zenslackchat.models import ZendeskApp
+from zenslackchat.models import PagerDutyApp
+from zenslackchat.models import FailedEvent
+from zenslackchat.models import ZenSlackChat
+from zenslackchat.models import TicketCloseJob
+from zenslackchat.models import utcnow
+from zenslackchat.zendesk_api import add_comment
+from zenslackchat.zendesk_api import job_failures
+from zenslackchat.zendesk_api import close_tickets
+from zenslackchat.zendesk_api import get_job_status
+from zenslackchat.zendesk_api import is_closed_error
+from zenslackchat.zendesk_api import zendesk_ticket_url
+from zenslackchat.slack_api import post_message
+from zenslackchat.message_tools import closed_message
+
+
+# Zendesk only keeps a job's status for an hour:
+JOB_POLL_TIMEOUT = timedelta(hours=1)
+
+
+@app.task(ignore_result=True)
+def process_slack_event(event):
+    """Run the message handler for a Slack event received by the Events view.
+
+    :param event: The raw slack event dict.
+
+    """
+    # Avoid a circular import, the events view enqueues this task.
+    from zenslackchat.eventsview import process_event
+
+    process_event(event)
+
+
+def enqueue_slack_event(event):
+    """Queue the event for process_slack_event on its Slack thread's queue.
+
+    Events in the same thread always go to the same queue and so are handled
+    in the order received.
+
+    :param event: The raw slack event dict.
+
+    """
+    queue = routing.queue_for(routing.thread_key(event))
+    process_slack_event.apply_async((event,), queue=queue)
+
+
+@app.task(ignore_result=True)
+def process_zendesk_webhook(name, event):
+    """Handle a Zendesk webhook event received by one of the webhook views.
+
+    :param name: The name of the webhook which received the event.
+
+    :param event: The POSTed dict of fields.
+
+    """
+    # Avoid a circular import, the webhook views enqueue this task.
+    from zenslackchat.zendesk_webhooks import WEBHOOKS
+
+    log = logging.getLogger(__name__)
+
+    try:
+        WEBHOOKS[name]().process(event)
+
+    except:  # noqa
+        log.exception(f'Failed handling {name} webhook because:')
+
+
+@app.task(ignore_result=True)
+def drain_deferred_events(limit=100):
+    """Hand events deferred by a full intake back for handling.
+
+    This runs periodically. Events are taken oldest first while the intake
+    has room for them.
+
+    :param limit: The most events to hand back in one run.
+
+    """
+    # Avoid a circular import, the views use these tasks.
+    from zenslackchat.eventsview import submit_event
+    from zenslackchat.zendesk_webhooks import WEBHOOKS
+
+    log = logging.getLogger(__name__)
+
+    for _ in range(limit):
+        try:
+            entry = intake.next_deferred()
+
+        except redis.RedisError:
+            log.exception("Unable to recover deferred events: ")
+            break
+
+        if entry is None:
+            break
+
+        log.debug(f"Handling deferred event <{entry['item_id']}>")
+        try:
+            if entry['source'] == 'slack':
+                submit_event(entry['item'])
+
+            else:
+                WEBHOOKS[entry['source']]().submit(entry['item'])
+
+        except:  # noqa
+            log.exception(f"Failed handling <{entry['item_id']}> because:")
+            intake.release(entry['item_id'])
+
+
+@app.task(ignore_result=True)
+def sync_zendesk_comments(event):
+    """Bring the Slack thread up to date with the ticket's Zendesk comments.
+
+    Scheduled once per burst of comment triggers by CommentsWebHook.
+
+    :param event: The POSTed dict of fields from the first trigger.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        mark_clean(event.get('ticket_id'))
+
+    except redis.RedisError:
+        log.exception("Unable to clear the ticket's dirty mark: ")
+
+    process_zendesk_webhook('comments', event)
+
+
+@app.task(bind=True, ignore_result=True, max_retries=3, default_retry_delay=30)
+def flush_zendesk_comments(self, ticket_id):
+    """Write the buffered Slack replies for a ticket as one Zendesk comment.
+
+    :param ticket_id: The Zendesk ticket to update.
+
+    On failure the lines are put back in the buffer and the task retried. Once
+    the retries are used up the comment is kept for replay.
+
+    """
+    log = logging.getLogger(__name__)
+
+    lines = comment_buffer.drain_comments(ticket_id)
+    if not lines:
+        log.debug(f'No buffered comments for ticket:<{ticket_id}>')
+        return
+
+    log.debug(f'Flushing {len(lines)} comment(s) to ticket:<{ticket_id}>')
+    comment = comment_buffer.merge_comments(lines)
+    try:
+        written = write_comment(ticket_id, comment)
+
+    except Exception as error:
+        if self.request.retries >= self.max_retries:
+            log.exception(f'Giving up on comments for ticket:<{ticket_id}>')
+            dead_letter.record(
+                dead_letter.COMMENT_FLUSH,
+                dict(ticket_id=ticket_id, comment=comment),
+                error
+            )
+            return
+
+        comment_buffer.restore_comments(ticket_id, lines)
+        raise self.retry(exc=error)
+
+    if not written:
+        tell_thread_ticket_closed(ticket_id)
+
+
+def write_comment(ticket_id, comment):
+    """Add a comment to the Zendesk ticket, raising any error.
+
+    If the ticket has been closed the comment is dropped, as Zendesk will
+    never accept it, and the closed status is mirrored locally.
+
+    :returns: True if the comment was added, False if it was dropped.
+
+    """
+    log = logging.getLogger(__name__)
+
+    client = ZendeskApp.client()
+    try:
+        add_comment(
+            client, ticket_id, comment, author_id=ZendeskApp.identity()
+        )
+
+    except APIException as error:
+        if not is_closed_error(error):
+            raise
+        log.warning(f'Dropped comment for closed ticket:<{ticket_id}>')
+        ZenSlackChat.mirror_ticket(ticket_id, 'closed')
+        return False
+
+    return True
+
+
+def tell_thread_ticket_closed(ticket_id):
+    """Tell the Slack thread its buffered replies were refused.
+
+    The same notice is posted as for a reply added straight away. Nothing is
+    posted if the thread isn't known.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        thread = comment_buffer.comment_thread(ticket_id)
+
+    except redis.RedisError:
+        log.exception(f"Unable to recover ticket:<{ticket_id}>'s thread: ")
+        return
+
+    if not thread:
+        log.warning(f"No Slack thread to tell ticket:<{ticket_id}> is closed")
+        return
+
+    url = zendesk_ticket_url(settings.ZENDESK_TICKET_URI, ticket_id)
+    post_message(
+        SlackApp.client(), thread['thread_id'], thread['channel_id'],
+        closed_message(url)
+    )
+
+
+def flush_pending_comments(ticket_id):
+    """Write the ticket's buffered Slack replies now, raising any error.
+
+    Call this before closing the ticket, as Zendesk refuses comments on a
+    closed ticket. The scheduled flush then finds nothing to do. If the
+    write fails the lines are put back in the buffer.
+
+    :param ticket_id: The Zendesk ticket the replies are for.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        lines = comment_buffer.drain_comments(ticket_id)
+
+    except redis.RedisError:
+        log.exception(f"Unable to drain comments for ticket:<{ticket_id}>: ")
+        return
+
+    if not lines:
+        return
+
+    log.debug(f'Flushing {len(lines)} comment(s) to ticket:<{ticket_id}>')
+    try:
+        write_comment(ticket_id, comment_buffer.merge_comments(lines))
+
+    except:  # noqa
+        comment_buffer.restore_comments(ticket_id, lines)
+        raise
+
+
+def debounce_comment(ticket_id, thread_id, comment, channel_id=None):
+    """Buffer a Slack reply and schedule a single write for the burst.
+
+    The first reply in a window schedules flush_zendesk_comments to run after
+    settings.ZENDESK_COMMENT_DEBOUNCE seconds. The flush goes on the thread's
+    ordered queue.
+
+    :param ticket_id: The Zendesk ticket the reply is for.
+
+    :param thread_id: The Slack thread the reply was made in.
+
+    :param comment: The comment text including the author.
+
+    :param channel_id: The Slack channel of the thread. The flush posts
+    there if Zendesk refuses the comment because the ticket is closed.
+
+    :returns: True if buffered, False if the caller must add the comment now.
+
+    """
+    window = settings.ZENDESK_COMMENT_DEBOUNCE
+
+    try:
+        thread = None
+        if channel_id:
+            thread = dict(channel_id=channel_id, thread_id=thread_id)
+        opened = comment_buffer.buffer_comment(
+            ticket_id, comment, window, thread=thread
+        )
+        if opened:
+            flush_zendesk_comments.apply_async(
+                (ticket_id,),
+                countdown=window,
+                queue=routing.queue_for(thread_id)
+            )
+
+    except redis.RedisError:
+        logging.getLogger(__name__).exception(
+            f"Unable to buffer comment for ticket:<{ticket_id}>: "
+        )
+        return False
+
+    return True
+
+
+@app.task(ignore_result=True)
+def replay_failed_events(ids):
+    """Replay the FailedEvents chosen in the admin.
+
+    :param ids: The FailedEvent primary keys.
+
+    """
+    dead_letter.replay_many(
+        FailedEvent.objects.filter(id__in=ids),
+        concurrency=settings.DEAD_LETTER_REPLAY_CONCURRENCY,
+        rate=settings.DEAD_LETTER_REPLAY_RATE,
+    )
+
+
+@app.task(ignore_result=True)
+def prefetch_on_call():
+    """Store who is on call so PagerDutyApp.on_call() needn't ask PagerDuty.
+
+    This runs every PAGERDUTY_ONCALL_REFRESH seconds and when on_call()
+    finds the stored windows out of date.
+
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        stored = PagerDutyApp.prefetch_on_call()
+
+    except:  # noqa
+        log.exception("Unable to prefetch who is on call: ")
+        metrics.incr('pagerduty.prefetch.failed')
+
+    else:
+        if stored is not None:
+            log.debug(f"Stored {stored} on call windows.")
+
+
+@app.task(ignore_result=True)
+def replay_circuit_failures(limit=100):
+    """Replay the events kept because the Zendesk circuit breaker was open.
+
+    This runs every CIRCUIT_BREAKER_RESET seconds and does nothing while the
+    breaker is open. Once it is half open the oldest event is replayed on its
+    own as the trial call, as nothing else may call Zendesk while it is
+    quiet. If that closes the breaker the rest are replayed.
+
+    :param limit: The most events to replay in one run.
+
+    """
+    state = circuit.zendesk.state()
+    if state == circuit.OPEN:
+        return
+
+    failed_events = list(FailedEvent.objects.filter(
+        error__contains=circuit.CircuitOpen.__name__
+    ).order_by('created_at')[:limit])
+
+    if state == circuit.HALF_OPEN and failed_events:
+        dead_letter.replay_many(failed_events[:1], concurrency=1)
+        if circuit.zendesk.state() != circuit.CLOSED:
+            return
+        failed_events = failed_events[1:]
+
+    dead_letter.replay_many(
+        failed_events,
+        concurrency=settings.DEAD_LETTER_REPLAY_CONCURRENCY,
+        rate=settings.DEAD_LETTER_REPLAY_RATE,
+    )
+
+
+@app.task(ignore_result=True)
+def close_zendesk_tickets(job_id):
+    """Send a TicketCloseJob's batch of tickets to Zendesk to be closed.
+
+    :param job_id: The TicketCloseJob primary key.
+
+    The Zendesk job is then followed by poll_ticket_close_job.
+
+    """
+    log = logging.getLogger(__name__)
+
+    job = TicketCloseJob.objects.get(pk=job_id)
+    try:
+        job_status = close_tickets(ZendeskApp.client(), job.ticket_ids)
+
+    except Exception as error:
+        log.exception(f'Unable to close the tickets of job:<{job.pk}>')
+        job.status = TicketCloseJob.FAILED
+        job.error = str(error)
+        job.updated_at = utcnow()
+        job.save()
+        return
+
+    job.sent_at = utcnow()
+    job.record(job_status)
+    log.debug(f'Zendesk job:<{job.job_id}> is closing {job.total} tickets')
+    poll_ticket_close_job.apply_async(
+        (job.pk,), countdown=settings.ZENDESK_JOB_POLL_INTERVAL
+    )
+
+
+@app.task(ignore_result=True)
+def poll_ticket_close_job(job_id):
+    """Record the progress of a Zendesk job closing tickets.
+
+    :param job_id: The TicketCloseJob primary key.
+
+    This schedules itself again every ZENDESK_JOB_POLL_INTERVAL seconds
+    until the job is finished. Failing to check is not an error, the job is
+    checked again next time.
+
+    """
+    log = logging.getLogger(__name__)
+
+    job = TicketCloseJob.objects.get(pk=job_id)
+    try:
+        job_status = get_job_status(ZendeskApp.client(), job.job_id)
+
+    except:  # noqa
+        log.exception(f'Unable to check Zendesk job:<{job.job_id}>')
+
+    else:
+        failures = ()
+        if job_status.status in TicketCloseJob.FINISHED:
+            failures = job_failures(job_status)
+        job.record(job_status, failures)
+
+    if job.finished:
+        log.info(f'Zendesk job:<{job.job_id}> is {job.status}')
+        metrics.incr(f'zendesk.close_jobs.{job.status}')
+        return
+
+    if utcnow() - (job.sent_at or job.created_at) > JOB_POLL_TIMEOUT:
+        log.error(f'Gave up waiting for Zendesk job:<{job.job_id}>')
+        job.status = TicketCloseJob.FAILED
+        job.error = 'Zendesk did not finish the job within an hour.'
+        job.updated_at = utcnow()
+        job.save()
+        return
+
+    poll_ticket_close_job.apply_async(
+        (job.pk,), countdown=settings.ZENDESK_JOB_POLL_INTERVAL
+    )
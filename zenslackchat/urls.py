@@ -29,6 +29,8 @@ urlpatterns = [
 
     path('pagerduty/oauth/', views.pagerduty_oauth, name='pagerduty_oauth'),
 
+    path('metrics/', views.service_metrics, name='metrics'),
+
     path(
         'trigger/report/daily',
         views.trigger_daily_report,
@@ -1,3 +1,4 @@
+import hmac
 import json
 import pprint
 import logging
@@ -6,6 +7,8 @@ import requests
 from django.conf import settings
 from django.template import loader
 from django.http import HttpResponse
+from django.http import JsonResponse
+from django.http import HttpResponseForbidden
 from rest_framework import status
 from django.contrib import messages
 from django.shortcuts import redirect
@@ -13,6 +16,9 @@ from rest_framework.response import Response
 from django.contrib.auth.decorators import login_required
 
 from webapp.celery import run_daily_summary
+from zenslackchat import intake
+from zenslackchat import circuit
+from zenslackchat import metrics
 from zenslackchat.models import SlackApp
 from zenslackchat.models import ZendeskApp
 from zenslackchat.models import PagerDutyApp
@@ -166,6 +172,30 @@ def trigger_daily_report(request):
     return redirect('/')
 
 
+def service_metrics(request):
+    """Report the intake depth and ages, the circuit breaker states and the
+    recorded counters as JSON.
+
+    This is polled to autoscale the workers and alert on backlogs. The request
+    must have the header "Authorization: Bearer <METRICS_TOKEN>". The endpoint
+    is disabled if METRICS_TOKEN is not set.
+
+    """
+    log = logging.getLogger(__name__)
+
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    given = request.META.get('HTTP_AUTHORIZATION', '')
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(given, expected):
+        log.error("Metrics request rejected, bad or missing token.")
+        return HttpResponseForbidden()
+
+    return JsonResponse(dict(
+        intake=intake.stats(),
+        circuits=circuit.states(),
+        metrics=metrics.snapshot(),
+    ))
+
+
 # Restrict scope down to what I can interact with..
 ZENDESK_REQUESTED_SCOPES = "%20".join((
     # general read:
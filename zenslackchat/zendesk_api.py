@@ -4,6 +4,21 @@ Wrapper around Zendesk API using the Zenpy library.
 To simplify testing I keep these functions django free and pass in whats needed
 in arguments. This can then be easily faked/mocked.
 
+Each call to Zendesk goes through the zendesk circuit breaker. Transient
+errors are retried and while Zendesk is down CircuitOpen is raised at once.
+
+The async_ functions do the same as their blocking namesakes using an
+AsyncAPIClient e.g. from ZendeskApp.async_client(). They take the same
+arguments and return the same Zenpy objects, so a single event loop can work
+on many tickets at once. async_client() queries the database, so it is called
+with run_in_thread():
+
+    client = await run_in_thread(ZendeskApp.async_client)()
+    async with client:
+        tickets = await asyncio.gather(*[
+            async_get_ticket(client, ticket_id) for ticket_id in ticket_ids
+        ])
+
 Oisin Mulvihill
 2020-08-18
 
@@ -11,6 +26,8 @@ Oisin Mulvihill
 import logging
 
 from zenpy.lib import exception
+from zenslackchat.circuit import zendesk
+from zenslackchat.clients import AsyncAPIError
 from zenpy.lib.api_objects import Ticket
 from zenpy.lib.api_objects import Comment
 
@@ -25,6 +42,7 @@ def zendesk_ticket_url(zendesk_ticket_uri, ticket_id):
     return '/'.join([zendesk_ticket_uri.rstrip('/'), str(ticket_id)])
 
 
+@zendesk.protect()
 def get_ticket(client, ticket_id):
     """Recover the ticket by it's ID in zendesk.
 
@@ -48,6 +66,73 @@ def get_ticket(client, ticket_id):
     return returned
 
 
+def ticket_from(data):
+    """Return the Zenpy Ticket from a Zendesk API response.
+
+    As with tickets Zenpy returns, only fields changed from here on are sent
+    when the ticket is updated.
+
+    """
+    ticket = Ticket(**data['ticket'])
+    ticket._clean_dirty()
+    return ticket
+
+
+@zendesk.protect()
+async def async_get_ticket(client, ticket_id):
+    """Recover the ticket by it's ID in zendesk without blocking.
+
+    :param client: The AsyncAPIClient for Zendesk.
+
+    :param ticket_id: The Zendesk ID of the Ticket.
+
+    :returns: A Zenpy.Ticket instance or None if nothing was found.
+
+    """
+    log = logging.getLogger(__name__)
+
+    log.debug(f'Look for Ticket by is Zendesk ID:<{ticket_id}>')
+    try:
+        data = await client.get(f'tickets/{ticket_id}.json')
+
+    except AsyncAPIError as error:
+        if error.status != 404:
+            raise
+        log.debug(f'Ticket not found by is Zendesk ID:<{ticket_id}>')
+        return None
+
+    return ticket_from(data)
+
+
+def new_ticket(
+    chat_id, user_id, group_id, recipient_email, subject, slack_message_url
+):
+    """Return the Zenpy Ticket to create for a new user question.
+
+    See create_ticket() for the arguments.
+
+    """
+    # And assign this ticket to them. I can then later filter comments that
+    # should go to the ZenSlackChat webhook to just those in the ZenSlackChat
+    # group.
+    return Ticket(
+        type='ticket',
+        external_id=chat_id,
+        requester_id=user_id,
+        submitter_id=user_id,
+        assignee_id=user_id,
+        group_id=group_id,
+        subject=subject,
+        description=subject,
+        recipient=recipient_email,
+        comment=Comment(
+            body=f'This is the message on slack {slack_message_url}.',
+            author_id=user_id
+        )
+    )
+
+
+@zendesk.protect(idempotent=False)
 def create_ticket(
     client, chat_id, user_id, group_id, recipient_email, subject,
     slack_message_url
@@ -78,23 +163,9 @@ def create_ticket(
         f'user:<{user_id}> and group:<{group_id}> '
     )
 
-    # And assign this ticket to them. I can then later filter comments that
-    # should go to the ZenSlackChat webhook to just those in the ZenSlackChat
-    # group.
-    issue = Ticket(
-        type='ticket',
-        external_id=chat_id,
-        requestor_id=user_id,
-        submitter_id=user_id,
-        assingee_id=user_id,
-        group_id=group_id,
-        subject=subject,
-        description=subject,
-        recipient=recipient_email,
-        comment=Comment(
-            body=f'This is the message on slack {slack_message_url}.',
-            author_id=user_id
-        )
+    issue = new_ticket(
+        chat_id, user_id, group_id, recipient_email, subject,
+        slack_message_url
     )
 
     log.debug(f'Creating new ticket with subject:<{subject}>')
@@ -106,53 +177,327 @@ def create_ticket(
     return ticket_audit.ticket
 
 
-def add_comment(client, ticket, comment):
+@zendesk.protect(idempotent=False)
+async def async_create_ticket(
+    client, chat_id, user_id, group_id, recipient_email, subject,
+    slack_message_url
+):
+    """Create a new zendesk ticket without blocking.
+
+    :param client: The AsyncAPIClient for Zendesk.
+
+    The other arguments are the same as create_ticket().
+
+    :returns: A Zenpy.Ticket instance.
+
+    """
+    log = logging.getLogger(__name__)
+
+    issue = new_ticket(
+        chat_id, user_id, group_id, recipient_email, subject,
+        slack_message_url
+    )
+
+    log.debug(f'Creating new ticket with subject:<{subject}>')
+    data = await client.post(
+        'tickets.json', json={'ticket': issue.to_dict(serialize=True)}
+    )
+    ticket = ticket_from(data)
+    log.debug(f'Ticket for subject:<{subject}> created ok:<{ticket.id}>')
+
+    return ticket
+
+
+def ticket_change(ticket, **fields):
+    """Return a Zenpy Ticket holding only the given changes.
+
+    Updating with this sends just these fields, without fetching the ticket
+    first, e.g. {"ticket": {"id": 1430, "status": "closed"}}
+
+    :param ticket: The Zenpy Ticket instance or the Zendesk ticket ID.
+
+    :param fields: The fields to change.
+
+    """
+    return Ticket(id=int(getattr(ticket, 'id', ticket)), **fields)
+
+
+def is_closed_error(error):
+    """True if Zendesk refused a change because the ticket is closed.
+
+    Closed tickets can't be changed. Zendesk answers with a 422 along the
+    lines of "Status: closed prevents ticket update".
+
+    """
+    if isinstance(error, AsyncAPIError):
+        status, text = error.status, error.body
+
+    elif isinstance(error, exception.APIException):
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+        text = getattr(response, 'text', '')
+
+    else:
+        return False
+
+    return status == 422 and 'closed' in (text or '').lower()
+
+
+@zendesk.protect(idempotent=False)
+def add_comment(client, ticket, comment, author_id=None):
     """Add a new comment to an existing ticket.
 
+    Only the comment is sent, the ticket doesn't need recovering first. If
+    the ticket is closed Zendesk refuses the comment, see is_closed_error().
+
     :param client: The Zendesk web client to use.
 
-    :param ticket: The Zenpy Ticket instance to use.
+    :param ticket: The Zenpy Ticket instance or the Zendesk ticket ID.
 
     :param comment: The text for the Zendesk comment.
 
-    :returns: The update Zenpy Ticket instance.
+    :param author_id: The Zendesk user ID to write the comment as. If this is
+    not given the client's own user is asked for, which is an extra call to
+    Zendesk.
+
+    :returns: What Zenpy returns for the update.
 
     """
     log = logging.getLogger(__name__)
 
-    requestor = client.users.me()
-    log.debug(f'Recovered my requestor id:<{requestor.id}>')
+    if author_id is None:
+        author_id = client.users.me().id
+        log.debug(f'Recovered my requestor id:<{author_id}>')
 
-    log.debug(f'Adding comment to ticket:<{ticket.id}>')
-    ticket.comment = Comment(
-        body=comment,
-        author_id=requestor.id
+    change = ticket_change(
+        ticket, comment=Comment(body=comment, author_id=author_id)
     )
-    client.tickets.update(ticket)
-    log.debug(f'Added comment:<{comment}> to ticket:<{ticket.id}>')
+    log.debug(f'Adding comment to ticket:<{change.id}>')
+    returned = client.tickets.update(change)
+    log.debug(f'Added comment:<{comment}> to ticket:<{change.id}>')
+
+    return returned
 
-    return ticket
+
+@zendesk.protect(idempotent=False)
+async def async_add_comment(client, ticket, comment, author_id=None):
+    """Add a new comment to an existing ticket without blocking.
+
+    :param client: The AsyncAPIClient for Zendesk.
+
+    The other arguments are the same as add_comment().
+
+    :returns: The updated Zenpy Ticket instance.
+
+    """
+    log = logging.getLogger(__name__)
+
+    if author_id is None:
+        data = await client.get('users/me.json')
+        author_id = data['user']['id']
+        log.debug(f'Recovered my requestor id:<{author_id}>')
+
+    change = ticket_change(
+        ticket, comment=Comment(body=comment, author_id=author_id)
+    )
+    log.debug(f'Adding comment to ticket:<{change.id}>')
+    data = await client.put(
+        f'tickets/{change.id}.json',
+        json={'ticket': change.to_dict(serialize=True)}
+    )
+    log.debug(f'Added comment:<{comment}> to ticket:<{change.id}>')
+
+    return ticket_from(data)
+
+
+@zendesk.protect()
+def update_ticket(client, ticket):
+    """Save changes to a ticket.
+
+    :param client: The Zendesk web client to use.
+
+    :param ticket: The changed Zenpy Ticket instance e.g. from
+    ticket_change().
+
+    :returns: What Zenpy returns for the update.
+
+    """
+    return client.tickets.update(ticket)
+
+
+@zendesk.protect()
+async def async_update_ticket(client, ticket):
+    """Save changes to a ticket without blocking.
+
+    :param client: The AsyncAPIClient for Zendesk.
+
+    :param ticket: The changed Zenpy Ticket instance. Only the changed
+    fields are sent.
+
+    :returns: The updated Zenpy Ticket instance.
+
+    """
+    data = await client.put(
+        f'tickets/{ticket.id}.json',
+        json={'ticket': ticket.to_dict(serialize=True)}
+    )
+    return ticket_from(data)
+
+
+def assign_ticket(client, ticket_id, user_id, group_id, external_id):
+    """Assign a ticket to ZenSlackChat so its comments come back to Slack.
+
+    :param client: The Zendesk web client to use.
+
+    :param ticket_id: The Zendesk Ticket ID.
+
+    :param user_id: The Zendesk user to assign the ticket to.
+
+    :param group_id: The Zendesk group to assign the ticket to.
+
+    :param external_id: The Slack chat_id comments are routed back to.
+
+    :returns: What Zenpy returns for the update.
+
+    """
+    log = logging.getLogger(__name__)
+
+    log.debug(
+        f'Assigning ticket:<{ticket_id}> to User:<{user_id}> and '
+        f'Group:<{group_id}>'
+    )
+    return update_ticket(client, ticket_change(
+        ticket_id,
+        assignee_id=user_id,
+        group_id=group_id,
+        external_id=external_id,
+    ))
 
 
 def close_ticket(client, ticket_id):
     """Close a ticket in zendesk.
 
+    Only the status is sent. A ticket which is already closed is left as is.
+
     :param client: The Zendesk web client to use.
 
     :param ticket_id: The Zendesk Ticket ID.
 
-    :returns: None or Ticket instance closed.
+    :returns: What Zenpy returns for the update or None if the ticket was
+    already closed.
+
+    """
+    log = logging.getLogger(__name__)
+
+    log.debug(f'Closing ticket:<{ticket_id}>')
+    try:
+        returned = update_ticket(
+            client, ticket_change(ticket_id, status='closed')
+        )
+
+    except exception.APIException as error:
+        if not is_closed_error(error):
+            raise
+        log.warning(f'The ticket:<{ticket_id}> has already been closed!')
+        returned = None
+
+    else:
+        log.debug(f'Closed ticket:<{ticket_id}>')
+
+    return returned
+
+
+async def async_close_ticket(client, ticket_id):
+    """Close a ticket in zendesk without blocking.
+
+    :param client: The AsyncAPIClient for Zendesk.
+
+    :param ticket_id: The Zendesk Ticket ID.
+
+    :returns: The closed Zenpy Ticket instance or None if the ticket was
+    already closed.
 
     """
     log = logging.getLogger(__name__)
 
-    log.debug(f'Looking for ticket with ticket_id:<{ticket_id}>')
-    ticket = get_ticket(client, ticket_id)
-    if ticket.status == 'closed':
-        log.warn(f'The ticket:<{ticket.id}> has already been closed!')
+    log.debug(f'Closing ticket:<{ticket_id}>')
+    try:
+        returned = await async_update_ticket(
+            client, ticket_change(ticket_id, status='closed')
+        )
+
+    except AsyncAPIError as error:
+        if not is_closed_error(error):
+            raise
+        log.warning(f'The ticket:<{ticket_id}> has already been closed!')
+        returned = None
+
     else:
-        ticket.status = 'closed'
-        client.tickets.update(ticket)
-        log.debug(f'Closed ticket:<{ticket.id}> for ticket_id:<{ticket_id}>')
+        log.debug(f'Closed ticket:<{ticket_id}>')
 
-    return ticket
+    return returned
+
+
+# The most tickets Zendesk will update in one update_many job.
+UPDATE_MANY_LIMIT = 100
+
+
+@zendesk.protect()
+def close_tickets(client, ticket_ids):
+    """Close many tickets with one Zendesk background job.
+
+    :param client: The Zendesk web client to use.
+
+    :param ticket_ids: Up to UPDATE_MANY_LIMIT Zendesk Ticket IDs.
+
+    :returns: The Zenpy JobStatus for the job, see get_job_status().
+
+    Only the status of each ticket is sent. Tickets which are already closed
+    are reported as failures in the job's results.
+
+    """
+    if len(ticket_ids) > UPDATE_MANY_LIMIT:
+        raise ValueError(
+            f"Zendesk can only update {UPDATE_MANY_LIMIT} tickets at once."
+        )
+
+    log = logging.getLogger(__name__)
+    log.debug(f'Closing {len(ticket_ids)} tickets with update_many')
+
+    return client.tickets.update([
+        ticket_change(ticket_id, status='closed') for ticket_id in ticket_ids
+    ])
+
+
+@zendesk.protect()
+def get_job_status(client, job_id):
+    """Recover the progress of a Zendesk background job.
+
+    :param client: The Zendesk web client to use.
+
+    :param job_id: The JobStatus id.
+
+    :returns: A Zenpy JobStatus with status 'queued', 'working',
+    'completed', 'failed' or 'killed', its progress and total.
+
+    """
+    return client.job_status(id=job_id)
+
+
+def job_failures(job_status):
+    """Return the tickets a finished job couldn't change.
+
+    :param job_status: The Zenpy JobStatus.
+
+    :returns: A list of (ticket_id, reason) tuples.
+
+    """
+    failures = []
+    for result in job_status.results or []:
+        if not isinstance(result, dict):
+            result = result.to_dict()
+        if result.get('error') or result.get('success') is False:
+            reason = result.get('details') or result.get('error') or ''
+            failures.append((result.get('id'), reason))
+
+    return failures
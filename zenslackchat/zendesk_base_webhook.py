@@ -1,23 +1,46 @@
+import json
 import pprint
 import logging
 
-from rest_framework import status
-from rest_framework.views import APIView
-from rest_framework.response import Response
+import redis
+
+from django.http import HttpResponse
+from django.http import HttpResponseForbidden
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 
 from webapp import settings
+from zenslackchat import intake
+from zenslackchat import journal
+from zenslackchat import dead_letter
+from zenslackchat import routing
+from zenslackchat.async_views import AsyncView
+from zenslackchat.async_views import run_in_thread
 from zenslackchat.models import SlackApp
 from zenslackchat.models import ZendeskApp
+from zenslackchat.tasks import process_zendesk_webhook
 
 
-class BaseWebHook(APIView):
+@method_decorator(csrf_exempt, name='dispatch')
+class BaseWebHook(AsyncView):
     """Handle Zendesk Events with authentication token.
 
     Zendesk will need to have a HTTP notifier and trigger configured to
     forward us comments.
 
+    Sub-classes set name to a unique value which is used to find them again
+    when the event is handled by the celery workers.
+
+    This is an async view. The token is checked on the event loop and the
+    blocking handling runs on a thread pool.
+
     """
-    def post(self, request, *args, **kwargs):
+    name = 'base'
+
+    # How the event is treated when the intake is full.
+    priority = intake.NORMAL
+
+    async def post(self, request, *args, **kwargs):
         """Handle the POSTed request from Zendesk.
 
         This will verify the shared token. If this not found or not as expected
@@ -27,24 +50,37 @@ class BaseWebHook(APIView):
         will be logged instead. This is to prevent Zendesk from think our end
         point is broken and not sending any further events.
 
+        With ASYNC_EVENT_PROCESSING enabled only the token is checked here. The
+        event is queued and handled by the celery workers.
+
         """
         log = logging.getLogger(__name__)
-        response = Response('OK, Thanks', status=200)
+        response = HttpResponse('OK, Thanks', status=200)
+
+        try:
+            event = json.loads(request.body)
+
+        except ValueError:
+            event = None
+
+        if not isinstance(event, dict):
+            # No token to find, this will be rejected below.
+            event = {}
 
         if settings.DEBUG:
-            log.debug(f'Raw POSTed data:\n{pprint.pformat(request.data)}')
+            log.debug(f'Raw POSTed data:\n{pprint.pformat(event)}')
 
         try:
-            token = request.data.get(
+            token = event.get(
                 'token', '<token not set in webhook request body JSON>'
             )
 
             if token == settings.ZENDESK_WEBHOOK_TOKEN:
-                self.handle_event(
-                    request.data,
-                    slack_client=SlackApp.client(),
-                    zendesk_client=ZendeskApp.client()
-                )
+                if journal.enabled():
+                    await run_in_thread(journal.record)(
+                        self.name, request.body
+                    )
+                await run_in_thread(self.accept)(event)
 
             else:
                 log.error(
@@ -58,7 +94,7 @@ class BaseWebHook(APIView):
                         f"match ours '{settings.ZENDESK_WEBHOOK_TOKEN}'"
                     )
 
-                response = Response(status=status.HTTP_403_FORBIDDEN)
+                response = HttpResponseForbidden()
 
         except: # noqa: I'm logging rather than hidding.
             # I need to respond OK or I won't receive further events.
@@ -66,6 +102,111 @@ class BaseWebHook(APIView):
 
         return response
 
+    def accept(self, event):
+        """Pass the event through the intake once its token has been verified.
+
+        :param event: The POSTed dict of fields.
+
+        """
+        log = logging.getLogger(__name__)
+
+        item_id = intake.webhook_item_id(self.name, event)
+        event['intake_id'] = item_id
+        hold_key = self.queue_key(event)
+        decision = intake.admit(item_id, self.priority, hold_key=hold_key)
+
+        if decision == intake.DEFER:
+            try:
+                intake.defer(
+                    self.name, event, item_id, self.priority, hold_key
+                )
+                return
+
+            except redis.RedisError:
+                log.exception('Unable to defer, handling now:')
+
+        elif decision == intake.DROP:
+            return
+
+        self.submit(event)
+
+    def submit(self, event):
+        """Queue or handle an event which has been admitted by the intake.
+
+        With ASYNC_EVENT_PROCESSING enabled the event is queued for the celery
+        workers. If the broker is unavailable it is handled now rather than
+        lost.
+
+        :param event: The POSTed dict of fields.
+
+        """
+        log = logging.getLogger(__name__)
+
+        if settings.ASYNC_EVENT_PROCESSING:
+            try:
+                self.enqueue(event)
+
+            except:  # noqa
+                log.exception('Unable to queue, handling inline:')
+                self.process(event)
+
+        else:
+            self.process(event)
+
+    def queue_key(self, event):
+        """Return the key used to pick the ordered queue for the event.
+
+        Events with the same key are handled in the order received. By default
+        this is the Zendesk ticket ID.
+
+        """
+        return str(event.get('ticket_id', ''))
+
+    def enqueue(self, event):
+        """Hand the event to the celery workers to handle.
+
+        :param event: The POSTed dict of fields.
+
+        """
+        queue = routing.queue_for(self.queue_key(event))
+        process_zendesk_webhook.apply_async((self.name, event), queue=queue)
+
+    def process(self, event):
+        """Handle the event, keeping it for replay if this fails.
+
+        This is called inline by post() or from the celery worker when
+        ASYNC_EVENT_PROCESSING is enabled. Errors are raised for the caller
+        to log.
+
+        :param event: The POSTed dict of fields. The 'intake_id' added by
+        accept() is removed before the event is handled.
+
+        """
+        event = dict(event)
+        item_id = event.pop('intake_id', None)
+        try:
+            self.run(event)
+
+        except Exception as error:
+            dead_letter.record(self.name, event, error)
+            raise
+
+        finally:
+            if item_id:
+                intake.release(item_id)
+
+    def run(self, event):
+        """Create the clients and handle the event.
+
+        :param event: The POSTed dict of fields.
+
+        """
+        self.handle_event(
+            event,
+            slack_client=SlackApp.client(),
+            zendesk_client=ZendeskApp.client()
+        )
+
     def handle_event(self, event, slack_client, zendesk_client):
         """Over-ridden to implement event handling.
 
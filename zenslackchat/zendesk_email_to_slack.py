@@ -8,71 +8,136 @@ Oisin Mulvihill
 import logging
 
 from webapp import settings
+from zenslackchat.flow import Flow
+from zenslackchat.clients import real_client
 from zenslackchat.models import SlackApp
 from zenslackchat.models import ZendeskApp
 from zenslackchat.models import PagerDutyApp
 from zenslackchat.models import ZenSlackChat
+from zenslackchat.models import NotFoundError
 from zenslackchat.slack_api import message_url
 from zenslackchat.slack_api import create_thread
 from zenslackchat.zendesk_api import get_ticket
 from zenslackchat.zendesk_api import add_comment
-from zenslackchat.message_tools import message_issue_zendesk_url
-from zenslackchat.message_tools import message_who_is_on_call
+from zenslackchat.zendesk_api import assign_ticket
+from zenslackchat.message_tools import message_welcome
 
 
 def email_from_zendesk(event, slack_client, zendesk_client):
     """Open a ZenSlackChat issue and link it to the existing Zendesk Ticket.
 
+    The steps run as a Flow so the Slack and Zendesk calls which don't need
+    each other are made at the same time.
+
+    This is safe to replay. If the ticket's Slack thread and issue were made
+    before a failure only the Zendesk assignment and comment are sent again.
+
     """
     log = logging.getLogger(__name__)
 
+    # The steps make their calls on other threads:
+    slack_client = real_client(slack_client)
+    zendesk_client = real_client(zendesk_client)
     zendesk = ZendeskApp.client()
     slack = SlackApp.client()
     ticket_id = event['ticket_id']
     channel_id = settings.SRE_SUPPORT_CHANNEL
     user_id = settings.ZENDESK_USER_ID
     group_id = settings.ZENDESK_GROUP_ID
-    zendesk_ticket_uri = settings.ZENDESK_TICKET_URI
     slack_workspace_uri = settings.SLACK_WORKSPACE_URI
 
+    flow = Flow('email_intake')
+    flow.step('author_id', ZendeskApp.identity, uses_db=True)
+
+    try:
+        issue = ZenSlackChat.get_for_ticket(channel_id, ticket_id)
+
+    except NotFoundError:
+        issue = None
+
+    if issue:
+        # This is a replay of an email which failed after its thread was
+        # made. Only the Zendesk updates are sent again.
+        log.info(
+            f'Ticket:<{ticket_id}> is already on Slack:<{issue.chat_id}>'
+        )
+        flow.step('chat_id', lambda: issue.chat_id)
+
+    else:
+        add_thread_steps(flow, zendesk, slack, slack_client, ticket_id)
+
+    # Assign the ticket to ZenSlackChat group and user so comments will
+    # come back to us on slack. The external_id routes them to the thread.
+    flow.step(
+        'assign',
+        lambda chat_id: assign_ticket(
+            zendesk, ticket_id, user_id, group_id, chat_id
+        ),
+        after=('chat_id',)
+    )
+
+    # Indicate on the existing Zendesk ticket that the SRE team now knows
+    # about this issue. This waits for the assignment, as two updates to a
+    # ticket at once can conflict, and so the external_id is set first.
+    flow.step(
+        'comment',
+        lambda chat_id, assign, author_id: add_comment(
+            zendesk_client,
+            ticket_id,
+            'The SRE team is aware of your issue on Slack here '
+            f'{message_url(slack_workspace_uri, channel_id, chat_id)}.',
+            author_id=author_id
+        ),
+        after=('chat_id', 'assign', 'author_id')
+    )
+
+    flow.run()
+
+
+def add_thread_steps(flow, zendesk, slack, slack_client, ticket_id):
+    """Add the steps posting the ticket's Slack thread, opening the issue and
+    welcoming the user to email_from_zendesk's flow.
+
+    The last of these gives the 'chat_id' result the Zendesk steps need.
+
+    """
+    log = logging.getLogger(__name__)
+
+    channel_id = settings.SRE_SUPPORT_CHANNEL
+    zendesk_ticket_uri = settings.ZENDESK_TICKET_URI
+
     # Recover the zendesk issue the email has already created:
     log.debug(f'Recovering ticket from Zendesk:<{ticket_id}>')
-    ticket = get_ticket(zendesk, ticket_id)
+    flow.step('ticket', lambda: get_ticket(zendesk, ticket_id))
+    flow.step('on_call', PagerDutyApp.on_call, uses_db=True)
 
     # We need to create a new thread for this on the slack channel.
     # We will then add the usual message to this new thread.
-    log.debug(f'Success. Got Zendesk ticket<{ticket_id}>')
     # Include descrition as next comment before who is on call to slack
     # to give SREs more context:
-    message = f"(From Zendesk Email): {ticket.subject}"
-    chat_id = create_thread(slack, channel_id, message)
-
-    # Assign the ticket to ZenSlackChat group and user so comments will
-    # come back to us on slack.
-    log.debug(
-        f'Assigning Zendesk ticket to User:<{user_id}> and Group:{group_id}'
+    flow.step(
+        'chat_id',
+        lambda ticket: create_thread(
+            slack, channel_id, f"(From Zendesk Email): {ticket.subject}"
+        ),
+        after=('ticket',)
     )
-    # Assign to User/Group
-    ticket.assingee_id = user_id
-    ticket.group_id = group_id
-    # Set to route comments back from zendesk to slack:
-    ticket.external_id = chat_id
-    zendesk.tickets.update(ticket)
 
     # Store the zendesk ticket in our db and notify:
-    ZenSlackChat.open(channel_id, chat_id, ticket_id=ticket.id)
-    message_issue_zendesk_url(
-        slack_client, zendesk_ticket_uri, ticket_id, chat_id, channel_id
+    flow.step(
+        'open',
+        lambda ticket, chat_id: ZenSlackChat.open(
+            channel_id, chat_id, ticket_id=ticket.id,
+            ticket_status=ticket.status
+        ),
+        after=('ticket', 'chat_id'),
+        uses_db=True
     )
-    message_who_is_on_call(
-        PagerDutyApp.on_call(), slack_client, chat_id, channel_id
-    )
-
-    # Indicate on the existing Zendesk ticket that the SRE team now knows
-    # about this issue.
-    slack_chat_url = message_url(slack_workspace_uri, channel_id, chat_id)
-    add_comment(
-        zendesk_client,
-        ticket,
-        f'The SRE team is aware of your issue on Slack here {slack_chat_url}.'
+    flow.step(
+        'welcome',
+        lambda on_call, chat_id: message_welcome(
+            slack_client, zendesk_ticket_uri, ticket_id, chat_id, channel_id,
+            on_call=on_call
+        ),
+        after=('on_call', 'chat_id')
     )
@@ -1,3 +1,15 @@
+import logging
+
+import redis
+from django.utils.dateparse import parse_datetime
+
+from webapp import settings
+from zenslackchat import intake
+from zenslackchat import routing
+from zenslackchat import metrics
+from zenslackchat.models import ZenSlackChat
+from zenslackchat.comment_sync import mark_dirty
+from zenslackchat.tasks import sync_zendesk_comments
 from zenslackchat.zendesk_base_webhook import BaseWebHook
 from zenslackchat.zendesk_email_to_slack import email_from_zendesk
 from zenslackchat.zendesk_comments_to_slack import comments_from_zendesk
@@ -6,6 +18,83 @@ from zenslackchat.zendesk_comments_to_slack import comments_from_zendesk
 class CommentsWebHook(BaseWebHook):
     """Handle Zendesk Comment Events.
     """
+    name = 'comments'
+
+    def queue_key(self, event):
+        """Use the Slack thread so comments are ordered with its replies."""
+        return event.get('chat_id') or super().queue_key(event)
+
+    def accept(self, event):
+        """Mirror the ticket's status then pass the event on.
+
+        This is done as the event is received, as later triggers for the
+        ticket may be absorbed into one comment sync.
+
+        """
+        self.mirror_status(event)
+        super().accept(event)
+
+    def mirror_status(self, event):
+        """Record the ticket's status if the trigger sends it.
+
+        The trigger JSON body can include:
+
+            "status": "{{ticket.status}}",
+            "updated_at": "{{ticket.updated_at_with_timestamp}}"
+
+        """
+        log = logging.getLogger(__name__)
+
+        status = event.get('status')
+        if not status or not event.get('ticket_id'):
+            return
+
+        try:
+            updated_at = parse_datetime(event.get('updated_at') or '')
+
+        except ValueError:
+            updated_at = None
+
+        try:
+            ZenSlackChat.mirror_ticket(event['ticket_id'], status, updated_at)
+
+        except:  # noqa
+            log.exception(
+                f"Unable to mirror ticket:<{event['ticket_id']}> status: "
+            )
+
+    def enqueue(self, event):
+        """Schedule one comment sync for the ticket.
+
+        Further triggers for the ticket which arrive before the sync starts
+        are absorbed into it. Their place in the intake is released straight
+        away as only the scheduled sync is left to handle.
+
+        """
+        log = logging.getLogger(__name__)
+
+        ticket_id = event.get('ticket_id')
+        delay = settings.ZENDESK_COMMENT_SYNC_DELAY
+        try:
+            schedule = mark_dirty(ticket_id, ttl=delay + 300)
+
+        except redis.RedisError:
+            log.exception(f"Unable to mark ticket:<{ticket_id}> dirty: ")
+            schedule = True
+
+        if schedule:
+            sync_zendesk_comments.apply_async(
+                (event,),
+                countdown=delay,
+                queue=routing.queue_for(self.queue_key(event))
+            )
+
+        else:
+            log.debug(f"Sync already pending for ticket:<{ticket_id}>")
+            metrics.incr('zendesk.comments.absorbed')
+            if event.get('intake_id'):
+                intake.release(event['intake_id'])
+
     def handle_event(self, event, slack_client, zendesk_client):
         """Handle the comment trigger event we have been POSTed.
 
@@ -18,7 +107,18 @@ class CommentsWebHook(BaseWebHook):
 class EmailWebHook(BaseWebHook):
     """Handle Zendesk Email Events.
     """
+    name = 'email'
+
+    # Each email is a new issue.
+    priority = intake.HIGH
+
     def handle_event(self, event, slack_client, zendesk_client):
         """Handle an email created issue and create it on slack.
         """
         email_from_zendesk(event, slack_client, zendesk_client)
+
+
+# Used by the celery workers to find the webhook that received the event.
+WEBHOOKS = {
+    webhook.name: webhook for webhook in (CommentsWebHook, EmailWebHook)
+}